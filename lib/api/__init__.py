@@ -4,5 +4,10 @@ if typing.TYPE_CHECKING:
 
 def init_app(app: 'fastapi.FastAPI', api_router: 'fastapi.APIRouter'):
     from .datalake import router as datalake_router
+    from ..datalake import snapshots
+    from ..models.config import DatalakeConfig
+    from lib.apibuilder.config import get_settings
 
+    # Removes the temporary files and uncommitted parts of writers that crashed
+    snapshots.recover(get_settings(DatalakeConfig))
     api_router.include_router(datalake_router, prefix="/datalake")
\ No newline at end of file
@@ -1,9 +1,14 @@
 import typing
 import fastapi
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from ..models.config import DatalakeConfig
 from lib.apibuilder.config import get_settings
+from lib.apibuilder.exceptions import NavigatorAPIException, TracebackSkip, ValueValidationError
 from pydantic import BaseModel
-from pathlib import Path
+from ..datalake import catalog, export, ingest, jobs, query, retention, snapshots, storage, upload
+from ..datalake.cache import get_info_cache
+from ..datalake.executor import get_executor
 
 router = fastapi.APIRouter(
     prefix="",
@@ -11,18 +16,62 @@ router = fastapi.APIRouter(
     responses={404: {"description": "Not Found"}}
 )
 
+class FileUploadedResponse(BaseModel):
+    filename: typing.Optional[str]
+    size_uploaded: float
+    rows_ingested: int
+    bytes_written: int
+    seconds: float
+
 class UploadedResponse(BaseModel):
     size_uploaded: float
+    rows_ingested: int
+    bytes_written: int
+    files: typing.List[FileUploadedResponse]
 
 @router.post("/upload")
 async def upload_to_datalake(files: typing.List[fastapi.UploadFile])->UploadedResponse:
     config: DatalakeConfig = get_settings(DatalakeConfig)
-    # TODO check file type is one of supported types
-    # TODO read data and store to data directory
-        # BONUS What did you store the data as and why? (Answer as a comment)
-        # BONUS what can be done to optimise calls to the info request
+    file_types = [ingest.get_file_type(file.filename, config.supported_types) for file in files]
+    # Uploads are read in chunks and flushed to the lake in bounded batches so a file is never held in memory
+    # Data is stored column wise in typed binary files partitioned by day and key (see lib.datalake.storage).
+    # Numbers are stored as fixed width binary so they never need to be parsed again and /info only reads
+    # the partitions matching the date and key and the single column it is asked about.
+    # Summary statistics of every numeric column are computed at upload time and stored next to each part
+    # so /info merges a handful of numbers per part instead of rescanning the data.
     # NOTE we can assume all data uploaded to this endpoint has the same schema. Bonus to assume a schema and enforce it
-    return UploadedResponse(size_uploaded=sum(file.size for file in files))
+    # The schema is inferred from the first upload and enforced on every later one (see lib.datalake.schema)
+    # Uploads are append only: every batch is written as new immutable parts (fsynced and renamed into place) and
+    # committed by adding them to the catalog. Existing parts are never rewritten, merging them is left to /optimise
+    # The files of an upload are ingested in parallel worker processes and committed together once all are written
+    # (see lib.datalake.upload). Ingestion runs in the bounded executor so the event loop keeps serving other requests
+    executor = get_executor()
+    results = await executor.run(upload.ingest_files, config, [(file.filename, file.file, file_type) for file, file_type in zip(files, file_types)])
+    get_info_cache().invalidate({(part.date, part.key) for result in results for part in result.parts})
+    return UploadedResponse(
+        size_uploaded=sum(result.bytes_read for result in results),
+        rows_ingested=sum(result.rows for result in results),
+        bytes_written=sum(result.bytes_written for result in results),
+        files=[
+            FileUploadedResponse(
+                filename=result.filename, size_uploaded=result.bytes_read, rows_ingested=result.rows,
+                bytes_written=result.bytes_written, seconds=result.seconds
+            )
+            for result in results
+        ]
+    )
+
+
+class SchemaResponse(BaseModel):
+    columns: typing.Dict[str, str]
+
+# Handlers reading the catalog or job files are plain functions (or await run_in_threadpool) so the first connection
+# of a process, which may rebuild the catalog, never blocks the event loop
+@router.get("/schema")
+def get_schema() -> SchemaResponse:
+    config: DatalakeConfig = get_settings(DatalakeConfig)
+    with catalog.connect(config) as connection:
+        return SchemaResponse(columns=catalog.get_columns(connection))
 
 
 class InfoResponse(BaseModel):
@@ -31,42 +80,200 @@ class InfoResponse(BaseModel):
     mean_value: float
     number_of_files: int
     total_records: int
+    p50: typing.Optional[float] = None
+    p95: typing.Optional[float] = None
+    p99: typing.Optional[float] = None
+    distinct_count: typing.Optional[int] = None
 
 @router.get("/info")
-async def info(column: str, date: typing.Optional[str]=None, key: typing.Optional[str]=None) -> InfoResponse:
+async def info(
+    column: str,
+    date: typing.Optional[str]=None,
+    key: typing.Optional[str]=None,
+    start: typing.Optional[str]=None,
+    end: typing.Optional[str]=None,
+    approximate: bool=False
+) -> InfoResponse:
     config: DatalakeConfig = get_settings(DatalakeConfig)
-    # TODO return statistics for uploaded data for the given date (single day) and key.
     # NOTE if no key or date given the statistics should be given for all files
+    # start and end (dates or timestamps) limit the statistics to the rows with start <= timestamp < end
+    # approximate adds the p50/p95/p99 quantiles and distinct count of the values, merged from the sketches stored
+    # with every part (see lib.datalake.sketches for their accuracy)
+    if date is not None:
+        date = storage.parse_date(date).isoformat()
+    start_time = storage.parse_cutoff(start) if start is not None else None
+    end_time = storage.parse_cutoff(end) if end is not None else None
+    cache = get_info_cache()
+    cache_key = (column, date, key, start_time and start_time.isoformat(), end_time and end_time.isoformat(), approximate)
+    # Cached results are checked against the catalog so writes made by other api processes are seen
+    generation = cache.generation
+    state = await run_in_threadpool(_partitions_state, config, date, key)
+    summary = cache.get(cache_key, state)
+    if summary is None:
+        executor = get_executor()
+        summary = await executor.run(query.summarise_column, config, column, date, key, start_time, end_time, approximate)
+        cache.put(cache_key, summary, generation, state)
+    return InfoResponse(**summary._asdict())
+
+def _partitions_state(config: DatalakeConfig, date: typing.Optional[str], key: typing.Optional[str]) -> typing.Tuple[int, int]:
+    with catalog.connect(config) as connection:
+        return catalog.partitions_state(connection, date, key)
+
+
+class ValueStatsResponse(BaseModel):
+    min_value: float
+    max_value: float
+    mean_value: float
+    count: int
+    p50: typing.Optional[float] = None
+    p95: typing.Optional[float] = None
+    p99: typing.Optional[float] = None
+    distinct_count: typing.Optional[int] = None
+
+class GroupStatsResponse(BaseModel):
+    date: typing.Optional[str]
+    key: typing.Optional[str]
+    number_of_files: int
+    total_records: int
+    columns: typing.Dict[str, ValueStatsResponse]
 
-    return InfoResponse(
-        min_value=0,  # TODO Calculate me
-        max_value=0,  # TODO Calculate me
-        mean_value=0,  # TODO Calculate me
-        number_of_files=0,  # Number of files scanned
-        total_records=0,  # Number of records matching criteria
+class StatsResponse(BaseModel):
+    groups: typing.List[GroupStatsResponse]
+
+@router.get("/stats")
+async def stats(
+    column: typing.List[str] = fastapi.Query(...),
+    group_by: typing.List[str] = fastapi.Query([]),
+    date: typing.Optional[str]=None,
+    key: typing.Optional[str]=None,
+    start: typing.Optional[str]=None,
+    end: typing.Optional[str]=None,
+    approximate: bool=False
+) -> StatsResponse:
+    config: DatalakeConfig = get_settings(DatalakeConfig)
+    # Statistics of every column (repeat column=) computed in a single pass over the parts, optionally grouped by
+    # day and/or key (group_by=date, group_by=key). Filters and approximate are the same as /info
+    start_time = storage.parse_cutoff(start) if start is not None else None
+    end_time = storage.parse_cutoff(end) if end is not None else None
+    executor = get_executor()
+    groups = await executor.run(query.summarise_columns, config, column, group_by, date, key, start_time, end_time, approximate)
+    return StatsResponse(groups=[
+        GroupStatsResponse(**{**group._asdict(), "columns": {name: ValueStatsResponse(**summary._asdict()) for name, summary in group.columns.items()}})
+        for group in groups
+    ])
+
+
+@router.get("/export")
+async def export_rows(
+    export_format: str = fastapi.Query("ndjson", alias="format"),
+    column: typing.Optional[typing.List[str]] = fastapi.Query(None),
+    date: typing.Optional[str]=None,
+    key: typing.Optional[str]=None,
+    start: typing.Optional[str]=None,
+    end: typing.Optional[str]=None
+) -> StreamingResponse:
+    config: DatalakeConfig = get_settings(DatalakeConfig)
+    # Streams the raw rows of the date and key with start <= timestamp < end as ndjson or csv, projected on the
+    # given columns (repeat column=, all columns if not given). Rows are read part by part in chunks so memory
+    # stays constant, and the chunks are produced in the bounded executor only as fast as the client reads them.
+    # The export holds an admission slot of the executor until the stream ends
+    export_format = export.get_format(export_format)
+    if date is not None:
+        date = storage.parse_date(date).isoformat()
+    column_types = await run_in_threadpool(export.export_columns, config, column)
+    stream = get_executor().stream(export.export(
+        config, export_format, column_types, date, key,
+        storage.parse_cutoff(start) if start is not None else None,
+        storage.parse_cutoff(end) if end is not None else None
+    ))
+    return StreamingResponse(
+        stream, media_type=export.MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="export.{export_format}"'}
     )
 
+
+class CacheStatsResponse(BaseModel):
+    hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+    entries: int
+    size_bytes: int
+
+@router.get("/cache")
+async def cache_stats() -> CacheStatsResponse:
+    return CacheStatsResponse(**get_info_cache().stats())
+
 class SizeResponse(BaseModel):
     size_before: float
     size_after: float
 
-@router.post("/optimise")
-async def upload_to_datalake()->SizeResponse:
+class OptimiseResponse(SizeResponse):
+    bytes_saved: float
+    files_before: int
+    files_after: int
+    partitions_compacted: int
+    partitions_rolled_up: int = 0
+
+class JobResponse(BaseModel):
+    id: str
+    kind: str
+    status: str
+    partitions_done: int = 0
+    partitions_total: int = 0
+    bytes_rewritten: int = 0
+    result: typing.Optional[OptimiseResponse] = None
+    error: typing.Optional[str] = None
+
+def _job_response(job: typing.Dict[str, typing.Any]) -> JobResponse:
+    return JobResponse(**job["progress"], **{field: value for field, value in job.items() if field != "progress"})
+
+@router.post("/optimise", status_code=202)
+def optimise()->JobResponse:
     config: DatalakeConfig = get_settings(DatalakeConfig)
+    # Uploads create many small parts through the day. Compaction merges the parts of each day/key partition
+    # into a few large compressed parts sorted on the timeseries column with rebuilt statistics. The hourly and
+    # daily rollups of the partitions changed since the last run are then rebuilt (see lib.datalake.rollups)
+    # The work runs in a process pool so the event loop stays free. Poll /jobs/{id} for progress and the result
+    job = jobs.submit(
+        config, "optimise", jobs.optimise,
+        on_done=lambda result: get_info_cache().invalidate(tuple(partition) for partition in result["partitions"])
+    )
+    return _job_response(job)
 
-    root_directory = Path(config.data_directory)
-    size_before = sum(f.stat().st_size for f in root_directory.glob('**/*') if f.is_file())
-    # TODO Assuming the upload endpoint is used multiple times a day what can be done to optimise the datalake
-    size_after = sum(f.stat().st_size for f in root_directory.glob('**/*') if f.is_file())
-    return SizeResponse(size_before=size_before, size_after=size_after)
+@router.get("/jobs/{job_id}")
+def get_job(job_id: str) -> JobResponse:
+    config: DatalakeConfig = get_settings(DatalakeConfig)
+    job = jobs.get_job(config, job_id)
+    if job is None:
+        raise NavigatorAPIException("Job not found", 404, f"No job with id {job_id}", TracebackSkip, hide_logs=True)
+    return _job_response(job)
 
 @router.delete("/")
-async def delete(date: typing.Optional[str]=None, key: typing.Optional[str]=None) -> SizeResponse:
+async def delete(
+    background_tasks: fastapi.BackgroundTasks,
+    date: typing.Optional[str]=None,
+    key: typing.Optional[str]=None,
+    start: typing.Optional[str]=None,
+    end: typing.Optional[str]=None
+) -> SizeResponse:
     config: DatalakeConfig = get_settings(DatalakeConfig)
-    root_directory = Path(config.data_directory)
-    size_before = sum(f.stat().st_size for f in root_directory.glob('**/*') if f.is_file())
-    # TODO delete data matching the given criteria. Note this time all data before the given date should be deleted
-    # NOTE if no key or date given the data should be deleted for all files
-
-    size_after = sum(f.stat().st_size for f in root_directory.glob('**/*') if f.is_file())
-    return SizeResponse(size_before=size_before, size_after=size_after)
\ No newline at end of file
+    # NOTE all data before the given date (or timestamp) is deleted. If no key or date given the data is deleted for all files
+    # start and end (dates or timestamps) delete the rows with start <= timestamp < end instead
+    # Whole partitions are removed from the catalog without being read and sizes come from the catalog so no
+    # directory walk is needed. Files are removed in the background once no running query can still read them
+    if date is not None and end is not None:
+        raise ValueValidationError(found="date and end", expected="only one of date and end", user_message="Invalid time range")
+    if end is None:
+        end = date
+    executor = get_executor()
+    result = await executor.run(
+        retention.delete_range,
+        config,
+        storage.parse_cutoff(start) if start is not None else None,
+        storage.parse_cutoff(end) if end is not None else None,
+        key
+    )
+    get_info_cache().invalidate(result.partitions)
+    background_tasks.add_task(snapshots.collect_garbage, config)
+    return SizeResponse(size_before=result.size_before, size_after=result.size_after)
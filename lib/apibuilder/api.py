@@ -1,7 +1,7 @@
 import typing
 if typing.TYPE_CHECKING:
     import fastapi
-    from .config.api import StaticPathConfigs, SecurityHeadersConfig, CORSConfig
+    from .config.api import StaticPathConfigs, SecurityHeadersConfig, CORSConfig, MetricsConfig
 import logging
 
 IS_RUNNING_AS_API = False
@@ -124,6 +124,11 @@ def add_security_headers_middleware(app: "fastapi.FastAPI", security_headers_con
         **conf_dict
     )
 
+def add_metrics_middleware(app: "fastapi.FastAPI", metrics_config: "MetricsConfig"):
+    # Added after the other middleware so request latencies include them
+    from .metrics import add_metrics
+    add_metrics(app, metrics_config)
+
 def init_app():
     global IS_RUNNING_AS_API
     IS_RUNNING_AS_API = True
@@ -144,6 +149,7 @@ def init_app():
     configure_logging(app_settings.logging.dict())
     add_cors_middleware(app, api_settings.cors)
     add_security_headers_middleware(app, api_settings.security_headers)
+    add_metrics_middleware(app, api_settings.metrics)
 
     api_router = fastapi.APIRouter()
     for route_module in route_modules:
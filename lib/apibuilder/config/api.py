@@ -53,6 +53,13 @@ class StaticPathConfig(pydantic.BaseModel):
     check_dir: bool = True
     override_404_file: typing.Optional[str] = None
 
+class MetricsConfig(pydantic.BaseModel):
+    enabled: bool = True
+    # Prometheus text format endpoint, mounted outside of the api route prefix
+    path: str = "/metrics"
+    # Upper bounds in seconds of the buckets of the request latency histograms
+    latency_buckets: typing.List[float] = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
 class APIRouteConfig(pydantic.BaseModel):
     class Config:
         extra=pydantic.Extra.allow
@@ -67,5 +74,6 @@ class APISettings(pydantic.BaseModel):
     server: ServerConfig = ServerConfig()
     cors: CORSConfig = CORSConfig()
     security_headers: SecurityHeadersConfig = SecurityHeadersConfig()
+    metrics: MetricsConfig = MetricsConfig()
     static_paths: StaticPathConfigs = pydantic.Field(default_factory=list)
     include_core: bool = True
\ No newline at end of file
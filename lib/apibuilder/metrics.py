@@ -0,0 +1,296 @@
+"""Counters and histograms exposed in the Prometheus text format.
+
+Metrics are kept per process. Work done in a process pool is recorded in the worker and merged into the
+calling process with `run_recorded` / `merge` so it shows up on the /metrics endpoint of the api.
+"""
+import bisect
+import math
+import threading
+import time
+import typing
+from contextlib import contextmanager
+
+if typing.TYPE_CHECKING:
+    import fastapi
+    from .config.api import MetricsConfig
+
+LabelValues = typing.Tuple[str, ...]
+# (metric name, label values, state) of every series of a registry, see Registry.snapshot
+Samples = typing.List[typing.Tuple[str, LabelValues, typing.Any]]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: typing.Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._series: typing.Dict[LabelValues, typing.Any] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str) -> typing.Any:
+        if len(values) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {values}")
+        values = tuple(str(value) for value in values)
+        series = self._series.get(values)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(values, self._new_series())
+        return series
+
+    def _new_series(self) -> typing.Any:
+        raise NotImplementedError
+
+    def samples(self) -> typing.Iterator[typing.Tuple[str, LabelValues, typing.Any]]:
+        """(suffix, label values, value) of every exposed line"""
+        raise NotImplementedError
+
+
+class _CounterSeries:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self, lock: threading.Lock):
+        self.value = 0.0
+        self._lock = lock
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_series(self) -> _CounterSeries:
+        return _CounterSeries(self._lock)
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for values, series in list(self._series.items()):
+            yield "", values, series.value
+
+    def state(self, series: _CounterSeries) -> float:
+        return series.value
+
+    def merge(self, series: _CounterSeries, state: float):
+        series.inc(state)
+
+
+class _HistogramSeries:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets: typing.Tuple[float, ...], lock: threading.Lock):
+        self.buckets = buckets
+        # Observations per bucket (not cumulative), the last one counts the values above every bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = lock
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self) -> typing.Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: typing.Sequence[str] = (), buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_series(self) -> _HistogramSeries:
+        return _HistogramSeries(self.buckets, self._lock)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self):
+        for values, series in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series.counts):
+                cumulative += count
+                yield "_bucket", values + (_format(bound),), cumulative
+            yield "_sum", values, series.sum
+            yield "_count", values, series.count
+
+    def state(self, series: _HistogramSeries) -> typing.Tuple[typing.List[int], float, int]:
+        return list(series.counts), series.sum, series.count
+
+    def merge(self, series: _HistogramSeries, state: typing.Tuple[typing.List[int], float, int]):
+        counts, total, count = state
+        with self._lock:
+            for index, bucket_count in enumerate(counts):
+                series.counts[index] += bucket_count
+            series.sum += total
+            series.count += count
+
+
+class CallbackMetric(Metric):
+    """A metric read from callback() when exposed, e.g. counters kept by another object.
+
+    callback returns the value of every series by label values. It is not merged across processes.
+    """
+    def __init__(self, name: str, documentation: str, callback: typing.Callable[[], typing.Dict[LabelValues, float]], kind: str = "gauge", labels: typing.Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.kind = kind
+        self.callback = callback
+
+    def samples(self):
+        for values, value in self.callback().items():
+            yield "", values, value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: typing.Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """Adds the metric, or returns the metric already registered under its name"""
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.label_names != metric.label_names:
+                    raise ValueError(f"Metric {metric.name} is already registered with different labels or type")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            label_names = metric.label_names
+            for suffix, values, value in metric.samples():
+                names = label_names + ("le",) if suffix == "_bucket" else label_names
+                labels = ",".join(f'{name}="{_escape_label(value)}"' for name, value in zip(names, values))
+                lines.append(f"{metric.name}{suffix}{{{labels}}} {_format(value)}" if labels else f"{metric.name}{suffix} {_format(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Samples:
+        return [
+            (metric.name, values, metric.state(series))
+            for metric in list(self._metrics.values()) if isinstance(metric, (Counter, Histogram))
+            for values, series in list(metric._series.items())
+        ]
+
+    def merge(self, samples: Samples):
+        for name, values, state in samples:
+            metric = self._metrics.get(name)
+            if isinstance(metric, (Counter, Histogram)):
+                metric.merge(metric.labels(*values), state)
+
+    def reset(self):
+        for metric in list(self._metrics.values()):
+            if isinstance(metric, (Counter, Histogram)):
+                with metric._lock:
+                    metric._series.clear()
+
+
+REGISTRY = Registry()
+
+def counter(name: str, documentation: str, labels: typing.Sequence[str] = ()) -> Counter:
+    return typing.cast(Counter, REGISTRY.register(Counter(name, documentation, labels)))
+
+def histogram(name: str, documentation: str, labels: typing.Sequence[str] = (), buckets: typing.Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return typing.cast(Histogram, REGISTRY.register(Histogram(name, documentation, labels, buckets)))
+
+def callback(name: str, documentation: str, fn: typing.Callable[[], typing.Dict[LabelValues, float]], kind: str = "gauge", labels: typing.Sequence[str] = ()) -> CallbackMetric:
+    return typing.cast(CallbackMetric, REGISTRY.register(CallbackMetric(name, documentation, fn, kind, labels)))
+
+
+def run_recorded(fn: typing.Callable[..., typing.Any], *args: typing.Any) -> typing.Tuple[typing.Any, Samples]:
+    """Runs fn(*args) in a pool worker and returns its result with the metrics it recorded (see Registry.merge).
+
+    Workers only run recorded tasks so the registry of the worker is reset before each one.
+    """
+    REGISTRY.reset()
+    result = fn(*args)
+    return result, REGISTRY.snapshot()
+
+def merge(samples: Samples):
+    REGISTRY.merge(samples)
+
+
+def _format(value: float) -> str:
+    if value == math.inf: return "+Inf"
+    if value == -math.inf: return "-Inf"
+    if isinstance(value, float) and value.is_integer(): return str(int(value))
+    return repr(value)
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the latency of every request by method, route and status.
+
+    Requests are labelled with the path template of the route they matched (e.g. /api/jobs/{job_id}) so the
+    number of series stays bounded. The latency includes sending the body of streaming responses.
+    """
+    def __init__(self, app, buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        self.app = app
+        self.latency = histogram(
+            "http_request_duration_seconds", "Latency of http requests by method, route and status",
+            ("method", "route", "status"), buckets
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.latency.labels(scope["method"], _route_path(scope), str(status)).observe(time.perf_counter() - started)
+
+
+def _route_path(scope) -> str:
+    from starlette.routing import Match
+    # Api routes record themselves in the scope, other routes (docs, static files) are matched again
+    route = scope.get("route")
+    if route is None:
+        for candidate in getattr(scope.get("app"), "routes", ()):
+            if candidate.matches(scope)[0] == Match.FULL:
+                route = candidate
+                break
+    return getattr(route, "path", None) or "unmatched"
+
+
+def add_metrics(app: "fastapi.FastAPI", metrics_config: "MetricsConfig"):
+    if not metrics_config.enabled: return
+    from starlette.responses import Response
+
+    async def metrics_endpoint() -> Response:
+        return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+    app.add_middleware(MetricsMiddleware, buckets=metrics_config.latency_buckets)
+    app.add_api_route(metrics_config.path, metrics_endpoint, methods=["GET"], include_in_schema=False)
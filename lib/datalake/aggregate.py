@@ -0,0 +1,151 @@
+import os
+import typing
+from functools import lru_cache
+from pathlib import Path
+import numpy as np
+from . import columns, instrumentation, storage
+from .executor import ProcessPool
+from .sketches import ColumnSketch
+from .stats import ColumnStats
+
+if typing.TYPE_CHECKING:
+    from ..models.config import DatalakeConfig
+
+
+def iter_column_chunks(
+    part: storage.Part, column: str, chunk_rows: int, rows: typing.Union[slice, np.ndarray, None] = None
+) -> typing.Iterator[np.ndarray]:
+    """Yields a fixed width numeric column of a part (or the selected rows of it) as arrays of at most chunk_rows values.
+
+    Whole columns and slices are views of the stored column.
+    """
+    values = part.map_column(column)
+    if rows is not None:
+        values = values[rows]
+    for offset in range(0, len(values), chunk_rows):
+        yield values[offset:offset + chunk_rows]
+
+
+def scan_column(
+    part: storage.Part,
+    column: str,
+    chunk_rows: int,
+    rows: typing.Union[slice, np.ndarray, None] = None,
+    sketch: typing.Optional[ColumnSketch] = None
+) -> ColumnStats:
+    """Computes the statistics of a numeric column by reducing it chunk by chunk, adding the values to sketch if given"""
+    stats = ColumnStats()
+    for chunk in iter_column_chunks(part, column, chunk_rows, rows):
+        stats.merge(ColumnStats.from_array(chunk))
+        if sketch is not None:
+            sketch.quantiles.add_array(chunk)
+            sketch.distinct.add_array(chunk)
+    return stats
+
+
+class ScanResult(typing.NamedTuple):
+    # Parts and rows within the time range
+    files: int
+    rows: int
+    # Statistics of each numeric column scanned
+    stats: typing.Dict[str, ColumnStats]
+    # Sketches of the columns of columns.SKETCH_TYPES if requested
+    sketches: typing.Dict[str, ColumnSketch] = {}
+
+    def merge(self, other: "ScanResult") -> "ScanResult":
+        stats = {column: ColumnStats().merge(column_stats) for column, column_stats in self.stats.items()}
+        for column, column_stats in other.stats.items():
+            stats.setdefault(column, ColumnStats()).merge(column_stats)
+        sketches = {column: ColumnSketch().merge(sketch) for column, sketch in self.sketches.items()}
+        for column, sketch in other.sketches.items():
+            sketches.setdefault(column, ColumnSketch()).merge(sketch)
+        return ScanResult(self.files + other.files, self.rows + other.rows, stats, sketches)
+
+# Bounds in epoch microseconds, None if unbounded
+TimeRange = typing.Tuple[typing.Optional[int], typing.Optional[int]]
+# Values of the group by fields (PartInfo fields such as date and key) shared by the parts of a group
+GroupKey = typing.Tuple[str, ...]
+
+def group_key(info: storage.PartInfo, group_by: typing.Sequence[str]) -> GroupKey:
+    return tuple(getattr(info, field) for field in group_by)
+
+
+def _scan_parts(
+    data_directory: str,
+    parts: typing.List[storage.PartInfo],
+    scan_columns: typing.List[str],
+    chunk_rows: int,
+    timeseries_column: str,
+    time_range: typing.Optional[TimeRange],
+    group_by: typing.Sequence[str],
+    with_sketches: bool
+) -> typing.Dict[GroupKey, ScanResult]:
+    root_directory = Path(data_directory)
+    results: typing.Dict[GroupKey, ScanResult] = {}
+    for info in parts:
+        part = storage.Part.from_info(root_directory, info)
+        rows = None if time_range is None else part.select_rows(timeseries_column, *time_range)
+        if rows is None:
+            selected = part.rows
+        elif isinstance(rows, slice):
+            selected = rows.stop - rows.start
+        else:
+            selected = len(rows)
+        if not selected: continue
+        # Every column is read in the same pass over the part, sharing the row selection
+        stats, sketches = {}, {}
+        size = 0
+        for column in scan_columns:
+            column_type = part.column_type(column)
+            if column_type not in columns.NUMERIC_TYPES: continue
+            size += selected * np.dtype(columns.DTYPES[column_type]).itemsize
+            sketch = None
+            if with_sketches and column_type in columns.SKETCH_TYPES:
+                sketch = sketches[column] = ColumnSketch()
+            stats[column] = scan_column(part, column, chunk_rows, rows, sketch).scaled(columns.stats_scale(column_type))
+        instrumentation.read(selected, size)
+        key = group_key(info, group_by)
+        result = ScanResult(1, selected, stats, sketches)
+        results[key] = results[key].merge(result) if key in results else result
+    return results
+
+
+def merge_groups(results: typing.Iterable[typing.Dict[GroupKey, ScanResult]]) -> typing.Dict[GroupKey, ScanResult]:
+    merged: typing.Dict[GroupKey, ScanResult] = {}
+    for groups in results:
+        for key, result in groups.items():
+            merged[key] = merged[key].merge(result) if key in merged else result
+    return merged
+
+
+def scan_workers(config: "DatalakeConfig") -> int:
+    return config.scan_workers or os.cpu_count() or 1
+
+@lru_cache(maxsize=1)
+def _get_executor(max_workers: int) -> ProcessPool:
+    return ProcessPool(max_workers)
+
+
+def scan(
+    config: "DatalakeConfig",
+    parts: typing.List[storage.PartInfo],
+    scan_columns: typing.List[str],
+    time_range: typing.Optional[TimeRange] = None,
+    group_by: typing.Sequence[str] = (),
+    with_sketches: bool = False
+) -> typing.Dict[GroupKey, ScanResult]:
+    """Computes the statistics (and sketches if with_sketches) of columns over the parts (or their rows within the
+    time range) from the stored data.
+
+    Results are grouped on the group_by fields of the parts. Timestamps are reported in seconds. Large scans are
+    split into scan_partitions groups of parts reduced in parallel by a pool of scan_workers processes.
+    """
+    arguments = (scan_columns, config.scan_chunk_rows, config.timeseries_column, time_range, tuple(group_by), with_sketches)
+    workers = scan_workers(config)
+    if workers <= 1 or len(parts) < config.scan_parallel_min_parts:
+        return _scan_parts(config.data_directory, parts, *arguments)
+    # Parts are dealt round robin so large and small parts (which tend to be grouped by date) are spread evenly
+    groups = min(config.scan_partitions or workers * 4, len(parts))
+    executor = _get_executor(workers)
+    futures = [instrumentation.submit(executor, _scan_parts, config.data_directory, parts[group::groups], *arguments) for group in range(groups)]
+    return merge_groups(instrumentation.result(future) for future in futures)
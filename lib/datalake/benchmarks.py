@@ -0,0 +1,256 @@
+"""Micro benchmarks of the storage engine on synthetic IoT data.
+
+Run with ``python -m lib.datalake.benchmarks <benchmark> [--rows N]``.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import tempfile
+import time
+import typing
+from pathlib import Path
+import numpy as np
+from . import aggregate, catalog, columns, ingest, sketches, storage
+
+
+def synthetic_data(rows: int, keys: int = 100, seed: int = 0) -> typing.Dict[str, storage.TypedColumn]:
+    """Readings of `keys` devices reporting every few seconds over a day"""
+    rng = np.random.default_rng(seed)
+    start = columns.to_micros(columns.parse_timestamp("2023-01-01T00:00:00"))
+    timestamps = np.sort(start + rng.integers(0, 24 * 60 * 60 * 1_000_000, rows))
+    device = rng.integers(0, keys, rows)
+    temperature = np.round(20 + 5 * np.sin(timestamps / 3.6e9) + rng.normal(0, 0.5, rows), 2)
+    return {
+        "entrytime": (columns.TIMESTAMP, timestamps.astype("<i8")),
+        "key": (columns.STRING, [f"device-{d}" for d in device]),
+        "temperature": (columns.FLOAT64, temperature.astype("<f8")),
+        "counter": (columns.INT64, np.cumsum(rng.integers(0, 3, rows)).astype("<i8")),
+    }
+
+
+def _time(fn: typing.Callable[[], typing.Any], repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _report(name: str, rows: int, seconds: float, baseline: typing.Optional[float] = None):
+    line = f"{name:<32} {seconds * 1000:10.1f} ms {rows / seconds / 1e6:10.1f} M rows/s"
+    if baseline is not None:
+        line += f" {baseline / seconds:8.1f}x"
+    print(line)
+
+
+def benchmark_aggregate(rows: int):
+    """Statistics of one column: csv module loop against the vectorised scan of stored parts"""
+    data = synthetic_data(rows)
+    with tempfile.TemporaryDirectory() as directory:
+        root_directory = Path(directory)
+        csv_path = root_directory / "data.csv"
+        with open(csv_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(data.keys())
+            writer.writerows(zip(*(values for _, values in data.values())))
+
+        def csv_loop():
+            with open(csv_path, newline="") as f:
+                reader = csv.reader(f)
+                index = next(reader).index("temperature")
+                count, total, min_value, max_value = 0, 0.0, float("inf"), float("-inf")
+                for row in reader:
+                    value = float(row[index])
+                    count += 1
+                    total += value
+                    if value < min_value: min_value = value
+                    if value > max_value: max_value = value
+                return count, total / count, min_value, max_value
+
+        baseline = _time(csv_loop, repeat=1)
+        _report("csv module loop", rows, baseline)
+        for codec in (None, "zlib"):
+            info = storage.write_part(root_directory, "2023-01-01", "all", data, codec, compress_numeric=True)
+            part = storage.Part.from_info(root_directory, info)
+            seconds = _time(lambda: aggregate.scan_column(part, "temperature", 1024 * 1024))
+            _report(f"numpy scan ({codec or 'memory mapped'})", rows, seconds, baseline)
+
+
+def benchmark_scan(rows: int, parts: int = 64):
+    """Full lake scan of one column split over many parts with an increasing number of scan workers"""
+    from ..models.config import DatalakeConfig
+    data = synthetic_data(rows)
+    with tempfile.TemporaryDirectory() as directory:
+        infos = []
+        for index in range(parts):
+            chunk = {name: (column_type, values[index::parts]) for name, (column_type, values) in data.items()}
+            infos.append(storage.write_part(Path(directory), "2023-01-01", f"key-{index}", chunk))
+        baseline = None
+        workers = 1
+        while workers <= (os.cpu_count() or 1):
+            config = DatalakeConfig(
+                data_directory=directory, timeseries_column="entrytime", key_column="key", supported_types=[],
+                scan_workers=workers, scan_parallel_min_parts=1
+            )
+            aggregate.scan(config, infos, ["temperature"])
+            seconds = _time(lambda: aggregate.scan(config, infos, ["temperature"]))
+            baseline = baseline or seconds
+            _report(f"scan ({workers} workers)", rows, seconds, baseline)
+            workers *= 2
+
+
+def benchmark_range(rows: int):
+    """Statistics of one hour of a day long part: binary search of the block index against filtering every row"""
+    data = synthetic_data(rows)
+    with tempfile.TemporaryDirectory() as directory:
+        root_directory = Path(directory)
+        info = storage.write_part(root_directory, "2023-01-01", "all", data, sort_column="entrytime")
+        part = storage.Part.from_info(root_directory, info)
+        start = columns.to_micros(columns.parse_timestamp("2023-01-01T12:00:00"))
+        end = start + 60 * 60 * 1_000_000
+
+        def filter_rows():
+            timestamps = part.map_column("entrytime")
+            return aggregate.scan_column(part, "temperature", 1024 * 1024, np.flatnonzero((timestamps >= start) & (timestamps < end)))
+
+        baseline = _time(filter_rows)
+        _report("filter every row", rows, baseline)
+        seconds = _time(lambda: aggregate.scan_column(part, "temperature", 1024 * 1024, part.select_rows("entrytime", start, end)))
+        _report("block index", rows, seconds, baseline)
+
+
+def benchmark_key_lookup(rows: int, keys: int = 50_000):
+    """Catalog lookup of the parts of one key over every day, with and without the key index (rows is the number of parts)"""
+    from ..models.config import DatalakeConfig
+    with tempfile.TemporaryDirectory() as directory:
+        config = DatalakeConfig(data_directory=directory, timeseries_column="entrytime", key_column="key", supported_types=[])
+        part_columns = [{"name": "value", "type": columns.FLOAT64, "file": "c0.bin", "codec": None}]
+        with catalog.connect(config, write=True) as connection:
+            catalog.add_parts(connection, (
+                storage.PartInfo(f"part-{index}", f"2023-01-{index // keys % 28 + 1:02d}", f"device-{index % keys}", 1000, 8000, None, part_columns, {})
+                for index in range(rows)
+            ))
+
+        def lookup():
+            with catalog.connect(config) as connection:
+                return catalog.find_parts(connection, key="device-42")
+
+        seconds = _time(lookup)
+        with catalog.connect(config, write=True) as connection:
+            connection.execute("DROP INDEX parts_key")
+        baseline = _time(lookup)
+        _report("no key index", rows, baseline)
+        _report("key index", rows, seconds, baseline)
+
+
+CODEC_SPECS = ["none", "zlib:1", "zlib:6", "gzip:6", "lzma:6", "bz2:9", "delta", "delta+zlib:6", "delta+lzma:6", "rle", "rle+zlib:6", "dictionary+zlib:6"]
+
+def benchmark_codecs(rows: int):
+    """Compression ratio against decode throughput of every encoding and codec on each column of one partition"""
+    data = synthetic_data(rows, keys=1)
+    print(f"{'column':<12} {'codec':<18} {'bytes':>12} {'ratio':>8} {'decode':>14}")
+    for column, (column_type, values) in data.items():
+        plain_size = len(columns.encode(column_type, values))
+        for spec in CODEC_SPECS:
+            encoding, codec, level = columns.parse_codec(spec)
+            if encoding is not None and columns.choose_encoding(column_type, values, encoding) != encoding: continue
+            encoding = columns.choose_encoding(column_type, values, encoding)
+            stored = columns.compress(codec, columns.encode(column_type, values, encoding), level)
+            if column_type == columns.STRING:
+                decode = lambda: columns.decode(column_type, columns.decompress(codec, stored), rows, encoding)
+            else:
+                decode = lambda: columns.decode_array(column_type, columns.decompress(codec, stored), rows, encoding)
+            seconds = _time(decode)
+            print(f"{column:<12} {spec:<18} {len(stored):>12} {plain_size / len(stored):>7.1f}x {rows / seconds / 1e6:>8.1f} M rows/s")
+
+
+def benchmark_sketches(rows: int, parts: int = 256):
+    """Accuracy of quantiles and distinct counts merged from the sketches of many parts against the exact answers"""
+    data = synthetic_data(rows)
+    with tempfile.TemporaryDirectory() as directory:
+        root_directory = Path(directory)
+        stored = [
+            storage.Part.from_info(root_directory, storage.write_part(
+                root_directory, "2023-01-01", f"key-{index}",
+                {name: (column_type, values[index::parts]) for name, (column_type, values) in data.items()}
+            ))
+            for index in range(parts)
+        ]
+        distinct_bound = 3 * 1.04 / 2 ** (sketches.HLL_PRECISION / 2)
+        print(f"{'column':<12} {'estimate':<10} {'exact':>14} {'approximate':>14} {'error':>8} {'bound':>8}")
+        for column in ("temperature", "counter"):
+            def exact():
+                values = np.sort(np.concatenate([part.map_column(column) for part in stored]))
+                return [values[int(q * (len(values) - 1))] for q in (0.5, 0.95, 0.99)] + [len(np.unique(values))]
+
+            def approximate():
+                sketch = sketches.ColumnSketch()
+                for part in stored:
+                    sketch.merge(part.sketch(column))
+                return [sketch.quantiles.quantile(q) for q in (0.5, 0.95, 0.99)] + [sketch.distinct.estimate()]
+
+            exact_seconds, approximate_seconds = _time(exact), _time(approximate)
+            for name, exact_value, value, bound in zip(
+                ("p50", "p95", "p99", "distinct"), exact(), approximate(), [sketches.RELATIVE_ACCURACY] * 3 + [distinct_bound]
+            ):
+                error = abs(value - exact_value) / abs(exact_value)
+                print(f"{column:<12} {name:<10} {exact_value:>14.2f} {value:>14.2f} {error:>7.2%} {bound:>7.2%} {'ok' if error <= bound else 'OUT OF BOUND'}")
+            print(f"{column:<12} exact {exact_seconds * 1000:.1f} ms, merging {parts} sketches {approximate_seconds * 1000:.1f} ms")
+
+
+def _upload_files(rows: int) -> typing.Dict[str, bytes]:
+    data = synthetic_data(rows)
+    names = list(data)
+    records = list(zip(*(
+        [columns.from_micros(value).isoformat() for value in values.tolist()] if column_type == columns.TIMESTAMP else np.asarray(values).tolist()
+        for column_type, values in data.values()
+    )))
+    with io.StringIO(newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(names)
+        writer.writerows(records)
+        csv_text = f.getvalue()
+    objects = [json.dumps(dict(zip(names, record))) for record in records]
+    return {
+        "csv": csv_text.encode(),
+        "ndjson": "\n".join(objects).encode(),
+        "json array": ("[" + ",\n".join(objects) + "]").encode(),
+    }
+
+def benchmark_ingest(rows: int, chunk_size: int = 1024 * 1024, buffer_size: int = 64 * 1024 * 1024):
+    """Upload parsing throughput of csv, newline delimited json and a json array"""
+    files = _upload_files(rows)
+    for name, content in files.items():
+        def parse():
+            parser = ingest.get_parser("csv" if name == "csv" else "json", buffer_size)
+            for start in range(0, len(content), chunk_size):
+                parser.feed(content[start:start + chunk_size])
+            parser.close()
+            assert parser.rows_read == rows
+        seconds = _time(parse, repeat=1)
+        _report(name, rows, seconds)
+        print(f"{'':<32} {len(content) / seconds / 1e6:10.1f} MB/s")
+
+
+BENCHMARKS = {
+    "aggregate": benchmark_aggregate,
+    "scan": benchmark_scan,
+    "range": benchmark_range,
+    "key_lookup": benchmark_key_lookup,
+    "codecs": benchmark_codecs,
+    "ingest": benchmark_ingest,
+    "sketches": benchmark_sketches,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("benchmark", choices=list(BENCHMARKS))
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args.rows)
+
+
+if __name__ == "__main__": main()
@@ -0,0 +1,123 @@
+import sys
+import threading
+import typing
+from collections import OrderedDict
+from functools import lru_cache
+
+Partition = typing.Tuple[str, str]
+# (column, date, key, start, end, approximate) where a missing date or key means all dates or keys and a missing
+# start or end an unbounded time range
+CacheKey = typing.Tuple[str, typing.Optional[str], typing.Optional[str], typing.Optional[str], typing.Optional[str], bool]
+# State of the partitions an entry was computed from (see catalog.partitions_state)
+State = typing.Tuple[int, int]
+
+
+class InfoCache:
+    """Bounded LRU cache of /info results.
+
+    Entries are indexed by the (date, key) filter they were computed for so a write to a partition only
+    drops the entries whose filter covers that partition. Invalidation only reaches the cache of the process that
+    made the write, so every entry also records the catalog state of the partitions of its filter and is dropped
+    on get when that state changed (e.g. after a write by another api process or by a job).
+    """
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[CacheKey, typing.Tuple[typing.Any, int, typing.Optional[State]]]" = OrderedDict()
+        self._by_filter: typing.Dict[typing.Tuple[typing.Optional[str], typing.Optional[str]], typing.Set[CacheKey]] = {}
+        self._bytes = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self) -> int:
+        """Changes on every invalidation. Results computed before a change must not be cached"""
+        return self._generation
+
+    def get(self, key: CacheKey, state: typing.Optional[State] = None) -> typing.Optional[typing.Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] != state:
+                self._remove(key)
+                self.invalidations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: CacheKey, value: typing.Any, generation: int, state: typing.Optional[State] = None):
+        """Caches a value computed after the generation and the state of its partitions were read"""
+        size = _estimate_size(key, value)
+        if size > self.max_bytes or self.max_entries <= 0: return
+        with self._lock:
+            if generation != self._generation: return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, state)
+            self._by_filter.setdefault(_filter(key), set()).add(key)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, partitions: typing.Iterable[Partition]):
+        with self._lock:
+            self._generation += 1
+            for date, key in partitions:
+                for cache_filter in ((date, key), (date, None), (None, key), (None, None)):
+                    for cache_key in list(self._by_filter.get(cache_filter, ())):
+                        self._remove(cache_key)
+                        self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._by_filter.clear()
+            self._bytes = 0
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries),
+            "size_bytes": self._bytes,
+        }
+
+    def _remove(self, key: CacheKey):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+        keys = self._by_filter[_filter(key)]
+        keys.discard(key)
+        if not keys:
+            del self._by_filter[_filter(key)]
+
+
+def _filter(key: CacheKey) -> typing.Tuple[typing.Optional[str], typing.Optional[str]]:
+    # Entries are invalidated on (date, key). A time range only narrows the rows of the partitions they cover
+    return key[1], key[2]
+
+def _estimate_size(key: CacheKey, value: typing.Any) -> int:
+    size = sys.getsizeof(key) + sum(sys.getsizeof(part) for part in key)
+    size += sys.getsizeof(value)
+    if isinstance(value, tuple):
+        size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
+@lru_cache(maxsize=1)
+def get_info_cache() -> InfoCache:
+    from ..models.config import DatalakeConfig
+    from ..apibuilder.config import get_settings
+    config: DatalakeConfig = get_settings(DatalakeConfig)
+    return InfoCache(config.info_cache_max_entries, config.info_cache_max_bytes)
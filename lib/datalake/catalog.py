@@ -0,0 +1,404 @@
+import json
+import sqlite3
+import typing
+from contextlib import contextmanager
+from pathlib import Path
+from . import columns, storage
+
+if typing.TYPE_CHECKING:
+    from ..models.config import DatalakeConfig
+
+# SQLite database under the data directory that indexes every part in the lake. Uploads, compaction and deletes
+# update it in the same transaction as they change the lake, so requests plan their work from it in
+# O(matching parts) instead of walking the directory tree.
+CATALOG_FILE = "_catalog.sqlite"
+CATALOG_VERSION = "6"
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS schemas (
+        version INTEGER PRIMARY KEY AUTOINCREMENT,
+        columns TEXT NOT NULL UNIQUE
+    )
+    """,
+    # The schema every upload is converted to (see lib.datalake.schema)
+    """
+    CREATE TABLE IF NOT EXISTS lake_columns (
+        position INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        type TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS parts (
+        path TEXT PRIMARY KEY,
+        date TEXT NOT NULL,
+        key TEXT NOT NULL,
+        rows INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        codec TEXT,
+        schema_version INTEGER NOT NULL REFERENCES schemas (version),
+        columns TEXT NOT NULL,
+        stats TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS parts_partition ON parts (date, key)
+    """,
+    # Every part holds a single key, so this index is the key index: a key filter without a date reads only the
+    # catalog rows of that key instead of every part of the lake
+    """
+    CREATE INDEX IF NOT EXISTS parts_key ON parts (key, date)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS partitions (
+        date TEXT NOT NULL,
+        key TEXT NOT NULL,
+        parts INTEGER NOT NULL,
+        rows INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        -- Lake version of the last change to the parts of the partition
+        version INTEGER NOT NULL,
+        PRIMARY KEY (date, key)
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS partitions_key ON partitions (key, date)
+    """,
+    # Parts removed from the lake whose files are kept until no pinned reader can still see them (see snapshots)
+    """
+    CREATE TABLE IF NOT EXISTS retired_parts (
+        path TEXT PRIMARY KEY,
+        removed_version INTEGER NOT NULL
+    )
+    """,
+    # Pre-aggregated statistics of the partitions per hour and day (see lib.datalake.rollups). A partition has rollups
+    # if it is in rollup_partitions, changing its parts removes them in the same transaction
+    """
+    CREATE TABLE IF NOT EXISTS rollup_partitions (
+        date TEXT NOT NULL,
+        key TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        PRIMARY KEY (date, key)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS rollups (
+        date TEXT NOT NULL,
+        key TEXT NOT NULL,
+        period TEXT NOT NULL,
+        start INTEGER NOT NULL,
+        rows INTEGER NOT NULL,
+        files INTEGER NOT NULL,
+        part_mask INTEGER,
+        stats TEXT NOT NULL,
+        PRIMARY KEY (date, key, period, start)
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS parts_insert AFTER INSERT ON parts BEGIN
+        INSERT INTO partitions (date, key, parts, rows, size, version)
+        VALUES (new.date, new.key, 1, new.rows, new.size, (SELECT CAST(value AS INTEGER) FROM settings WHERE name = 'lake_version'))
+        ON CONFLICT (date, key) DO UPDATE SET parts = parts + 1, rows = rows + excluded.rows, size = size + excluded.size, version = excluded.version;
+        DELETE FROM rollup_partitions WHERE date = new.date AND key = new.key;
+        DELETE FROM rollups WHERE date = new.date AND key = new.key;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS parts_delete AFTER DELETE ON parts BEGIN
+        UPDATE partitions SET parts = parts - 1, rows = rows - old.rows, size = size - old.size,
+            version = (SELECT CAST(value AS INTEGER) FROM settings WHERE name = 'lake_version')
+        WHERE date = old.date AND key = old.key;
+        DELETE FROM partitions WHERE date = old.date AND key = old.key AND parts = 0;
+        DELETE FROM rollup_partitions WHERE date = old.date AND key = old.key;
+        DELETE FROM rollups WHERE date = old.date AND key = old.key;
+    END
+    """,
+]
+
+
+_initialised: typing.Set[str] = set()
+
+@contextmanager
+def connect(config: "DatalakeConfig", write: bool = False) -> typing.Iterator[sqlite3.Connection]:
+    """Opens the catalog in a transaction that is committed when the block exits without an error.
+
+    Write transactions are serialised across processes, readers never block each other.
+    """
+    root_directory = Path(config.data_directory)
+    root_directory.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(root_directory / CATALOG_FILE, timeout=60, isolation_level=None)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL")
+        if config.data_directory not in _initialised:
+            # In a write transaction so concurrent first connections (threads or processes) initialise it once
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                _initialise(config, connection)
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+            _initialised.add(config.data_directory)
+        connection.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+    finally:
+        connection.close()
+
+
+def _initialise(config: "DatalakeConfig", connection: sqlite3.Connection):
+    tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    version = None
+    if "settings" in tables:
+        version = connection.execute("SELECT value FROM settings WHERE name = 'version'").fetchone()
+    if version is not None and version[0] == CATALOG_VERSION: return
+    # Created by an older version (or missing). Rebuild the index from the parts on disk. The parts committed to
+    # the old catalog, its retired parts and its lake version are carried over so parts that were never committed
+    # and retired parts not collected yet (e.g. the inputs of a compaction still pinned by a reader) stay out of
+    # the lake. Without a catalog every part on disk is indexed
+    committed: typing.Optional[typing.Set[str]] = None
+    retired: typing.List[typing.Tuple[str, int]] = []
+    lake_version = 0
+    if "parts" in tables:
+        committed = {row[0] for row in connection.execute("SELECT path FROM parts")}
+    if "retired_parts" in tables:
+        retired = connection.execute("SELECT path, removed_version FROM retired_parts").fetchall()
+    if "settings" in tables:
+        row = connection.execute("SELECT value FROM settings WHERE name = 'lake_version'").fetchone()
+        if row is not None:
+            lake_version = int(row[0])
+    for name, kind in connection.execute("SELECT name, type FROM sqlite_master WHERE type IN ('table', 'trigger') AND name NOT LIKE 'sqlite_%'").fetchall():
+        connection.execute(f'DROP {kind} IF EXISTS "{name}"')
+    for statement in _SCHEMA:
+        connection.execute(statement)
+    # The lake version must exist before parts are added (see _next_version)
+    connection.execute("INSERT INTO settings (name, value) VALUES ('lake_version', ?)", (lake_version,))
+    connection.executemany("INSERT INTO retired_parts (path, removed_version) VALUES (?, ?)", retired)
+    retired_paths = {path for path, _ in retired}
+    root_directory = Path(config.data_directory)
+    column_types: typing.Dict[str, typing.Set[str]] = {}
+    for partition_directory in storage.iter_partitions(config):
+        parts = []
+        for part in partition_directory.glob(f"{storage.PART_PREFIX}*"):
+            path = part.relative_to(root_directory).as_posix()
+            if path in retired_paths or (committed is not None and path not in committed): continue
+            parts.append(storage.read_part_info(root_directory, part))
+        add_parts(connection, parts)
+        for part in parts:
+            for column in part.columns:
+                column_types.setdefault(column["name"], set()).add(column["type"])
+    register_columns(connection, {name: columns.common_type(types) for name, types in column_types.items()})
+    connection.execute("INSERT INTO settings (name, value) VALUES ('version', ?)", (CATALOG_VERSION,))
+
+
+def schema_version(connection: sqlite3.Connection, part_columns: typing.List[typing.Dict[str, typing.Any]]) -> int:
+    schema = json.dumps([[column["name"], column["type"]] for column in part_columns])
+    connection.execute("INSERT INTO schemas (columns) VALUES (?) ON CONFLICT (columns) DO NOTHING", (schema,))
+    return connection.execute("SELECT version FROM schemas WHERE columns = ?", (schema,)).fetchone()[0]
+
+
+def get_columns(connection: sqlite3.Connection) -> typing.Dict[str, str]:
+    """Returns the name and type of the columns of the lake schema in the order they were registered"""
+    return dict(connection.execute("SELECT name, type FROM lake_columns ORDER BY position").fetchall())
+
+def register_columns(connection: sqlite3.Connection, column_types: typing.Dict[str, str]):
+    """Adds columns to the lake schema or changes their type"""
+    connection.executemany(
+        "INSERT INTO lake_columns (name, type) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET type = excluded.type",
+        list(column_types.items())
+    )
+
+
+def current_version(connection: sqlite3.Connection) -> int:
+    """Version of the lake, incremented by every transaction that adds or removes parts"""
+    return int(connection.execute("SELECT value FROM settings WHERE name = 'lake_version'").fetchone()[0])
+
+def _next_version(connection: sqlite3.Connection) -> int:
+    connection.execute("UPDATE settings SET value = value + 1 WHERE name = 'lake_version'")
+    return current_version(connection)
+
+
+def add_parts(connection: sqlite3.Connection, parts: typing.Iterable[storage.PartInfo]):
+    rows = [
+        (part.path, part.date, part.key, part.rows, part.size, part.codec,
+         schema_version(connection, part.columns), json.dumps(part.columns), json.dumps(part.stats))
+        for part in parts
+    ]
+    if not rows: return
+    _next_version(connection)
+    connection.executemany(
+        "INSERT INTO parts (path, date, key, rows, size, codec, schema_version, columns, stats) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (path) DO NOTHING",
+        rows
+    )
+
+def remove_parts(connection: sqlite3.Connection, parts: typing.Iterable[storage.PartInfo]):
+    """Removes parts from the lake. Their files are left for snapshots.collect_garbage"""
+    paths = [(part.path,) for part in parts]
+    if not paths: return
+    version = _next_version(connection)
+    connection.executemany(f"INSERT INTO retired_parts (path, removed_version) SELECT path, {version} FROM parts WHERE path = ?", paths)
+    connection.executemany("DELETE FROM parts WHERE path = ?", paths)
+
+def replace_parts(connection: sqlite3.Connection, old_parts: typing.List[storage.PartInfo], new_parts: typing.List[storage.PartInfo]) -> bool:
+    """Swaps old parts for new parts. Nothing is changed and False is returned if any old part is no longer in the catalog"""
+    placeholders = ", ".join("?" * len(old_parts))
+    found = connection.execute(f"SELECT COUNT(*) FROM parts WHERE path IN ({placeholders})", [part.path for part in old_parts]).fetchone()[0]
+    if found != len(old_parts): return False
+    remove_parts(connection, old_parts)
+    add_parts(connection, new_parts)
+    return True
+
+def remove_partitions(connection: sqlite3.Connection, partitions: typing.Iterable[typing.Tuple[str, str]]):
+    partitions = list(partitions)
+    if not partitions: return
+    version = _next_version(connection)
+    connection.executemany(f"INSERT INTO retired_parts (path, removed_version) SELECT path, {version} FROM parts WHERE date = ? AND key = ?", partitions)
+    connection.executemany("DELETE FROM parts WHERE date = ? AND key = ?", partitions)
+
+def find_retired_parts(connection: sqlite3.Connection, up_to_version: int) -> typing.List[str]:
+    """Returns the paths of the parts removed at or before the version"""
+    return [row[0] for row in connection.execute("SELECT path FROM retired_parts WHERE removed_version <= ? ORDER BY path", (up_to_version,))]
+
+def known_part_paths(connection: sqlite3.Connection) -> typing.Set[str]:
+    """Returns the paths of the parts in the lake and of the retired parts whose files are not collected yet"""
+    return {row[0] for row in connection.execute("SELECT path FROM parts UNION SELECT path FROM retired_parts")}
+
+def forget_retired_parts(connection: sqlite3.Connection, paths: typing.Iterable[str]):
+    connection.executemany("DELETE FROM retired_parts WHERE path = ?", [(path,) for path in paths])
+
+
+def _filter(
+    date: typing.Optional[str],
+    key: typing.Optional[str],
+    before: typing.Optional[str],
+    since: typing.Optional[str]
+) -> typing.Tuple[str, typing.List[str]]:
+    conditions, parameters = [], []
+    if date is not None:
+        conditions.append("date = ?")
+        parameters.append(date)
+    if since is not None:
+        conditions.append("date >= ?")
+        parameters.append(since)
+    if before is not None:
+        conditions.append("date < ?")
+        parameters.append(before)
+    if key is not None:
+        conditions.append("key = ?")
+        parameters.append(key)
+    return (" WHERE " + " AND ".join(conditions)) if conditions else "", parameters
+
+def find_parts(
+    connection: sqlite3.Connection,
+    date: typing.Optional[str] = None,
+    key: typing.Optional[str] = None,
+    before: typing.Optional[str] = None,
+    since: typing.Optional[str] = None
+) -> typing.List[storage.PartInfo]:
+    """Returns the parts matching the date, the key and of days from since up to before (all if not given)"""
+    where, parameters = _filter(date, key, before, since)
+    rows = connection.execute(f"SELECT path, date, key, rows, size, codec, columns, stats FROM parts{where} ORDER BY date, key, path", parameters)
+    return [
+        storage.PartInfo(path, date, key, rows, size, codec, json.loads(part_columns), json.loads(stats))
+        for path, date, key, rows, size, codec, part_columns, stats in rows
+    ]
+
+def find_partitions(
+    connection: sqlite3.Connection,
+    date: typing.Optional[str] = None,
+    key: typing.Optional[str] = None,
+    before: typing.Optional[str] = None,
+    since: typing.Optional[str] = None
+) -> typing.List[typing.Tuple[str, str]]:
+    """Returns the (date, key) partitions matching the date, the key and of days from since up to before (all if not given)"""
+    where, parameters = _filter(date, key, before, since)
+    return [tuple(row) for row in connection.execute(f"SELECT date, key FROM partitions{where} ORDER BY date, key", parameters)]
+
+def find_uncompacted_partitions(connection: sqlite3.Connection, codec: typing.Optional[str], target_rows: int) -> typing.List[typing.Tuple[str, str]]:
+    """Returns the partitions with parts not compressed with the codec or with more than one part below target_rows.
+
+    Compaction leaves a partition as parts of target_rows rows and at most one smaller part, so those are not
+    compacted again.
+    """
+    return [tuple(row) for row in connection.execute(
+        "SELECT date, key FROM parts GROUP BY date, key HAVING SUM(codec IS NOT ?) > 0 OR SUM(rows < ?) > 1 ORDER BY date, key",
+        (codec, target_rows)
+    )]
+
+def find_partitions_without_rollups(connection: sqlite3.Connection) -> typing.List[typing.Tuple[str, str]]:
+    """Returns the partitions changed since their rollups were built (or never rolled up)"""
+    return [tuple(row) for row in connection.execute(
+        "SELECT date, key FROM partitions WHERE NOT EXISTS "
+        "(SELECT 1 FROM rollup_partitions r WHERE r.date = partitions.date AND r.key = partitions.key) ORDER BY date, key"
+    )]
+
+def partitions_state(connection: sqlite3.Connection, date: typing.Optional[str] = None, key: typing.Optional[str] = None) -> typing.Tuple[int, int]:
+    """Returns the number of partitions matching the date and key and the last version any of them changed at.
+
+    Adding, changing or removing a matching partition changes it (unless the partitions are back as they were).
+    """
+    where, parameters = _filter(date, key, None, None)
+    return tuple(connection.execute(f"SELECT COUNT(*), COALESCE(MAX(version), 0) FROM partitions{where}", parameters).fetchone())
+
+def partition_version(connection: sqlite3.Connection, date: str, key: str) -> typing.Optional[int]:
+    row = connection.execute("SELECT version FROM partitions WHERE date = ? AND key = ?", (date, key)).fetchone()
+    return None if row is None else row[0]
+
+class Rollup(typing.NamedTuple):
+    date: str
+    key: str
+    # "hour" or "day" starting at start (epoch microseconds)
+    period: str
+    start: int
+    rows: int
+    # Parts with rows in the period and a bit per part (in path order) if the partition has at most 62 parts
+    files: int
+    part_mask: typing.Optional[int]
+    # Column -> ColumnStats.to_dict() in reported units (seconds for timestamps)
+    stats: typing.Dict[str, typing.Dict[str, typing.Any]]
+
+def put_rollups(connection: sqlite3.Connection, date: str, key: str, version: int, rollups: typing.Iterable[Rollup]) -> bool:
+    """Stores the rollups of a partition built from its parts at the version.
+
+    Nothing is stored and False is returned if the partition changed since.
+    """
+    if partition_version(connection, date, key) != version: return False
+    connection.execute("DELETE FROM rollups WHERE date = ? AND key = ?", (date, key))
+    connection.execute(
+        "INSERT INTO rollup_partitions (date, key, version) VALUES (?, ?, ?) ON CONFLICT (date, key) DO UPDATE SET version = excluded.version",
+        (date, key, version)
+    )
+    connection.executemany(
+        "INSERT INTO rollups (date, key, period, start, rows, files, part_mask, stats) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(rollup.date, rollup.key, rollup.period, rollup.start, rollup.rows, rollup.files, rollup.part_mask, json.dumps(rollup.stats)) for rollup in rollups]
+    )
+    return True
+
+def find_rollups(
+    connection: sqlite3.Connection,
+    date: typing.Optional[str] = None,
+    key: typing.Optional[str] = None,
+    before: typing.Optional[str] = None,
+    since: typing.Optional[str] = None
+) -> typing.Dict[typing.Tuple[str, str], typing.List[Rollup]]:
+    """Returns the rollups of the partitions matching the filters that have them, by partition"""
+    where, parameters = _filter(date, key, before, since)
+    partitions: typing.Dict[typing.Tuple[str, str], typing.List[Rollup]] = {
+        tuple(row): [] for row in connection.execute(f"SELECT date, key FROM rollup_partitions{where}", parameters)
+    }
+    for row in connection.execute(f"SELECT date, key, period, start, rows, files, part_mask, stats FROM rollups{where} ORDER BY date, key, period, start", parameters):
+        partitions[row[0], row[1]].append(Rollup(*row[:7], json.loads(row[7])))
+    return partitions
+
+
+def total_size(connection: sqlite3.Connection) -> int:
+    return connection.execute("SELECT COALESCE(SUM(size), 0) FROM partitions").fetchone()[0]
@@ -0,0 +1,317 @@
+import array
+import datetime
+import math
+import sys
+import typing
+import numpy as np
+
+INT64 = "int64"
+FLOAT64 = "float64"
+TIMESTAMP = "timestamp"
+STRING = "string"
+NUMERIC_TYPES = (INT64, FLOAT64, TIMESTAMP)
+# Types quantile and distinct count sketches are kept for (see lib.datalake.sketches)
+SKETCH_TYPES = (INT64, FLOAT64)
+
+_ARRAY_TYPECODES = {INT64: "q", FLOAT64: "d", TIMESTAMP: "q"}
+# Little endian numpy dtypes of the fixed width column types
+DTYPES = {INT64: "<i8", FLOAT64: "<f8", TIMESTAMP: "<i8"}
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def parse_timestamp(value: typing.Any) -> datetime.datetime:
+    """Parses an ISO 8601 string or a unix epoch (s, ms, us or ns) to a UTC datetime. Naive values are assumed to be UTC."""
+    if isinstance(value, str):
+        value = value.strip()
+        try:
+            value = float(value)
+        except ValueError:
+            parsed = datetime.datetime.fromisoformat(value)
+            if parsed.tzinfo is None:
+                return parsed.replace(tzinfo=datetime.timezone.utc)
+            return parsed.astimezone(datetime.timezone.utc)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        magnitude = abs(value)
+        if magnitude >= 1e17: value = value / 1e9
+        elif magnitude >= 1e14: value = value / 1e6
+        elif magnitude >= 1e11: value = value / 1e3
+        return _EPOCH + datetime.timedelta(seconds=value)
+    raise ValueError(f"Could not parse timestamp: {value!r}")
+
+def stats_scale(column_type: str) -> float:
+    """Factor converting stored values to the units statistics are reported in (seconds for timestamps)"""
+    return 1e-6 if column_type == TIMESTAMP else 1.0
+
+def to_micros(timestamp: datetime.datetime) -> int:
+    return (timestamp - _EPOCH) // datetime.timedelta(microseconds=1)
+
+def from_micros(micros: int) -> datetime.datetime:
+    return _EPOCH + datetime.timedelta(microseconds=micros)
+
+
+def _to_int(value: typing.Any) -> int:
+    if isinstance(value, str) or (isinstance(value, int) and not isinstance(value, bool)):
+        return int(value)
+    raise ValueError(f"Not an integer: {value!r}")
+
+def _to_float(value: typing.Any) -> float:
+    if value is None or value == "":
+        return math.nan
+    if isinstance(value, str) or (isinstance(value, (int, float)) and not isinstance(value, bool)):
+        return float(value)
+    raise ValueError(f"Not a number: {value!r}")
+
+def _to_str(value: typing.Any) -> str:
+    if value is None: return ""
+    if isinstance(value, str): return value
+    if isinstance(value, (dict, list)):
+        import json
+        return json.dumps(value)
+    return str(value)
+
+
+def infer_type(values: typing.List[typing.Any]) -> str:
+    for column_type, converter in ((INT64, _to_int), (FLOAT64, _to_float)):
+        try:
+            for value in values: converter(value)
+        except (ValueError, TypeError, OverflowError):
+            continue
+        return column_type
+    return STRING
+
+
+def convert(column_type: str, values: typing.List[typing.Any]) -> typing.Sequence[typing.Any]:
+    """Converts raw parsed values to the in memory representation of the column type (missing floats are NaN)"""
+    if column_type == STRING:
+        return [_to_str(value) for value in values]
+    if column_type == TIMESTAMP:
+        values = [to_micros(parse_timestamp(value)) for value in values]
+    elif column_type == INT64:
+        values = [_to_int(value) for value in values]
+    else:
+        values = [_to_float(value) for value in values]
+    return array.array(_ARRAY_TYPECODES[column_type], values)
+
+
+# Encodings of the values of a column, applied before the column is compressed:
+#   plain       every value (numeric columns fixed width, see encode)
+#   dictionary  strings only. Each distinct value once and an int32 code per row, suits low cardinality columns
+#   delta       int64 and timestamps only. The difference to the previous value, small for regular time series
+#   rle         runs of equal values as (value, length) pairs, suits sorted or constant columns such as keys
+PLAIN = "plain"
+DICTIONARY = "dictionary"
+DELTA = "delta"
+RLE = "rle"
+_ENCODINGS = {
+    INT64: (PLAIN, DELTA, RLE),
+    FLOAT64: (PLAIN, RLE),
+    TIMESTAMP: (PLAIN, DELTA, RLE),
+    STRING: (PLAIN, DICTIONARY, RLE),
+}
+
+
+def choose_encoding(column_type: str, values: typing.Sequence[typing.Any], encoding: typing.Optional[str] = None) -> str:
+    """Returns the requested encoding if it applies to the column type, otherwise the default for the values"""
+    if encoding is not None and encoding in _ENCODINGS[column_type]:
+        return encoding
+    if column_type == STRING and len(set(values)) * 2 <= len(values):
+        return DICTIONARY
+    return PLAIN
+
+
+def _encode_strings(values: typing.Sequence[str]) -> bytes:
+    data = [value.encode("utf-8") for value in values]
+    offsets = array.array("q", [0])
+    position = 0
+    for item in data:
+        position += len(item)
+        offsets.append(position)
+    return _little_endian(offsets).tobytes() + b"".join(data)
+
+def _decode_strings(data: bytes, rows: int) -> typing.List[str]:
+    offsets = array.array("q")
+    offsets.frombytes(data[:(rows + 1) * 8])
+    _little_endian(offsets)
+    start = (rows + 1) * 8
+    return [data[start + offsets[i]:start + offsets[i + 1]].decode("utf-8") for i in range(rows)]
+
+def _run_starts(values: typing.Sequence[typing.Any]) -> typing.List[int]:
+    return [row for row in range(len(values)) if row == 0 or values[row] != values[row - 1]]
+
+
+def encode(column_type: str, values: typing.Sequence[typing.Any], encoding: str = PLAIN) -> bytes:
+    """Encodes converted values to the little endian binary layout of the column type and encoding.
+
+    Plain numeric columns are fixed width (8 bytes per value) and plain string columns store (rows + 1) int64
+    offsets followed by the concatenated utf-8 data. Dictionary columns store the number of distinct values
+    (int64), an int32 code per row and the distinct values. Delta columns store the difference of every value
+    to the previous one (int64). Run length columns store the number of runs (int64), the length of every run
+    (int64) and the value of every run.
+    """
+    if column_type == STRING:
+        if encoding == DICTIONARY:
+            dictionary: typing.Dict[str, int] = {}
+            codes = np.fromiter((dictionary.setdefault(value, len(dictionary)) for value in values), dtype="<i4", count=len(values))
+            return np.array([len(dictionary)], dtype="<i8").tobytes() + codes.tobytes() + _encode_strings(list(dictionary))
+        if encoding == RLE:
+            starts = _run_starts(values)
+            lengths = np.diff(np.array(starts + [len(values)], dtype="<i8"))
+            return np.array([len(starts)], dtype="<i8").tobytes() + lengths.tobytes() + _encode_strings([values[start] for start in starts])
+        return _encode_strings(values)
+    values = np.asarray(values, dtype=DTYPES[column_type])
+    if encoding == DELTA:
+        return np.diff(values, prepend=values.dtype.type(0)).tobytes()
+    if encoding == RLE:
+        starts = np.flatnonzero(np.concatenate(([True], values[1:] != values[:-1])))
+        lengths = np.diff(np.append(starts, len(values))).astype("<i8")
+        return np.array([len(starts)], dtype="<i8").tobytes() + lengths.tobytes() + values[starts].tobytes()
+    return values.tobytes()
+
+
+def decode_array(column_type: str, data: bytes, rows: int, encoding: str = PLAIN) -> np.ndarray:
+    """Decodes a numeric column to a read only array (a view of the data for plain columns)"""
+    dtype = np.dtype(DTYPES[column_type])
+    if encoding == DELTA:
+        return np.cumsum(np.frombuffer(data, dtype=dtype, count=rows), dtype=dtype)
+    if encoding == RLE:
+        runs = int(np.frombuffer(data, dtype="<i8", count=1)[0])
+        lengths = np.frombuffer(data, dtype="<i8", count=runs, offset=8)
+        return np.repeat(np.frombuffer(data, dtype=dtype, count=runs, offset=8 + runs * 8), lengths)
+    return np.frombuffer(data, dtype=dtype, count=rows)
+
+
+def decode(column_type: str, data: bytes, rows: int, encoding: str = PLAIN) -> typing.Sequence[typing.Any]:
+    if column_type != STRING:
+        if encoding != PLAIN:
+            data = decode_array(column_type, data, rows, encoding).tobytes()
+        values = array.array(_ARRAY_TYPECODES[column_type])
+        values.frombytes(data)
+        return _little_endian(values)
+    if encoding == DICTIONARY:
+        size = int(np.frombuffer(data, dtype="<i8", count=1)[0])
+        codes = np.frombuffer(data, dtype="<i4", count=rows, offset=8)
+        dictionary = _decode_strings(data[8 + rows * 4:], size)
+        return [dictionary[code] for code in codes.tolist()]
+    if encoding == RLE:
+        runs = int(np.frombuffer(data, dtype="<i8", count=1)[0])
+        lengths = np.frombuffer(data, dtype="<i8", count=runs, offset=8).tolist()
+        values = []
+        for value, length in zip(_decode_strings(data[8 + runs * 8:], runs), lengths):
+            values.extend([value] * length)
+        return values
+    return _decode_strings(data, rows)
+
+
+def take(values: typing.Sequence[typing.Any], indexes: typing.Union[typing.Iterable[int], np.ndarray]) -> typing.Sequence[typing.Any]:
+    if isinstance(values, array.array):
+        # Numeric columns are gathered with numpy instead of value by value
+        selected = np.frombuffer(values, dtype=values.typecode)[np.asarray(indexes, dtype=np.int64)]
+        return array.array(values.typecode, selected.tobytes())
+    if isinstance(indexes, np.ndarray):
+        indexes = indexes.tolist()
+    return [values[i] for i in indexes]
+
+def concat(column_type: str, chunks: typing.Iterable[typing.Sequence[typing.Any]]) -> typing.Sequence[typing.Any]:
+    combined = [] if column_type == STRING else array.array(_ARRAY_TYPECODES[column_type])
+    for chunk in chunks:
+        combined.extend(chunk)
+    return combined
+
+def missing(column_type: str, rows: int) -> typing.Sequence[typing.Any]:
+    if column_type == STRING: return [""] * rows
+    if column_type == FLOAT64: return array.array("d", [math.nan]) * rows
+    raise ValueError(f"Columns of type {column_type} can not have missing values")
+
+def common_type(column_types: typing.Iterable[typing.Optional[str]]) -> str:
+    """Returns the type that values of all the given types (None for missing values) can be cast to"""
+    column_types = set(column_types)
+    if len(column_types) == 1 and None not in column_types:
+        return column_types.pop()
+    if STRING in column_types: return STRING
+    return FLOAT64
+
+def cast(values: typing.Sequence[typing.Any], from_type: str, to_type: str) -> typing.Sequence[typing.Any]:
+    if from_type == to_type: return values
+    if to_type == STRING:
+        if from_type == TIMESTAMP:
+            return [from_micros(value).isoformat() for value in values]
+        return [_to_str(value) for value in values]
+    if to_type == FLOAT64 and from_type in NUMERIC_TYPES:
+        return array.array("d", values)
+    raise ValueError(f"Can not cast {from_type} to {to_type}")
+
+
+class Codec(typing.NamedTuple):
+    compress: typing.Callable[[bytes, int], bytes]
+    decompress: typing.Callable[[bytes], bytes]
+
+def _zlib() -> Codec:
+    import zlib
+    return Codec(zlib.compress, zlib.decompress)
+
+def _gzip() -> Codec:
+    import gzip
+    return Codec(lambda data, level: gzip.compress(data, level, mtime=0), gzip.decompress)
+
+def _lzma() -> Codec:
+    import lzma
+    return Codec(lambda data, level: lzma.compress(data, preset=level), lzma.decompress)
+
+def _bz2() -> Codec:
+    import bz2
+    return Codec(lambda data, level: bz2.compress(data, max(level, 1)), bz2.decompress)
+
+# Byte level compression applied to encoded columns. Levels are 0 (fastest) to 9 (smallest)
+CODECS: typing.Dict[str, typing.Callable[[], Codec]] = {
+    "zlib": _zlib,
+    "gzip": _gzip,
+    "lzma": _lzma,
+    "bz2": _bz2,
+}
+
+def _codec(name: str) -> Codec:
+    if name not in CODECS:
+        raise ValueError(f"Unknown codec: {name}")
+    return CODECS[name]()
+
+def compress(codec: typing.Optional[str], data: bytes, level: int = 6) -> bytes:
+    if codec is None: return data
+    return _codec(codec).compress(data, level)
+
+def decompress(codec: typing.Optional[str], data: bytes) -> bytes:
+    if codec is None: return data
+    return _codec(codec).decompress(data)
+
+
+class ColumnCodec(typing.NamedTuple):
+    """How a column is stored: an encoding (None for the default of the column) then a codec at a level"""
+    encoding: typing.Optional[str]
+    codec: typing.Optional[str]
+    level: int
+
+def parse_codec(spec: typing.Optional[str], default_level: int = 6) -> ColumnCodec:
+    """Parses "[encoding+]codec[:level]" such as "zlib", "lzma:9", "delta+zlib" or "rle" ("none" or None for no codec)"""
+    if spec is None:
+        return ColumnCodec(None, None, default_level)
+    encoding, codec, level = None, spec, default_level
+    if "+" in codec:
+        encoding, codec = codec.split("+", 1)
+    elif codec in (PLAIN, DICTIONARY, DELTA, RLE):
+        encoding, codec = codec, "none"
+    if ":" in codec:
+        codec, level_text = codec.split(":", 1)
+        level = int(level_text)
+    if encoding is not None and encoding not in (PLAIN, DICTIONARY, DELTA, RLE):
+        raise ValueError(f"Unknown encoding: {encoding}")
+    if codec == "none":
+        codec = None
+    elif codec not in CODECS:
+        raise ValueError(f"Unknown codec: {codec}")
+    return ColumnCodec(encoding, codec, level)
+
+
+def _little_endian(values: array.array) -> array.array:
+    # The on disk layout is little endian regardless of platform
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
@@ -0,0 +1,102 @@
+import typing
+from pathlib import Path
+import numpy as np
+from . import catalog, columns, instrumentation, snapshots, storage
+
+if typing.TYPE_CHECKING:
+    from ..models.config import DatalakeConfig
+
+
+class CompactionResult(typing.NamedTuple):
+    partitions: typing.List[typing.Tuple[str, str]]
+    files_before: int
+    files_after: int
+    bytes_before: int
+    bytes_after: int
+
+
+def merge_parts(parts: typing.List[storage.Part]) -> typing.Dict[str, storage.TypedColumn]:
+    """Concatenates the columns of the parts casting each column to a type common to all parts"""
+    names = list(dict.fromkeys(column for part in parts for column in part.columns))
+    merged = {}
+    for column in names:
+        column_type = columns.common_type(part.column_type(column) for part in parts)
+        chunks = (
+            columns.cast(part.read_column(column), part.column_type(column), column_type)
+            if column in part.columns else columns.missing(column_type, part.rows)
+            for part in parts
+        )
+        merged[column] = (column_type, columns.concat(column_type, chunks))
+    return merged
+
+
+def compact_partition(config: "DatalakeConfig", date: str, key: str) -> typing.Optional[typing.Tuple[int, int, int, int]]:
+    """Rewrites all parts of a partition as parts of at most compaction_target_rows rows sorted on the timeseries column.
+
+    Returns (files_before, files_after, bytes_before, bytes_after) or None if nothing was compacted.
+    """
+    # The old parts are pinned while they are read so a concurrent delete can not remove their files
+    with snapshots.pin(config):
+        return _compact_partition(config, date, key)
+
+def _compact_partition(config: "DatalakeConfig", date: str, key: str) -> typing.Optional[typing.Tuple[int, int, int, int]]:
+    root_directory = Path(config.data_directory)
+    with catalog.connect(config) as connection:
+        old_parts = catalog.find_parts(connection, date=date, key=key)
+    if not old_parts: return None
+
+    # NOTE the whole partition (a single key for a single day) is held in memory while it is sorted
+    merged = merge_parts([storage.Part.from_info(root_directory, info) for info in old_parts])
+    instrumentation.read(sum(info.rows for info in old_parts), sum(info.size for info in old_parts))
+    timestamps = np.asarray(merged[config.timeseries_column][1])
+    order = np.argsort(timestamps, kind="stable")
+    _, codec, level = columns.parse_codec(config.compaction_codec, config.compaction_level)
+    column_codecs = storage.column_codecs(config)
+    new_parts = []
+    for start in range(0, len(order), config.compaction_target_rows):
+        indexes = order[start:start + config.compaction_target_rows]
+        data = {column: (column_type, columns.take(values, indexes)) for column, (column_type, values) in merged.items()}
+        new_parts.append(storage.write_part(
+            root_directory, date, key, data, codec, level, config.compaction_compress_numeric,
+            sort_column=config.timeseries_column, block_rows=config.index_block_rows, column_codecs=column_codecs,
+            sync=config.fsync_writes, presorted=True
+        ))
+
+    # Parts written by uploads running concurrently are left untouched. If any of the old parts were deleted
+    # while compacting the new parts are discarded. Otherwise the old parts are retired, readers that still see
+    # them keep reading their files until snapshots.collect_garbage removes them
+    with catalog.connect(config, write=True) as connection:
+        replaced = catalog.replace_parts(connection, old_parts, new_parts)
+    if not replaced:
+        # The new parts were never visible to anyone
+        storage.discard_parts(config, new_parts)
+        return None
+    return (
+        sum(storage.part_file_count(info) for info in old_parts),
+        sum(storage.part_file_count(info) for info in new_parts),
+        sum(info.size for info in old_parts),
+        sum(info.size for info in new_parts),
+    )
+
+
+# Called with (partitions done, partitions total, bytes rewritten so far)
+ProgressCallback = typing.Callable[[int, int, int], None]
+
+def compact(config: "DatalakeConfig", progress: typing.Optional[ProgressCallback] = None) -> CompactionResult:
+    partitions = []
+    files_before = files_after = bytes_before = bytes_after = 0
+    with catalog.connect(config) as connection:
+        uncompacted = catalog.find_uncompacted_partitions(
+            connection, columns.parse_codec(config.compaction_codec).codec, config.compaction_target_rows
+        )
+    for done, partition in enumerate(uncompacted, 1):
+        compacted = compact_partition(config, *partition)
+        if compacted is not None:
+            partitions.append(partition)
+            files_before += compacted[0]
+            files_after += compacted[1]
+            bytes_before += compacted[2]
+            bytes_after += compacted[3]
+        if progress is not None:
+            progress(done, len(uncompacted), bytes_after)
+    return CompactionResult(partitions, files_before, files_after, bytes_before, bytes_after)
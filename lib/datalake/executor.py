@@ -0,0 +1,153 @@
+import asyncio
+import multiprocessing
+import threading
+import typing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from ..apibuilder.exceptions import NavigatorAPIException, TracebackSkip
+
+T = typing.TypeVar("T")
+# Returned by next() when an iterator run by BoundedExecutor.stream is exhausted
+_DONE = object()
+
+
+class BoundedExecutor:
+    """Thread pool running the blocking work of requests (parsing, writing and scanning) off the event loop.
+
+    At most max_pending requests are admitted at a time, further requests are rejected with a 503 instead of
+    queueing without bound so cheap endpoints stay responsive while heavy uploads run. A request stays admitted
+    until its work finishes, even when its client disconnects before.
+    """
+    def __init__(self, workers: int, max_pending: int):
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="datalake")
+        self._lock = threading.Lock()
+
+    async def run(self, fn: typing.Callable[..., T], *args: typing.Any) -> T:
+        """Runs fn(*args) in the pool, rejecting it with a 503 when max_pending requests are already admitted"""
+        self._admit()
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        # Released by the worker, cancelling the awaiting request does not stop work that already started
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def stream(self, iterator: typing.Iterator[T]) -> typing.AsyncIterator[T]:
+        """Iterates iterator in the pool, admitted (or rejected with a 503) like run until it is exhausted or closed"""
+        self._admit()
+        return _Stream(self._executor, iterator, self._release)
+
+    def _admit(self):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise NavigatorAPIException(
+                    "The server is busy, try again later", 503, f"{self.pending} requests are already being processed",
+                    TracebackSkip, headers={"Retry-After": "1"}, hide_logs=True
+                )
+            self.pending += 1
+
+    def _release(self, future: typing.Optional[Future] = None):
+        with self._lock:
+            self.pending -= 1
+
+
+class _Stream:
+    """Async iterator producing the items of an iterator in a thread pool (see BoundedExecutor.stream).
+
+    release is called once the iterator is closed, after the item being produced (if any) is done. A stream that
+    is never iterated (e.g. its client disconnected before the response started) is closed when collected.
+    """
+    def __init__(self, executor: ThreadPoolExecutor, iterator: typing.Iterator[T], release: typing.Callable[[typing.Optional[Future]], None]):
+        self._executor = executor
+        self._iterator = iterator
+        self._release = release
+        self._running: typing.Optional[Future] = None
+        self._closed = False
+
+    def __aiter__(self) -> "_Stream":
+        return self
+
+    async def __anext__(self) -> typing.Any:
+        if self._closed: raise StopAsyncIteration
+        self._running = self._executor.submit(next, self._iterator, _DONE)
+        try:
+            item = await asyncio.wrap_future(self._running)
+        except BaseException:
+            self.close()
+            raise
+        self._running = None
+        if item is _DONE:
+            self.close()
+            raise StopAsyncIteration
+        return item
+
+    async def aclose(self):
+        self.close()
+
+    def close(self):
+        if self._closed: return
+        self._closed = True
+        running, self._running = self._running, None
+        def close_iterator(_: typing.Optional[Future] = None):
+            self._executor.submit(_close, self._iterator).add_done_callback(self._release)
+        if running is None:
+            close_iterator()
+        else:
+            running.add_done_callback(close_iterator)
+
+    def __del__(self):
+        self.close()
+
+def _close(iterator: typing.Iterator[typing.Any]):
+    close = getattr(iterator, "close", None)
+    if close is not None:
+        close()
+
+
+@lru_cache(maxsize=1)
+def get_executor() -> BoundedExecutor:
+    from ..models.config import DatalakeConfig
+    from ..apibuilder.config import get_settings
+    config: DatalakeConfig = get_settings(DatalakeConfig)
+    return BoundedExecutor(config.executor_workers, config.executor_max_pending)
+
+
+# Modules imported once by the fork server so workers start without importing them again
+_PRELOAD_MODULES = ["lib.datalake.aggregate", "lib.datalake.jobs", "lib.datalake.upload"]
+
+def _process_context() -> multiprocessing.context.BaseContext:
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(_PRELOAD_MODULES)
+    return context
+
+
+class ProcessPool:
+    """Process pool running the cpu bound work of scans, uploads and jobs.
+
+    Workers are started from a fork server (spawned where not available) instead of being forked from the
+    threads of the api, so they never inherit locks held by another thread. A pool broken by a worker dying
+    (e.g. killed when out of memory) fails the work it was running and is replaced for the work submitted after.
+    """
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor: typing.Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn: typing.Callable[..., T], *args: typing.Any) -> "Future[T]":
+        with self._lock:
+            if self._executor is not None:
+                try:
+                    return self._executor.submit(fn, *args)
+                except BrokenProcessPool:
+                    self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=_process_context())
+            return self._executor.submit(fn, *args)
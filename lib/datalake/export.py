@@ -0,0 +1,137 @@
+import csv
+import datetime
+import io
+import json
+import math
+import typing
+from pathlib import Path
+import numpy as np
+from . import catalog, columns, instrumentation, snapshots, storage
+from ..apibuilder.exceptions import ValueValidationError
+
+if typing.TYPE_CHECKING:
+    from ..models.config import DatalakeConfig
+
+# Raw rows are exported by a pipeline of generators: parts -> selected rows in chunks of export_chunk_rows ->
+# formatted bytes. Only one chunk (and at most one decompressed part) is in memory at a time, and the next chunk is
+# only produced once the previous one was sent, so a slow client slows the export down instead of buffering it.
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# Column name -> values of a chunk of rows
+RowChunk = typing.Dict[str, typing.List[typing.Any]]
+
+
+def get_format(export_format: str) -> str:
+    if export_format not in MEDIA_TYPES:
+        raise ValueValidationError(found=export_format, expected=f"one of {list(MEDIA_TYPES)}", user_message="Unsupported export format")
+    return export_format
+
+
+def export_columns(config: "DatalakeConfig", requested: typing.Optional[typing.List[str]]) -> typing.Dict[str, str]:
+    """The name and type of the projected columns (every column of the schema if none requested)"""
+    with catalog.connect(config) as connection:
+        registered = catalog.get_columns(connection)
+    if not requested:
+        return registered
+    unknown = [column for column in requested if column not in registered]
+    if unknown:
+        raise ValueValidationError(found=unknown, expected=f"columns of {list(registered)}", user_message="Unknown column")
+    return {column: registered[column] for column in dict.fromkeys(requested)}
+
+
+def _to_python(column_type: str, values: typing.Sequence[typing.Any]) -> typing.List[typing.Any]:
+    if column_type == columns.TIMESTAMP:
+        return [columns.from_micros(value).isoformat() for value in np.asarray(values).tolist()]
+    if column_type == columns.FLOAT64:
+        return [None if math.isnan(value) else value for value in np.asarray(values).tolist()]
+    if column_type == columns.INT64:
+        return np.asarray(values).tolist()
+    return list(values)
+
+def iter_chunks(
+    config: "DatalakeConfig",
+    column_types: typing.Dict[str, str],
+    date: typing.Optional[str] = None,
+    key: typing.Optional[str] = None,
+    start: typing.Optional[datetime.datetime] = None,
+    end: typing.Optional[datetime.datetime] = None
+) -> typing.Iterator[RowChunk]:
+    """Yields the projected columns of the rows of the date and key with start <= timestamp < end in chunks.
+
+    Rows are ordered by day, key and then by timestamp within each part.
+    """
+    root_directory = Path(config.data_directory)
+    since, before = storage.date_bounds(start, end)
+    time_range = (storage.micros_or_none(start), storage.micros_or_none(end))
+    # The snapshot is pinned for the whole export so parts removed meanwhile are still read
+    with snapshots.pin(config):
+        with catalog.connect(config) as connection:
+            parts = catalog.find_parts(connection, date=date, key=key, since=since, before=before)
+        for info in parts:
+            part = storage.Part.from_info(root_directory, info)
+            rows: typing.Union[slice, np.ndarray] = slice(0, part.rows)
+            if time_range != (None, None):
+                rows = part.select_rows(config.timeseries_column, *time_range)
+            selected = rows.stop - rows.start if isinstance(rows, slice) else len(rows)
+            if not selected: continue
+            # Numeric columns are sliced from memory maps, other columns are decoded once per part
+            part_columns = {}
+            size = 0
+            for column, column_type in column_types.items():
+                if column not in part.columns:
+                    part_columns[column] = None
+                elif part.column_type(column) in columns.NUMERIC_TYPES:
+                    part_columns[column] = part.map_column(column)
+                    size += selected * part_columns[column].itemsize
+                else:
+                    values = part.read_column(column)
+                    part_columns[column] = values[rows] if isinstance(rows, slice) else [values[row] for row in rows.tolist()]
+            instrumentation.read(selected, size, instrumentation.EXPORT)
+            for offset in range(0, selected, config.export_chunk_rows):
+                count = min(config.export_chunk_rows, selected - offset)
+                chunk = {}
+                for column, values in part_columns.items():
+                    if values is None:
+                        chunk[column] = [None] * count
+                    elif isinstance(values, np.ndarray):
+                        chunk_rows = slice(rows.start + offset, rows.start + offset + count) if isinstance(rows, slice) else rows[offset:offset + count]
+                        chunk[column] = _to_python(part.column_type(column), values[chunk_rows])
+                    else:
+                        chunk[column] = _to_python(part.column_type(column), values[offset:offset + count])
+                yield chunk
+
+
+def iter_ndjson(chunks: typing.Iterable[RowChunk]) -> typing.Iterator[bytes]:
+    for chunk in chunks:
+        names = list(chunk)
+        yield "".join(json.dumps(dict(zip(names, row))) + "\n" for row in zip(*chunk.values())).encode()
+
+def iter_csv(column_names: typing.List[str], chunks: typing.Iterable[RowChunk]) -> typing.Iterator[bytes]:
+    output = io.StringIO(newline="")
+    writer = csv.writer(output)
+    writer.writerow(column_names)
+    for chunk in chunks:
+        # Missing values are written as empty fields
+        writer.writerows(zip(*chunk.values()))
+        yield output.getvalue().encode()
+        output.seek(0)
+        output.truncate()
+    if output.tell():
+        yield output.getvalue().encode()
+
+def export(
+    config: "DatalakeConfig",
+    export_format: str,
+    column_types: typing.Dict[str, str],
+    date: typing.Optional[str] = None,
+    key: typing.Optional[str] = None,
+    start: typing.Optional[datetime.datetime] = None,
+    end: typing.Optional[datetime.datetime] = None
+) -> typing.Iterator[bytes]:
+    chunks = iter_chunks(config, column_types, date, key, start, end)
+    if export_format == "csv":
+        return iter_csv(list(column_types), chunks)
+    return iter_ndjson(chunks)
@@ -0,0 +1,300 @@
+import codecs
+import csv
+import json
+import re
+import typing
+from pathlib import PurePath
+from . import instrumentation
+from ..apibuilder.exceptions import ValueValidationError
+
+# A block of records stored column wise (column name -> values)
+RecordBatch = typing.Dict[str, typing.List[typing.Any]]
+
+
+def get_file_type(filename: typing.Optional[str], supported_types: typing.List[str]) -> str:
+    file_type = PurePath(filename or "").suffix.lstrip(".").lower()
+    if file_type not in supported_types:
+        raise ValueValidationError(
+            found=filename,
+            expected=f"a file with one of the following extensions {supported_types}",
+            user_message="Unsupported file type"
+        )
+    return file_type
+
+
+# An incomplete record (a line without its end, an open quoted field of a csv or an object of a json array) larger
+# than this is reported as invalid instead of waiting for the rest of it
+MAX_RECORD_SIZE = 16 * 1024 * 1024
+
+
+class StreamParser:
+    """Incrementally parses raw byte chunks into columnar record batches.
+
+    Only the current incomplete record and at most ``buffer_size`` bytes of parsed records are held in memory.
+    """
+    invalid_message = "Invalid file"
+
+    def __init__(self, buffer_size: int):
+        self.buffer_size = buffer_size
+        self.bytes_read = 0
+        self.rows_read = 0
+        # utf-8-sig drops a leading byte order mark if present
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        # Text after the last line end, kept as the chunks it arrived in until its line ends
+        self._pending: typing.List[str] = []
+        self._pending_size = 0
+        self._batch: RecordBatch = {}
+        self._batch_rows = 0
+        self._batch_bytes = 0
+
+    def feed(self, chunk: bytes) -> typing.List[RecordBatch]:
+        self.bytes_read += len(chunk)
+        return self._consume_text(self._decode(chunk))
+
+    def close(self) -> typing.List[RecordBatch]:
+        batches = self._consume_text(self._decode(b"", final=True), final=True)
+        if self._batch_rows:
+            batches.append(self._flush())
+        return batches
+
+    def _decode(self, chunk: bytes, final: bool = False) -> str:
+        try:
+            return self._decoder.decode(chunk, final)
+        except UnicodeDecodeError as e:
+            # e.object holds the bytes of the chunk and those of a character left incomplete by the previous one
+            raise self._invalid(f"Invalid utf-8 at byte {self.bytes_read - len(e.object) + e.start}: {e.reason}")
+
+    def _invalid(self, detail: str) -> ValueValidationError:
+        return ValueValidationError(detail=detail, user_message=self.invalid_message)
+
+    def _take_pending(self, text: str) -> str:
+        """The pending text followed by text"""
+        pending = "".join(self._pending) + text
+        self._pending = []
+        self._pending_size = 0
+        return pending
+
+    def _keep_pending(self, text: str):
+        self._pending.append(text)
+        self._pending_size += len(text)
+        if self._pending_size > MAX_RECORD_SIZE:
+            raise self._invalid(f"Record {self.rows_read + self._batch_rows + 1} is larger than {MAX_RECORD_SIZE} bytes")
+
+    def _consume_text(self, text: str, final: bool = False) -> typing.List[RecordBatch]:
+        if not final and "\n" not in text:
+            # Text is only joined once its line ends so a long line is not copied again for every chunk
+            self._keep_pending(text)
+            return []
+        lines = self._take_pending(text).split("\n")
+        if not final:
+            self._keep_pending(lines.pop())
+        return self._consume(lines, final)
+
+    def _consume(self, lines: typing.List[str], final: bool = False) -> typing.List[RecordBatch]:
+        batches = []
+        for line in lines:
+            if not line.strip(): continue
+            self._parse_line(line)
+            self._batch_bytes += len(line)
+            if self._batch_bytes >= self.buffer_size:
+                batches.append(self._flush())
+        return batches
+
+    def _flush(self) -> RecordBatch:
+        batch = self._batch
+        self.rows_read += self._batch_rows
+        self._batch = {column: [] for column in batch}
+        self._batch_rows = 0
+        self._batch_bytes = 0
+        return batch
+
+    def _parse_line(self, line: str):
+        raise NotImplementedError()
+
+
+class CSVStreamParser(StreamParser):
+    invalid_message = "Invalid CSV file"
+
+    def __init__(self, buffer_size: int):
+        super().__init__(buffer_size)
+        self._header: typing.Optional[typing.List[str]] = None
+        # Lines of the current record while one of its quoted fields is open
+        self._record: typing.List[str] = []
+        self._record_size = 0
+
+    def _consume(self, lines: typing.List[str], final: bool = False) -> typing.List[RecordBatch]:
+        # Quoted fields may contain new lines so only complete records are parsed. Only the new line is scanned to
+        # find whether it closes the open quoted field, so a record is never rescanned
+        records = []
+        for line in lines:
+            in_quotes = _ends_in_quotes(line, bool(self._record))
+            if self._record or in_quotes:
+                self._record.append(line)
+                self._record_size += len(line) + 1
+                if in_quotes:
+                    if self._record_size > MAX_RECORD_SIZE:
+                        raise ValueValidationError(
+                            detail=f"Unterminated quoted field on row {self.rows_read + self._batch_rows + len(records) + 1}",
+                            user_message="Invalid CSV file"
+                        )
+                    continue
+                line = "\n".join(self._record)
+                self._record = []
+                self._record_size = 0
+            records.append(line)
+        if final and self._record:
+            raise ValueValidationError(detail="Unterminated quoted field at end of file", user_message="Invalid CSV file")
+        return super()._consume(records, final)
+
+    def _parse_line(self, line: str):
+        values = next(csv.reader((line,)))
+        if self._header is None:
+            self._header = values
+            self._batch = {column: [] for column in values}
+            self._batch_bytes -= len(line)
+            return
+        if len(values) != len(self._header):
+            raise ValueValidationError(
+                found=f"{len(values)} fields on row {self.rows_read + self._batch_rows + 1}",
+                expected=f"{len(self._header)} fields",
+                user_message="Invalid CSV file"
+            )
+        for column_values, value in zip(self._batch.values(), values):
+            column_values.append(value)
+        self._batch_rows += 1
+
+
+def _ends_in_quotes(line: str, in_quotes: bool) -> bool:
+    """Whether a csv line (starting inside a quoted field if in_quotes) ends inside a quoted field.
+
+    Follows the csv module: a quote only opens a quoted field at the start of a field, elsewhere it is part of
+    the value, and "" within a quoted field is an escaped quote.
+    """
+    position = 0
+    while True:
+        quote = line.find('"', position)
+        if quote < 0: return in_quotes
+        if in_quotes:
+            if line.startswith('"', quote + 1):
+                position = quote + 2
+                continue
+            in_quotes = False
+        elif quote == 0 or (quote > position and line[quote - 1] == ","):
+            in_quotes = True
+        position = quote + 1
+
+
+# Parsing states of a top level json array
+ARRAY_START, ARRAY_VALUE_OR_END, ARRAY_VALUE, ARRAY_SEPARATOR, ARRAY_CLOSED = range(5)
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+class JSONStreamParser(StreamParser):
+    """Parses newline delimited json (one object per line) or a top level json array of objects.
+
+    The format is detected from the first character of the file. The objects of an array are decoded one at a
+    time as their text arrives so the array is never held in memory as a whole.
+    """
+    invalid_message = "Invalid JSON file"
+
+    def __init__(self, buffer_size: int):
+        super().__init__(buffer_size)
+        self._json = json.JSONDecoder()
+        # None until the first non whitespace character is read
+        self._array: typing.Optional[bool] = None
+        self._expect = ARRAY_START
+
+    def _consume_text(self, text: str, final: bool = False) -> typing.List[RecordBatch]:
+        if self._array is None:
+            text = text.lstrip()
+            if not text and not final: return []
+            self._array = text.startswith("[")
+        if self._array:
+            return self._consume_array(text, final)
+        return super()._consume_text(text, final)
+
+    def _consume_array(self, text: str, final: bool) -> typing.List[RecordBatch]:
+        text = self._take_pending(text)
+        position = 0
+        batches = []
+        while True:
+            position = _WHITESPACE.match(text, position).end()
+            if position == len(text): break
+            character = text[position]
+            if self._expect == ARRAY_START:
+                self._expect = ARRAY_VALUE_OR_END
+                position += 1
+            elif self._expect == ARRAY_SEPARATOR and character in ",]":
+                self._expect = ARRAY_VALUE if character == "," else ARRAY_CLOSED
+                position += 1
+            elif self._expect == ARRAY_VALUE_OR_END and character == "]":
+                self._expect = ARRAY_CLOSED
+                position += 1
+            elif self._expect in (ARRAY_VALUE, ARRAY_VALUE_OR_END):
+                if character != "{":
+                    raise self._invalid(f"Expected a json object at record {self.rows_read + self._batch_rows + 1}")
+                try:
+                    record, end = self._json.raw_decode(text, position)
+                except json.JSONDecodeError as e:
+                    # The rest of the object has not been read yet, unless the file ended or the object is too
+                    # large to be anything but invalid
+                    if final or len(text) - position > MAX_RECORD_SIZE:
+                        raise self._invalid(f"Invalid json at record {self.rows_read + self._batch_rows + 1}: {e.msg}")
+                    break
+                self._add_record(record)
+                self._batch_bytes += end - position
+                position = end
+                self._expect = ARRAY_SEPARATOR
+                if self._batch_bytes >= self.buffer_size:
+                    batches.append(self._flush())
+            elif self._expect == ARRAY_CLOSED:
+                raise self._invalid("Unexpected data after the end of the json array")
+            else:
+                raise self._invalid(f"Expected ',' or ']' after record {self.rows_read + self._batch_rows}")
+        if position < len(text):
+            self._pending.append(text[position:])
+            self._pending_size = len(text) - position
+        if final and self._expect != ARRAY_CLOSED:
+            raise self._invalid("Unterminated json array at end of file")
+        return batches
+
+    def _parse_line(self, line: str):
+        try:
+            record = self._json.decode(line)
+        except json.JSONDecodeError as e:
+            raise self._invalid(f"Invalid json on row {self.rows_read + self._batch_rows + 1}: {e}")
+        self._add_record(record)
+
+    def _add_record(self, record: typing.Any):
+        if not isinstance(record, dict):
+            raise ValueValidationError(found=type(record).__name__, expected="a json object per row", user_message="Invalid JSON file")
+        for column, value in record.items():
+            if column not in self._batch:
+                # Backfill columns first seen part way through a batch
+                self._batch[column] = [None] * self._batch_rows
+            self._batch[column].append(value)
+        self._batch_rows += 1
+        for column_values in self._batch.values():
+            if len(column_values) < self._batch_rows:
+                column_values.append(None)
+
+
+PARSERS: typing.Dict[str, typing.Type[StreamParser]] = {
+    "csv": CSVStreamParser,
+    "json": JSONStreamParser,
+}
+
+def get_parser(file_type: str, buffer_size: int) -> StreamParser:
+    return PARSERS[file_type](buffer_size)
+
+
+def read_batches(file: typing.BinaryIO, parser: StreamParser, chunk_size: int) -> typing.Iterator[RecordBatch]:
+    """Yields the record batches of a file read chunk_size bytes at a time"""
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk: break
+        with instrumentation.stage("parse"):
+            batches = parser.feed(chunk)
+        yield from batches
+    with instrumentation.stage("parse"):
+        batches = parser.close()
+    yield from batches
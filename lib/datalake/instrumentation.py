@@ -0,0 +1,87 @@
+import contextvars
+import time
+import typing
+from concurrent.futures import Future
+from contextlib import contextmanager
+from ..apibuilder import metrics
+
+if typing.TYPE_CHECKING:
+    from .executor import ProcessPool
+
+# Timings of the stages of ingest (parse, convert, encode, write, fsync, commit), queries (catalog, plan, scan,
+# merge) and optimise (compact, collect_garbage, rollup) and the rows and bytes read and written by each operation.
+# Stages are labelled with the operation running in the current context (see `operation`) so storage code shared
+# by uploads, /optimise and deletes is attributed to the right one.
+INGEST = "ingest"
+QUERY = "query"
+EXPORT = "export"
+OPTIMISE = "optimise"
+DELETE = "delete"
+
+STAGE_SECONDS = metrics.histogram(
+    "datalake_stage_duration_seconds", "Time spent in each stage of datalake operations", ("operation", "stage"),
+    (0.0005, 0.001, 0.0025) + metrics.DEFAULT_BUCKETS
+)
+ROWS_READ = metrics.counter("datalake_read_rows_total", "Rows read by datalake operations", ("operation",))
+BYTES_READ = metrics.counter("datalake_read_bytes_total", "Bytes of uploads and stored data read by datalake operations", ("operation",))
+ROWS_WRITTEN = metrics.counter("datalake_written_rows_total", "Rows written to parts by datalake operations", ("operation",))
+BYTES_WRITTEN = metrics.counter("datalake_written_bytes_total", "Bytes of parts written by datalake operations", ("operation",))
+
+_operation: contextvars.ContextVar[str] = contextvars.ContextVar("datalake_operation", default="other")
+
+@contextmanager
+def operation(name: str) -> typing.Iterator[None]:
+    token = _operation.set(name)
+    try:
+        yield
+    finally:
+        _operation.reset(token)
+
+@contextmanager
+def stage(name: str) -> typing.Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(_operation.get(), name).observe(time.perf_counter() - started)
+
+def read(rows: int, size: int, operation_name: typing.Optional[str] = None):
+    operation_name = operation_name or _operation.get()
+    ROWS_READ.labels(operation_name).inc(rows)
+    BYTES_READ.labels(operation_name).inc(size)
+
+def written(rows: int, size: int):
+    ROWS_WRITTEN.labels(_operation.get()).inc(rows)
+    BYTES_WRITTEN.labels(_operation.get()).inc(size)
+
+
+def submit(executor: "ProcessPool", fn: typing.Callable[..., typing.Any], *args: typing.Any) -> Future:
+    """Submits fn(*args) to a process pool under the current operation. Get its result with `result`"""
+    return executor.submit(_run_recorded, _operation.get(), fn, *args)
+
+def _run_recorded(operation_name: str, fn: typing.Callable[..., typing.Any], *args: typing.Any) -> typing.Tuple[typing.Any, metrics.Samples]:
+    with operation(operation_name):
+        return metrics.run_recorded(fn, *args)
+
+def result(future: Future) -> typing.Any:
+    """The result of a task of `submit`, merging the metrics it recorded into this process"""
+    value, samples = future.result()
+    metrics.merge(samples)
+    return value
+
+
+def _cache_stats() -> typing.Dict[str, int]:
+    from .cache import get_info_cache
+    return get_info_cache().stats()
+
+def _executor():
+    from .executor import get_executor
+    return get_executor()
+
+metrics.callback("datalake_info_cache_hits_total", "Hits of the /info cache", lambda: {(): _cache_stats()["hits"]}, "counter")
+metrics.callback("datalake_info_cache_misses_total", "Misses of the /info cache", lambda: {(): _cache_stats()["misses"]}, "counter")
+metrics.callback("datalake_info_cache_evictions_total", "Entries evicted from the /info cache", lambda: {(): _cache_stats()["evictions"]}, "counter")
+metrics.callback("datalake_info_cache_entries", "Entries in the /info cache", lambda: {(): _cache_stats()["entries"]})
+metrics.callback("datalake_info_cache_bytes", "Estimated size of the /info cache", lambda: {(): _cache_stats()["size_bytes"]})
+metrics.callback("datalake_executor_pending_requests", "Requests admitted to the executor", lambda: {(): _executor().pending})
+metrics.callback("datalake_executor_rejected_total", "Requests rejected with a 503 by the executor", lambda: {(): _executor().rejected}, "counter")
@@ -0,0 +1,136 @@
+import json
+import os
+import time
+import typing
+import uuid
+from concurrent.futures import Future
+from functools import lru_cache
+from pathlib import Path
+from . import catalog, compaction, instrumentation, rollups, snapshots
+from .executor import ProcessPool
+
+if typing.TYPE_CHECKING:
+    from ..models.config import DatalakeConfig
+
+# Job state is kept in files under the data directory so any api process can report on a job
+JOBS_DIRECTORY = "_jobs"
+
+PENDING = "pending"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+def _job_path(data_directory: str, job_id: str) -> Path:
+    return Path(data_directory) / JOBS_DIRECTORY / f"{job_id}.json"
+
+def _write_job(data_directory: str, job: typing.Dict[str, typing.Any]):
+    path = _job_path(data_directory, job["id"])
+    temporary_path = path.with_name(f".{path.name}.{os.getpid()}")
+    temporary_path.write_text(json.dumps(job))
+    os.replace(temporary_path, path)
+
+def get_job(config: "DatalakeConfig", job_id: str) -> typing.Optional[typing.Dict[str, typing.Any]]:
+    try:
+        path = _job_path(config.data_directory, str(uuid.UUID(job_id)))
+        return json.loads(path.read_text())
+    except (ValueError, FileNotFoundError):
+        return None
+
+
+@lru_cache(maxsize=1)
+def _get_executor(max_workers: int) -> ProcessPool:
+    return ProcessPool(max_workers)
+
+def submit(config: "DatalakeConfig", kind: str, fn: typing.Callable[..., typing.Dict[str, typing.Any]], on_done: typing.Optional[typing.Callable[[typing.Dict[str, typing.Any]], None]] = None) -> typing.Dict[str, typing.Any]:
+    """Runs fn(config, progress) in the job process pool and returns the initial state of the job.
+
+    fn must be picklable and returns the result of the job. progress(**fields) updates the reported state.
+    on_done is called in this process with the result once the job completes.
+    """
+    (Path(config.data_directory) / JOBS_DIRECTORY).mkdir(parents=True, exist_ok=True)
+    _remove_expired(config)
+    job = {"id": str(uuid.uuid4()), "kind": kind, "status": PENDING, "created": time.time(), "progress": {}, "result": None, "error": None}
+    _write_job(config.data_directory, job)
+    future: Future = instrumentation.submit(_get_executor(config.job_workers), _run, config.dict(), job, fn)
+    def done_callback(future: Future):
+        error = future.exception()
+        if error is None:
+            result = instrumentation.result(future)
+            if on_done is not None:
+                on_done(result)
+            return
+        # The job reports its own errors, unless its process died (e.g. killed when out of memory)
+        state = get_job(config, job["id"]) or job
+        if state["status"] in (PENDING, RUNNING):
+            _write_job(config.data_directory, {**state, "status": FAILED, "error": repr(error), "finished": time.time()})
+    future.add_done_callback(done_callback)
+    return job
+
+
+def _run(config_dict: typing.Dict[str, typing.Any], job: typing.Dict[str, typing.Any], fn: typing.Callable[..., typing.Dict[str, typing.Any]]) -> typing.Dict[str, typing.Any]:
+    from ..models.config import DatalakeConfig
+    config = DatalakeConfig(**config_dict)
+
+    last_write = time.monotonic()
+    def progress(**fields):
+        nonlocal last_write
+        job["progress"].update(fields)
+        # Progress is reported at most a few times a second
+        if time.monotonic() - last_write >= 0.5:
+            _write_job(config.data_directory, job)
+            last_write = time.monotonic()
+
+    job["status"] = RUNNING
+    _write_job(config.data_directory, job)
+    try:
+        result = fn(config, progress)
+    except Exception as e:
+        job["status"] = FAILED
+        job["error"] = repr(e)
+        job["finished"] = time.time()
+        _write_job(config.data_directory, job)
+        raise
+    job["status"] = COMPLETED
+    job["result"] = result
+    job["finished"] = time.time()
+    _write_job(config.data_directory, job)
+    return result
+
+
+def _remove_expired(config: "DatalakeConfig"):
+    expiry = time.time() - config.job_retention_seconds
+    for path in (Path(config.data_directory) / JOBS_DIRECTORY).glob("*.json"):
+        try:
+            job = json.loads(path.read_text())
+        except (ValueError, FileNotFoundError):
+            continue
+        if job.get("finished") is not None and job["finished"] < expiry:
+            path.unlink(missing_ok=True)
+
+
+def optimise(config: "DatalakeConfig", progress: typing.Callable[..., None]) -> typing.Dict[str, typing.Any]:
+    with catalog.connect(config) as connection:
+        size_before = catalog.total_size(connection)
+    with instrumentation.operation(instrumentation.OPTIMISE):
+        with instrumentation.stage("compact"):
+            result = compaction.compact(
+                config,
+                lambda done, total, bytes_rewritten: progress(partitions_done=done, partitions_total=total, bytes_rewritten=bytes_rewritten)
+            )
+        with catalog.connect(config) as connection:
+            size_after = catalog.total_size(connection)
+        with instrumentation.stage("collect_garbage"):
+            snapshots.collect_garbage(config)
+        with instrumentation.stage("rollup"):
+            partitions_rolled_up = rollups.refresh(config)
+    return {
+        "size_before": size_before,
+        "size_after": size_after,
+        "bytes_saved": result.bytes_before - result.bytes_after,
+        "files_before": result.files_before,
+        "files_after": result.files_after,
+        "partitions_compacted": len(result.partitions),
+        "partitions_rolled_up": partitions_rolled_up,
+        "partitions": result.partitions,
+    }
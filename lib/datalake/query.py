@@ -0,0 +1,197 @@
+import datetime
+import typing
+from pathlib import Path
+from . import aggregate, catalog, columns, instrumentation, rollups, snapshots, storage
+from .sketches import ColumnSketch
+from .stats import ColumnStats
+from ..apibuilder.exceptions import ValueValidationError
+
+if typing.TYPE_CHECKING:
+    from ..models.config import DatalakeConfig
+
+
+class ColumnSummary(typing.NamedTuple):
+    min_value: float
+    max_value: float
+    mean_value: float
+    number_of_files: int
+    total_records: int
+    # Approximate quantiles and distinct count, see lib.datalake.sketches for their accuracy
+    p50: typing.Optional[float] = None
+    p95: typing.Optional[float] = None
+    p99: typing.Optional[float] = None
+    distinct_count: typing.Optional[int] = None
+
+
+class ValueSummary(typing.NamedTuple):
+    min_value: float
+    max_value: float
+    mean_value: float
+    # Non missing values
+    count: int
+    p50: typing.Optional[float] = None
+    p95: typing.Optional[float] = None
+    p99: typing.Optional[float] = None
+    distinct_count: typing.Optional[int] = None
+
+    @classmethod
+    def from_stats(cls, stats: typing.Optional[ColumnStats], sketch: typing.Optional[ColumnSketch] = None) -> "ValueSummary":
+        if stats is None or not stats.count:
+            return cls(0, 0, 0, 0)
+        if sketch is None:
+            return cls(stats.min, stats.max, stats.mean, stats.count)
+        # The estimates are clamped to the exact bounds
+        p50, p95, p99 = (min(max(sketch.quantiles.quantile(q), stats.min), stats.max) for q in (0.5, 0.95, 0.99))
+        return cls(stats.min, stats.max, stats.mean, stats.count, p50, p95, p99, min(round(sketch.distinct.estimate()), stats.count))
+
+
+class GroupSummary(typing.NamedTuple):
+    # None unless grouped by
+    date: typing.Optional[str]
+    key: typing.Optional[str]
+    number_of_files: int
+    total_records: int
+    columns: typing.Dict[str, ValueSummary]
+
+
+# Fields the statistics can be grouped by. Every part belongs to a single day and key so groups are sets of parts
+GROUP_BY_FIELDS = ("date", "key")
+
+
+def summarise_column(
+    config: "DatalakeConfig",
+    column: str,
+    date: typing.Optional[str] = None,
+    key: typing.Optional[str] = None,
+    start: typing.Optional[datetime.datetime] = None,
+    end: typing.Optional[datetime.datetime] = None,
+    approximate: bool = False
+) -> ColumnSummary:
+    """Statistics of a numeric column over the rows of the date and key with start <= timestamp < end (all if not given).
+
+    With approximate the quantiles and distinct count of int64 and float64 columns are estimated from sketches.
+    """
+    groups = summarise_columns(config, [column], (), date, key, start, end, approximate)
+    if not groups:
+        return ColumnSummary(0, 0, 0, 0, 0)
+    summary = groups[0].columns[column]
+    return ColumnSummary(
+        summary.min_value, summary.max_value, summary.mean_value, groups[0].number_of_files, groups[0].total_records,
+        summary.p50, summary.p95, summary.p99, summary.distinct_count
+    )
+
+
+def summarise_columns(
+    config: "DatalakeConfig",
+    column_names: typing.List[str],
+    group_by: typing.Sequence[str] = (),
+    date: typing.Optional[str] = None,
+    key: typing.Optional[str] = None,
+    start: typing.Optional[datetime.datetime] = None,
+    end: typing.Optional[datetime.datetime] = None,
+    approximate: bool = False
+) -> typing.List[GroupSummary]:
+    """Statistics of numeric columns over the rows of the date and key with start <= timestamp < end, grouped by
+    day and/or key. Every column is computed in the same pass over the parts. Groups without rows are left out.
+    """
+    invalid = [field for field in group_by if field not in GROUP_BY_FIELDS]
+    if invalid:
+        raise ValueValidationError(found=invalid, expected=f"fields of {list(GROUP_BY_FIELDS)}", user_message="Invalid group by")
+    group_by = tuple(field for field in GROUP_BY_FIELDS if field in group_by)
+    column_names = list(dict.fromkeys(column_names))
+    if date is not None:
+        date = storage.parse_date(date).isoformat()
+    since, before = storage.date_bounds(start, end)
+    time_range = (storage.micros_or_none(start), storage.micros_or_none(end))
+    # Rollups hold no sketches so approximate queries read the parts
+    use_rollups = config.info_use_rollups and not approximate and rollups.aligned(time_range)
+    # The parts are pinned so their files outlive a concurrent /optimise or delete until the scan is done
+    with instrumentation.operation(instrumentation.QUERY), snapshots.pin(config):
+        with instrumentation.stage("catalog"), catalog.connect(config) as connection:
+            parts = catalog.find_parts(connection, date=date, key=key, since=since, before=before)
+            partition_rollups = catalog.find_rollups(connection, date=date, key=key, since=since, before=before) if use_rollups else {}
+        groups = _summarise_parts(config, parts, column_names, group_by, time_range, approximate, rollups.select(partition_rollups, time_range))
+    return [
+        GroupSummary(
+            **{field: value for field, value in zip(group_by, group)},
+            **{field: None for field in GROUP_BY_FIELDS if field not in group_by},
+            number_of_files=result.files,
+            total_records=result.rows,
+            columns={column: ValueSummary.from_stats(result.stats.get(column), result.sketches.get(column)) for column in column_names}
+        )
+        for group, result in sorted(groups.items())
+    ]
+
+
+def _summarise_parts(
+    config: "DatalakeConfig",
+    parts: typing.List[storage.PartInfo],
+    column_names: typing.List[str],
+    group_by: typing.Sequence[str],
+    time_range: aggregate.TimeRange,
+    approximate: bool,
+    partition_rollups: typing.Dict[rollups.Partition, typing.List[catalog.Rollup]]
+) -> typing.Dict[aggregate.GroupKey, aggregate.ScanResult]:
+    root_directory = Path(config.data_directory)
+    from_stats: typing.Dict[aggregate.GroupKey, aggregate.ScanResult] = {}
+    matched = False
+    found = set()
+    to_scan, to_scan_range = [], []
+    with instrumentation.stage("plan"):
+        for info in parts:
+            part = storage.Part.from_info(root_directory, info)
+            # Parts entirely within the time range are answered from their statistics, parts overlapping it are scanned
+            overlap = _overlap(part, config.timeseries_column, *time_range)
+            if overlap is None: continue
+            matched = True
+            stats, sketches = {}, {}
+            answered = overlap == _WHOLE and config.info_use_statistics
+            for column in column_names:
+                column_type = part.column_type(column)
+                if column_type is None: continue
+                if column_type not in columns.NUMERIC_TYPES:
+                    raise ValueValidationError(found=column_type, expected="a numeric column", user_message=f"Statistics are not available for column '{column}'")
+                found.add(column)
+                if not answered: continue
+                part_stats = part.stats(column)
+                sketch = part.sketch(column) if approximate and column_type in columns.SKETCH_TYPES else None
+                if part_stats is None or (sketch is None and approximate and column_type in columns.SKETCH_TYPES):
+                    answered = False
+                    continue
+                stats[column] = part_stats.scaled(columns.stats_scale(column_type))
+                if sketch is not None:
+                    sketches[column] = sketch
+            if (info.date, info.key) in partition_rollups:
+                continue
+            if overlap == _PARTIAL:
+                to_scan_range.append(info)
+            elif not answered:
+                to_scan.append(info)
+            else:
+                group = aggregate.group_key(info, group_by)
+                result = aggregate.ScanResult(1, part.rows, stats, sketches)
+                from_stats[group] = from_stats[group].merge(result) if group in from_stats else result
+    missing = [column for column in column_names if column not in found]
+    if matched and missing:
+        raise ValueValidationError(found=missing[0], expected="a column present in the uploaded data", user_message="Unknown column")
+    results = [from_stats, rollups.summarise(partition_rollups, column_names, group_by)]
+    with instrumentation.stage("scan"):
+        if to_scan:
+            results.append(aggregate.scan(config, to_scan, column_names, group_by=group_by, with_sketches=approximate))
+        if to_scan_range:
+            results.append(aggregate.scan(config, to_scan_range, column_names, time_range, group_by, approximate))
+    with instrumentation.stage("merge"):
+        return aggregate.merge_groups(results)
+
+
+_WHOLE = "whole"
+_PARTIAL = "partial"
+
+def _overlap(part: storage.Part, timeseries_column: str, start: typing.Optional[int], end: typing.Optional[int]) -> typing.Optional[str]:
+    """Whether all, some (_PARTIAL) or none (None) of the rows of the part can be in the time range"""
+    if start is None and end is None: return _WHOLE
+    bounds = part.stats(timeseries_column)
+    if bounds is None or not bounds.count: return _PARTIAL
+    if (start is not None and bounds.max < start) or (end is not None and bounds.min >= end): return None
+    if (start is None or bounds.min >= start) and (end is None or bounds.max < end): return _WHOLE
+    return _PARTIAL
@@ -0,0 +1,95 @@
+import datetime
+import sqlite3
+import typing
+from . import catalog, instrumentation, snapshots, storage
+from ..apibuilder.exceptions import NavigatorAPIException, TracebackSkip, ValueValidationError
+
+if typing.TYPE_CHECKING:
+    from ..models.config import DatalakeConfig
+
+
+class DeleteResult(typing.NamedTuple):
+    size_before: int
+    size_after: int
+    partitions: typing.List[typing.Tuple[str, str]]
+
+
+# Times the boundary parts are rewritten when uploads or compactions keep changing them before giving up
+DELETE_ATTEMPTS = 5
+
+
+def delete_range(
+    config: "DatalakeConfig",
+    start: typing.Optional[datetime.datetime] = None,
+    end: typing.Optional[datetime.datetime] = None,
+    key: typing.Optional[str] = None
+) -> DeleteResult:
+    """Deletes the rows with start <= timestamp < end (unbounded if not given) for the key (all keys if not given).
+
+    Partitions of whole days within the range are removed from the catalog without reading them. Only the
+    partitions of the first and last day are rewritten when the range does not start or end at midnight.
+    The boundary parts are rewritten outside the catalog write lock so uploads keep committing meanwhile, and
+    rewritten again if they changed before the rewrite is committed. The files of removed parts are left for
+    snapshots.collect_garbage.
+    """
+    if start is not None and end is not None and start >= end:
+        raise ValueValidationError(found=f"{start.isoformat()} to {end.isoformat()}", expected="a start before the end", user_message="Invalid time range")
+    midnight = datetime.time()
+    first_whole_day = None
+    if start is not None:
+        first_whole_day = start.date() if start.time() == midnight else start.date() + datetime.timedelta(days=1)
+    boundary_days = dict.fromkeys(
+        timestamp.date().isoformat() for timestamp in (start, end) if timestamp is not None and timestamp.time() != midnight
+    )
+    with instrumentation.operation(instrumentation.DELETE):
+        for _ in range(DELETE_ATTEMPTS):
+            result = _delete_range(config, start, end, key, first_whole_day, list(boundary_days))
+            if result is not None: return result
+    raise NavigatorAPIException(
+        "The lake is busy, try again later", 503, f"The parts of {list(boundary_days)} changed during {DELETE_ATTEMPTS} attempts to delete",
+        TracebackSkip, headers={"Retry-After": "1"}
+    )
+
+
+def _delete_range(
+    config: "DatalakeConfig",
+    start: typing.Optional[datetime.datetime],
+    end: typing.Optional[datetime.datetime],
+    key: typing.Optional[str],
+    first_whole_day: typing.Optional[datetime.date],
+    boundary_days: typing.List[str]
+) -> typing.Optional[DeleteResult]:
+    # The boundary parts are pinned while they are read so garbage collection can not remove their files
+    with snapshots.pin(config):
+        with catalog.connect(config) as connection:
+            boundary_parts = _find_parts(connection, boundary_days, key)
+        removed, added = storage.truncate_parts(config, boundary_parts, storage.micros_or_none(start), storage.micros_or_none(end))
+    try:
+        with catalog.connect(config, write=True) as connection:
+            # Parts added by uploads since the boundary parts were read may hold rows in the range, the truncated
+            # parts are only valid if the boundary days still have exactly the parts that were read
+            changed = [part.path for part in _find_parts(connection, boundary_days, key)] != [part.path for part in boundary_parts]
+            if not changed:
+                size_before = catalog.total_size(connection)
+                partitions = catalog.find_partitions(
+                    connection, key=key,
+                    since=None if first_whole_day is None else first_whole_day.isoformat(),
+                    before=None if end is None else end.date().isoformat()
+                )
+                catalog.remove_partitions(connection, partitions)
+                if removed:
+                    catalog.replace_parts(connection, removed, added)
+                partitions.extend(dict.fromkeys((part.date, part.key) for part in removed))
+                size_after = catalog.total_size(connection)
+    except BaseException:
+        storage.discard_parts(config, added)
+        raise
+    if changed:
+        # The truncated parts were never visible to anyone
+        storage.discard_parts(config, added)
+        return None
+    return DeleteResult(size_before, size_after, partitions)
+
+
+def _find_parts(connection: sqlite3.Connection, days: typing.List[str], key: typing.Optional[str]) -> typing.List[storage.PartInfo]:
+    return [part for day in days for part in catalog.find_parts(connection, date=day, key=key)]
@@ -0,0 +1,160 @@
+import functools
+import operator
+import typing
+from pathlib import Path
+import numpy as np
+from . import aggregate, catalog, columns, snapshots, storage
+from .stats import ColumnStats
+
+if typing.TYPE_CHECKING:
+    from ..models.config import DatalakeConfig
+
+# Count, sum, min and max of every numeric column per partition (key and day) and per hour of the partition,
+# kept in the catalog. /optimise builds them for the partitions changed since its last run, and any change to the
+# parts of a partition (uploads, compaction, deletes) removes its rollups in the same transaction, so rollups are
+# never stale. Queries with a time range aligned to hours read the rollups of the partitions that have them
+# instead of their parts.
+HOUR = 60 * 60 * 1_000_000
+DAY = 24 * HOUR
+HOUR_PERIOD = "hour"
+DAY_PERIOD = "day"
+# Hourly rollups record the parts with rows in the hour as a bit mask so the number of files of several hours can
+# be counted. Partitions with more parts are only answered from rollups when a single rollup covers the query
+MAX_MASK_PARTS = 62
+
+Partition = typing.Tuple[str, str]
+
+
+def _segment_stats(values: np.ndarray, starts: np.ndarray, counts: np.ndarray) -> typing.List[ColumnStats]:
+    """Statistics of the consecutive segments of values beginning at starts"""
+    values = values.astype(np.float64)
+    valid = ~np.isnan(values)
+    counts = np.add.reduceat(valid, starts) if not valid.all() else counts
+    sums = np.add.reduceat(np.where(valid, values, 0), starts)
+    minimums = np.minimum.reduceat(np.where(valid, values, np.inf), starts)
+    maximums = np.maximum.reduceat(np.where(valid, values, -np.inf), starts)
+    return [
+        ColumnStats(int(count), float(total / count), float(minimum), float(maximum)) if count else ColumnStats()
+        for count, total, minimum, maximum in zip(counts.tolist(), sums.tolist(), minimums.tolist(), maximums.tolist())
+    ]
+
+
+def build(config: "DatalakeConfig", date: str, key: str, parts: typing.List[storage.PartInfo]) -> typing.List[catalog.Rollup]:
+    """Computes the hourly and daily rollups of the parts of a partition"""
+    root_directory = Path(config.data_directory)
+    parts = sorted(parts, key=lambda info: info.path)
+    with_mask = len(parts) <= MAX_MASK_PARTS
+    # Hour start -> [rows, files, part mask, column statistics]
+    hours: typing.Dict[int, typing.List[typing.Any]] = {}
+    for ordinal, info in enumerate(parts):
+        part = storage.Part.from_info(root_directory, info)
+        if not part.rows: continue
+        hour_starts = np.asarray(part.map_column(config.timeseries_column)) // HOUR * HOUR
+        order = None
+        if (hour_starts[1:] < hour_starts[:-1]).any():
+            order = np.argsort(hour_starts, kind="stable")
+            hour_starts = hour_starts[order]
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(hour_starts)) + 1))
+        counts = np.diff(np.append(starts, len(hour_starts)))
+        column_stats = {}
+        for column in part.columns:
+            column_type = part.column_type(column)
+            if column_type not in columns.NUMERIC_TYPES: continue
+            values = np.asarray(part.map_column(column))
+            if order is not None:
+                values = values[order]
+            scale = columns.stats_scale(column_type)
+            column_stats[column] = [stats.scaled(scale) for stats in _segment_stats(values, starts, counts)]
+        for segment, hour in enumerate(hour_starts[starts].tolist()):
+            rollup = hours.setdefault(hour, [0, 0, 0, {}])
+            rollup[0] += int(counts[segment])
+            rollup[1] += 1
+            rollup[2] |= 1 << ordinal
+            for column, segments in column_stats.items():
+                rollup[3].setdefault(column, ColumnStats()).merge(segments[segment])
+    if not hours: return []
+    rollups = [
+        catalog.Rollup(
+            date, key, HOUR_PERIOD, hour, rows, files, mask if with_mask else None,
+            {column: stats.to_dict() for column, stats in column_stats.items()}
+        )
+        for hour, (rows, files, mask, column_stats) in sorted(hours.items())
+    ]
+    day_stats: typing.Dict[str, ColumnStats] = {}
+    for _, _, _, column_stats in hours.values():
+        for column, stats in column_stats.items():
+            day_stats.setdefault(column, ColumnStats()).merge(stats)
+    part_mask = functools.reduce(operator.or_, (mask for _, _, mask, _ in hours.values()))
+    rollups.append(catalog.Rollup(
+        date, key, DAY_PERIOD, min(hours) // DAY * DAY, sum(rows for rows, _, _, _ in hours.values()), bin(part_mask).count("1"),
+        part_mask if with_mask else None, {column: stats.to_dict() for column, stats in day_stats.items()}
+    ))
+    return rollups
+
+
+def refresh(config: "DatalakeConfig") -> int:
+    """Builds the rollups of the partitions changed since their rollups were built. Returns the partitions rolled up"""
+    with catalog.connect(config) as connection:
+        partitions = catalog.find_partitions_without_rollups(connection)
+    refreshed = 0
+    for date, key in partitions:
+        # The parts are pinned so a concurrent delete can not remove their files while they are read
+        with snapshots.pin(config):
+            with catalog.connect(config) as connection:
+                version = catalog.partition_version(connection, date, key)
+                parts = catalog.find_parts(connection, date=date, key=key)
+            if version is None: continue
+            rollups = build(config, date, key, parts)
+        # Rollups of a partition changed while they were built are dropped, the next run builds them again
+        with catalog.connect(config, write=True) as connection:
+            refreshed += catalog.put_rollups(connection, date, key, version, rollups)
+    return refreshed
+
+
+def aligned(time_range: aggregate.TimeRange) -> bool:
+    return all(bound is None or bound % HOUR == 0 for bound in time_range)
+
+def select(
+    partition_rollups: typing.Dict[Partition, typing.List[catalog.Rollup]],
+    time_range: aggregate.TimeRange
+) -> typing.Dict[Partition, typing.List[catalog.Rollup]]:
+    """Picks the rollups answering the rows of each partition within an hour aligned time range.
+
+    Partitions the rollups can not answer are left out.
+    """
+    start, end = time_range
+    selected = {}
+    for partition, rollups in partition_rollups.items():
+        day = next((rollup for rollup in rollups if rollup.period == DAY_PERIOD), None)
+        if day is None or ((start is None or start <= day.start) and (end is None or day.start + DAY <= end)):
+            selected[partition] = [] if day is None else [day]
+            continue
+        hours = [
+            rollup for rollup in rollups
+            if rollup.period == HOUR_PERIOD and (start is None or rollup.start >= start) and (end is None or rollup.start < end)
+        ]
+        if len(hours) > 1 and any(rollup.part_mask is None for rollup in hours): continue
+        selected[partition] = hours
+    return selected
+
+def summarise(
+    selected: typing.Dict[Partition, typing.List[catalog.Rollup]],
+    column_names: typing.List[str],
+    group_by: typing.Sequence[str]
+) -> typing.Dict[aggregate.GroupKey, aggregate.ScanResult]:
+    results: typing.Dict[aggregate.GroupKey, aggregate.ScanResult] = {}
+    for rollups in selected.values():
+        if not rollups: continue
+        if len(rollups) == 1:
+            files = rollups[0].files
+        else:
+            files = bin(functools.reduce(operator.or_, (rollup.part_mask for rollup in rollups))).count("1")
+        stats: typing.Dict[str, ColumnStats] = {}
+        for rollup in rollups:
+            for column in column_names:
+                if column in rollup.stats:
+                    stats.setdefault(column, ColumnStats()).merge(ColumnStats.from_dict(rollup.stats[column]))
+        group = aggregate.group_key(rollups[0], group_by)
+        result = aggregate.ScanResult(files, sum(rollup.rows for rollup in rollups), stats)
+        results[group] = results[group].merge(result) if group in results else result
+    return results
@@ -0,0 +1,101 @@
+import sqlite3
+import typing
+from . import catalog, columns, storage
+from .ingest import RecordBatch
+from ..apibuilder.exceptions import ValueValidationError
+
+if typing.TYPE_CHECKING:
+    from ..models.config import DatalakeConfig
+
+# The lake has a single schema (the name and type of every column) kept in the catalog. It is inferred from the
+# first batch uploaded and every later batch is converted to it, so values are parsed once at upload and stored
+# typed. Integer columns are widened to float64 when a batch holds fractional or missing values. Columns of the
+# schema missing from a batch are left out of its parts.
+
+
+def infer_columns(config: "DatalakeConfig", batch: RecordBatch) -> typing.Dict[str, str]:
+    """Infers the type of every column of a batch. The timeseries column is a timestamp and the key column a string"""
+    column_types = {}
+    for column, values in batch.items():
+        if column == config.timeseries_column:
+            column_types[column] = columns.TIMESTAMP
+        elif column == config.key_column:
+            column_types[column] = columns.STRING
+        else:
+            column_types[column] = columns.infer_type(values)
+    return column_types
+
+
+def _invalid_value(config: "DatalakeConfig", column: str, column_type: str, values: typing.List[typing.Any]) -> ValueValidationError:
+    for row, value in enumerate(values):
+        try:
+            columns.convert(column_type, [value])
+        except (ValueError, TypeError, OverflowError):
+            break
+    if column == config.timeseries_column:
+        return ValueValidationError(found=value, expected=f"a timestamp in '{column}' (row {row + 1} of batch)", user_message="Invalid timestamp")
+    return ValueValidationError(
+        found=value, expected=f"a {column_type} value in column '{column}' (row {row + 1} of batch)", user_message="Value does not match the schema"
+    )
+
+def _convert(config: "DatalakeConfig", column: str, column_type: str, values: typing.List[typing.Any]) -> storage.TypedColumn:
+    try:
+        return column_type, columns.convert(column_type, values)
+    except (ValueError, TypeError, OverflowError):
+        if column_type != columns.INT64:
+            raise _invalid_value(config, column, column_type, values)
+    try:
+        return columns.FLOAT64, columns.convert(columns.FLOAT64, values)
+    except (ValueError, TypeError, OverflowError):
+        raise _invalid_value(config, column, column_type, values)
+
+
+def apply(config: "DatalakeConfig", schema: typing.Dict[str, str], batch: RecordBatch) -> typing.Dict[str, storage.TypedColumn]:
+    """Converts a batch to a schema (the lake schema or the schema of the previous batches of an upload), inferring
+    the type of columns it does not have. The catalog is not changed, see `updated` and `register`.
+    """
+    for column in (config.timeseries_column, config.key_column):
+        if column not in batch:
+            raise ValueValidationError(found=list(batch.keys()), expected=f"a '{column}' column", user_message="Missing required column")
+    new_columns = [column for column in batch if column not in schema]
+    if schema and new_columns and not config.schema_allow_new_columns:
+        raise ValueValidationError(found=new_columns, expected=f"only the columns {list(schema)}", user_message="Columns not in schema")
+    column_types = {**infer_columns(config, {column: batch[column] for column in new_columns}), **schema}
+    return {column: _convert(config, column, column_types[column], values) for column, values in batch.items()}
+
+def updated(schema: typing.Dict[str, str], data: typing.Dict[str, storage.TypedColumn]) -> typing.Dict[str, str]:
+    """The schema with the new and widened columns of a converted batch"""
+    return {**schema, **{column: column_type for column, (column_type, _) in data.items()}}
+
+
+def register(config: "DatalakeConfig", connection: sqlite3.Connection, parts: typing.List[storage.PartInfo]):
+    """Registers the columns of the parts of an upload in the lake schema.
+
+    Must be called in the write transaction adding the parts. Uploads convert their data to the schema read when
+    they started, so the columns are checked again against the schema committed by concurrent uploads since.
+    """
+    registered = catalog.get_columns(connection)
+    part_types: typing.Dict[str, typing.Set[str]] = {}
+    for part in parts:
+        for column in part.columns:
+            part_types.setdefault(column["name"], set()).add(column["type"])
+    new_columns = [column for column in part_types if column not in registered]
+    if registered and new_columns and not config.schema_allow_new_columns:
+        raise ValueValidationError(found=new_columns, expected=f"only the columns {list(registered)}", user_message="Columns not in schema")
+    changed = {}
+    for column, types in part_types.items():
+        if column in registered:
+            types = types | {registered[column]}
+        if len(types) == 1:
+            column_type = next(iter(types))
+        elif types <= {columns.INT64, columns.FLOAT64}:
+            # Integer columns are widened to float64
+            column_type = columns.FLOAT64
+        else:
+            raise ValueValidationError(
+                found=sorted(types), expected=f"a single type for column '{column}'", user_message="Value does not match the schema"
+            )
+        if registered.get(column) != column_type:
+            changed[column] = column_type
+    if changed:
+        catalog.register_columns(connection, changed)
@@ -0,0 +1,155 @@
+import os
+import shutil
+import typing
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from . import catalog, storage
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+if typing.TYPE_CHECKING:
+    from ..models.config import DatalakeConfig
+
+# Snapshot isolation between readers and the writers that remove parts (/optimise and deletes).
+# Every catalog transaction that adds or removes parts commits a new lake version. Removed parts are only retired
+# in the catalog, their files stay on disk. A reader pins the version it reads with a pin file under _pins that it
+# holds an exclusive file lock on, so the pins of readers in every process are visible and the pins of crashed
+# processes are detected. The files of a retired part are removed once no pin is older than the version that
+# removed it. Readers never wait on writers: catalog reads are WAL snapshots and pins never block.
+PINS_DIRECTORY = "_pins"
+PIN_SUFFIX = ".pin"
+# Every api process holds a shared lock on this file while it runs, see recover
+LEASE_FILE = "_lease"
+_leases: typing.Dict[str, typing.TextIO] = {}
+
+
+@contextmanager
+def pin(config: "DatalakeConfig") -> typing.Iterator[int]:
+    """Keeps the files of every part visible in the catalog from the start of the block until it exits.
+
+    Read the catalog inside the block. Yields the pinned version.
+    """
+    directory = Path(config.data_directory) / PINS_DIRECTORY
+    directory.mkdir(parents=True, exist_ok=True)
+    with catalog.connect(config) as connection:
+        version = catalog.current_version(connection)
+    # The pin is locked before it is renamed into place so it is never mistaken for the pin of a crashed reader
+    name = uuid.uuid4().hex
+    temporary_path = directory / f"{storage.TEMPORARY_PREFIX}{name}"
+    path = directory / f"{name}{PIN_SUFFIX}"
+    f = open(temporary_path, "w")
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        f.write(str(version))
+        f.flush()
+        os.replace(temporary_path, path)
+        try:
+            yield version
+        finally:
+            path.unlink()
+    finally:
+        f.close()
+        if temporary_path.exists():
+            temporary_path.unlink()
+
+
+def pinned_versions(config: "DatalakeConfig") -> typing.List[int]:
+    """Returns the versions pinned by live readers, removing the pins of readers that no longer exist"""
+    versions = []
+    for path in (Path(config.data_directory) / PINS_DIRECTORY).glob(f"*{PIN_SUFFIX}"):
+        try:
+            f = open(path)
+        except FileNotFoundError:
+            continue
+        with f:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    versions.append(int(f.read()))
+                    continue
+                # The lock was released without removing the pin, its reader crashed
+                path.unlink(missing_ok=True)
+                continue
+            versions.append(int(f.read()))
+    return versions
+
+
+def collect_garbage(config: "DatalakeConfig") -> int:
+    """Removes the files of retired parts that no pinned reader can see. Returns the number of parts removed"""
+    # The current version must be read before the pins. A reader pinning after the pins are listed reads a
+    # version at least as new, so none of the parts it sees can have been retired at or before it
+    with catalog.connect(config) as connection:
+        oldest = catalog.current_version(connection)
+    oldest = min([oldest, *pinned_versions(config)])
+    with catalog.connect(config) as connection:
+        paths = catalog.find_retired_parts(connection, oldest)
+    if not paths: return 0
+    root_directory = Path(config.data_directory)
+    trash = storage.trash_directory(config)
+    trash.mkdir()
+    for path in paths:
+        part = root_directory / path
+        try:
+            part.rename(trash / part.name)
+        except FileNotFoundError:
+            pass
+        storage.remove_empty_partition(part.parent)
+    with catalog.connect(config, write=True) as connection:
+        catalog.forget_retired_parts(connection, paths)
+    storage.remove_trash(trash)
+    return len(paths)
+
+
+def recover(config: "DatalakeConfig") -> int:
+    """Removes what writers that crashed left behind: temporary part, pin, upload spool and trash entries and parts
+    written but never committed. Returns the number of entries removed.
+
+    Called when an api process starts. Writes in progress leave the same entries, so the lake is only swept when
+    no other api process is running: every process holds a shared lock on the lease file until it exits and the
+    sweep needs an exclusive one.
+    """
+    if fcntl is None or config.data_directory in _leases: return 0
+    root_directory = Path(config.data_directory)
+    root_directory.mkdir(parents=True, exist_ok=True)
+    lease = open(root_directory / LEASE_FILE, "a")
+    removed = 0
+    try:
+        fcntl.flock(lease.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        pass
+    else:
+        removed = _sweep(config)
+    fcntl.flock(lease.fileno(), fcntl.LOCK_SH)
+    _leases[config.data_directory] = lease
+    return removed
+
+
+def _sweep(config: "DatalakeConfig") -> int:
+    root_directory = Path(config.data_directory)
+    with catalog.connect(config) as connection:
+        known = catalog.known_part_paths(connection)
+    entries = [
+        *root_directory.glob(f"{storage.TEMPORARY_PREFIX}*"),
+        *(root_directory / PINS_DIRECTORY).glob(f"{storage.TEMPORARY_PREFIX}*"),
+    ]
+    partition_entries = []
+    for partition_directory in storage.iter_partitions(config):
+        partition_entries.extend(partition_directory.glob(f"{storage.TEMPORARY_PREFIX}*"))
+        partition_entries.extend(
+            part for part in partition_directory.glob(f"{storage.PART_PREFIX}*")
+            if part.relative_to(root_directory).as_posix() not in known
+        )
+    for entry in entries + partition_entries:
+        if entry.is_dir():
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            entry.unlink(missing_ok=True)
+    for partition_directory in dict.fromkeys(entry.parent for entry in partition_entries):
+        storage.remove_empty_partition(partition_directory)
+    return len(entries) + len(partition_entries)
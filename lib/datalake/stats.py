@@ -0,0 +1,61 @@
+import math
+import typing
+import numpy as np
+
+
+class ColumnStats:
+    """Mergeable summary (count, mean, min, max) of the non missing values of a numeric column.
+
+    The mean is kept instead of a running sum and merged weighted by count (Chan et al.) so merging many
+    partial results does not accumulate the rounding error of one large sum.
+    """
+    __slots__ = ("count", "mean", "min", "max")
+
+    def __init__(self, count: int = 0, mean: float = 0.0, min: float = math.inf, max: float = -math.inf):
+        self.count = count
+        self.mean = mean
+        self.min = min
+        self.max = max
+
+    @classmethod
+    def from_array(cls, values: np.ndarray) -> "ColumnStats":
+        """Vectorised reduction of a numeric array (NaN values are ignored)"""
+        if values.dtype.kind == "f":
+            values = values[~np.isnan(values)]
+        if not values.size:
+            return cls()
+        return cls(int(values.size), float(values.mean(dtype=np.float64)), float(values.min()), float(values.max()))
+
+    @classmethod
+    def from_values(cls, values: typing.Sequence[float]) -> "ColumnStats":
+        return cls.from_array(np.asarray(values))
+
+    def merge(self, other: "ColumnStats") -> "ColumnStats":
+        if not other.count: return self
+        count = self.count + other.count
+        self.mean += (other.mean - self.mean) * (other.count / count)
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def scaled(self, scale: float) -> "ColumnStats":
+        return ColumnStats(self.count, self.mean * scale, self.min * scale, self.max * scale)
+
+    @property
+    def sum(self) -> float:
+        return self.mean * self.count
+
+    def to_dict(self) -> typing.Dict[str, float]:
+        if not self.count:
+            return {"count": 0, "sum": 0.0, "mean": 0.0, "min": None, "max": None}
+        return {"count": self.count, "sum": self.sum, "mean": self.mean, "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data: typing.Dict[str, typing.Any]) -> "ColumnStats":
+        if not data["count"]:
+            return cls()
+        mean = data.get("mean")
+        if mean is None:
+            mean = data["sum"] / data["count"]
+        return cls(data["count"], mean, data["min"], data["max"])
@@ -0,0 +1,435 @@
+import bisect
+import datetime
+import json
+import os
+import shutil
+import typing
+import uuid
+from pathlib import Path
+from urllib.parse import quote, unquote
+import numpy as np
+from . import columns, instrumentation
+from .sketches import ColumnSketch
+from .stats import ColumnStats
+from ..apibuilder.exceptions import ValueValidationError
+
+if typing.TYPE_CHECKING:
+    from ..models.config import DatalakeConfig
+
+# Layout of the lake:
+#   <data_directory>/date=YYYY-MM-DD/key=<url quoted key>/part-<id>/
+#       _meta.json  row count, codec, the name, type, file and codec of every column and the block index
+#       c<N>.bin    one binary file per column (see columns.encode), string columns are plain or dictionary encoded
+#       _stats.json count, sum, min and max of every numeric column
+# Partitioning on day and key means a query only has to open the partitions and the single column it needs.
+# The statistics sidecar lets /info merge a few numbers per part instead of reading any column data.
+# Rows are sorted on the timeseries column and the sparse block index records the first and last timestamp of
+# every block of rows so a time range is found with a binary search instead of reading the whole part.
+# Numeric columns are left uncompressed by default so scans memory map them (see Part.map_column) and repeated
+# queries are served from the page cache without copying.
+META_FILE = "_meta.json"
+STATS_FILE = "_stats.json"
+SKETCHES_FILE = "_sketches.json"
+PART_PREFIX = "part-"
+TEMPORARY_PREFIX = ".tmp-"
+
+# (column type, converted values)
+TypedColumn = typing.Tuple[str, typing.Sequence[typing.Any]]
+_MICROS_PER_DAY = 24 * 60 * 60 * 1_000_000
+
+
+def parse_date(date: str) -> datetime.date:
+    try:
+        return datetime.date.fromisoformat(date)
+    except ValueError:
+        raise ValueValidationError(found=date, expected="a date formatted as YYYY-MM-DD", user_message="Invalid date")
+
+def partition_path(root_directory: Path, date: str, key: str) -> Path:
+    return root_directory / f"date={date}" / f"key={quote(key, safe='')}"
+
+def partition_of(partition_directory: Path) -> typing.Tuple[str, str]:
+    """Returns the (date, key) of a partition directory"""
+    return partition_directory.parent.name[len("date="):], unquote(partition_directory.name[len("key="):])
+
+
+def split_partitions(config: "DatalakeConfig", data: typing.Dict[str, TypedColumn]) -> typing.Dict[typing.Tuple[str, str], typing.Dict[str, TypedColumn]]:
+    """Splits converted columns (see schema.apply) on the day of the timeseries column and the key column"""
+    timestamps = data[config.timeseries_column][1]
+    keys = data[config.key_column][1]
+    days: typing.Dict[int, str] = {}
+    rows: typing.Dict[typing.Tuple[str, str], typing.List[int]] = {}
+    for row, (timestamp, key) in enumerate(zip(timestamps, keys)):
+        day = timestamp // _MICROS_PER_DAY
+        date = days.get(day)
+        if date is None:
+            date = days[day] = columns.from_micros(day * _MICROS_PER_DAY).date().isoformat()
+        rows.setdefault((date, key), []).append(row)
+    if len(rows) == 1:
+        return {next(iter(rows)): data}
+    return {
+        partition: {column: (column_type, columns.take(values, indexes)) for column, (column_type, values) in data.items()}
+        for partition, indexes in rows.items()
+    }
+
+
+class PartInfo(typing.NamedTuple):
+    """Description of a stored part as recorded in the catalog"""
+    # Relative to the data directory
+    path: str
+    date: str
+    key: str
+    rows: int
+    size: int
+    codec: typing.Optional[str]
+    columns: typing.List[typing.Dict[str, typing.Any]]
+    stats: typing.Dict[str, typing.Dict[str, typing.Any]]
+
+
+def write_part(
+    root_directory: Path,
+    date: str,
+    key: str,
+    data: typing.Dict[str, TypedColumn],
+    codec: typing.Optional[str] = None,
+    level: int = 6,
+    compress_numeric: bool = False,
+    sort_column: typing.Optional[str] = None,
+    block_rows: int = 8192,
+    column_codecs: typing.Optional[typing.Dict[str, columns.ColumnCodec]] = None,
+    sync: bool = False,
+    presorted: bool = False
+) -> PartInfo:
+    """Writes converted column values (see columns.convert) as a new part of the (date, key) partition.
+
+    The codec is applied to string columns, and to numeric columns only if compress_numeric is set. Columns in
+    column_codecs are stored with their own encoding and codec instead. If a sort column is given the rows are
+    sorted on it (unless presorted says the data already is) and indexed in blocks of block_rows rows (see
+    Part.select_rows).
+    Parts are immutable. A part is written to a temporary directory and renamed into place so readers never see
+    a partial part. With sync the files and directories, including the date and key directories created for the
+    part, are fsynced so a part is never renamed into place before its data is on disk. Recording it in the catalog commits it (parts left out of the catalog by a crash are
+    never read).
+    """
+    index_meta: typing.Dict[str, typing.Any] = {}
+    if sort_column is not None:
+        if not presorted:
+            data = sort_rows(data, sort_column)
+        sorted_values = np.asarray(data[sort_column][1])
+        index_meta["sorted_by"] = sort_column
+        index_meta["index"] = [
+            [int(sorted_values[start]), int(sorted_values[min(start + block_rows, len(sorted_values)) - 1]), start]
+            for start in range(0, len(sorted_values), block_rows)
+        ]
+    partition_directory = partition_path(root_directory, date, key)
+    part_id = uuid.uuid4().hex
+    temporary_part = partition_directory / f"{TEMPORARY_PREFIX}{part_id}"
+    # Date and key directories created for the part, their entries in their parents are synced with the part
+    created: typing.List[Path] = []
+    while True:
+        created.extend(directory for directory in (partition_directory.parent, partition_directory) if not directory.exists())
+        partition_directory.mkdir(parents=True, exist_ok=True)
+        try:
+            temporary_part.mkdir()
+            break
+        except FileNotFoundError:
+            # The partition directory was removed as empty (see remove_empty_partition) after it was created
+            continue
+    try:
+        meta_columns = []
+        column_stats = {}
+        column_sketches = {}
+        rows = 0
+        for index, (column, (column_type, values)) in enumerate(data.items()):
+            file_name = f"c{index}.bin"
+            column_codec = codec if compress_numeric or column_type not in columns.NUMERIC_TYPES else None
+            encoding, column_level = None, level
+            if column_codecs and column in column_codecs:
+                encoding, column_codec, column_level = column_codecs[column]
+            encoding = columns.choose_encoding(column_type, values, encoding)
+            column_meta = {"name": column, "type": column_type, "file": file_name, "codec": column_codec}
+            if column_type == columns.STRING or encoding != columns.PLAIN:
+                column_meta["encoding"] = encoding
+            with instrumentation.stage("encode"):
+                encoded = columns.compress(column_codec, columns.encode(column_type, values, encoding), column_level)
+                if column_type in columns.NUMERIC_TYPES:
+                    column_stats[column] = ColumnStats.from_values(values).to_dict()
+                if column_type in columns.SKETCH_TYPES:
+                    column_sketches[column] = ColumnSketch.from_array(np.asarray(values)).to_dict()
+            _write_file(temporary_part / file_name, encoded, sync)
+            meta_columns.append(column_meta)
+            rows = len(values)
+        _write_file(temporary_part / STATS_FILE, json.dumps(column_stats).encode(), sync)
+        _write_file(temporary_part / SKETCHES_FILE, json.dumps(column_sketches).encode(), sync)
+        _write_file(temporary_part / META_FILE, json.dumps({"rows": rows, "codec": codec, "columns": meta_columns, **index_meta}).encode(), sync)
+        if sync:
+            _sync_directory(temporary_part)
+        part = partition_directory / f"{PART_PREFIX}{part_id}"
+        temporary_part.rename(part)
+    except BaseException:
+        shutil.rmtree(temporary_part, ignore_errors=True)
+        raise
+    if sync:
+        _sync_directory(partition_directory)
+        # Innermost first, so a parent never holds a synced entry of a directory whose own entries are not synced
+        for directory in reversed(dict.fromkeys(created)):
+            _sync_directory(directory.parent)
+    info = PartInfo(part.relative_to(root_directory).as_posix(), date, key, rows, part_size(part), codec, meta_columns, column_stats)
+    instrumentation.written(info.rows, info.size)
+    return info
+
+def _write_file(path: Path, data: bytes, sync: bool):
+    with open(path, "wb") as f:
+        with instrumentation.stage("write"):
+            f.write(data)
+            f.flush()
+        if sync:
+            with instrumentation.stage("fsync"):
+                os.fsync(f.fileno())
+
+def _sync_directory(directory: Path):
+    # Makes the creation and renaming of the entries of a directory durable (not supported on Windows)
+    if os.name == "nt": return
+    with instrumentation.stage("fsync"):
+        descriptor = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+
+def sort_rows(data: typing.Dict[str, TypedColumn], column: str) -> typing.Dict[str, TypedColumn]:
+    sort_values = np.asarray(data[column][1])
+    if (sort_values[1:] >= sort_values[:-1]).all(): return data
+    order = np.argsort(sort_values, kind="stable")
+    return {name: (column_type, columns.take(values, order)) for name, (column_type, values) in data.items()}
+
+def part_size(part: Path) -> int:
+    return sum(f.stat().st_size for f in part.iterdir())
+
+def part_file_count(info: PartInfo) -> int:
+    # A file per column plus the meta, statistics and sketches files
+    return len(info.columns) + 3
+
+def read_part_info(root_directory: Path, part: Path) -> PartInfo:
+    """Describes a part from its files (used to index parts that are not in the catalog)"""
+    meta = json.loads((part / META_FILE).read_text())
+    stats_path = part / STATS_FILE
+    column_stats = json.loads(stats_path.read_text()) if stats_path.exists() else {}
+    date, key = partition_of(part.parent)
+    codec = meta["codec"] if "codec" in meta else next(iter(meta["columns"]), {}).get("codec")
+    return PartInfo(part.relative_to(root_directory).as_posix(), date, key, meta["rows"], part_size(part), codec, meta["columns"], column_stats)
+
+
+def column_codecs(config: "DatalakeConfig") -> typing.Dict[str, columns.ColumnCodec]:
+    return {column: columns.parse_codec(spec, config.compaction_level) for column, spec in config.column_codecs.items()}
+
+def write_batch(config: "DatalakeConfig", data: typing.Dict[str, TypedColumn]) -> typing.List[PartInfo]:
+    """Writes converted columns into the partitioned columnar layout, one part per (date, key) partition"""
+    root_directory = Path(config.data_directory)
+    _, codec, level = columns.parse_codec(config.upload_codec, config.compaction_level)
+    return [
+        write_part(
+            root_directory, date, key, partition_data, codec, level, config.compaction_compress_numeric,
+            sort_column=config.timeseries_column, block_rows=config.index_block_rows, column_codecs=column_codecs(config),
+            sync=config.fsync_writes
+        )
+        for (date, key), partition_data in split_partitions(config, data).items()
+    ]
+
+
+def iter_partitions(config: "DatalakeConfig", date: typing.Optional[str] = None, key: typing.Optional[str] = None) -> typing.Iterator[Path]:
+    """Yields the partition directories matching the date and key (all partitions if not given)"""
+    root_directory = Path(config.data_directory)
+    date_directories = [root_directory / f"date={date}"] if date is not None else root_directory.glob("date=*")
+    for date_directory in date_directories:
+        if key is not None:
+            key_directories = [date_directory / f"key={quote(key, safe='')}"]
+        else:
+            key_directories = date_directory.glob("key=*")
+        for key_directory in key_directories:
+            if key_directory.is_dir():
+                yield key_directory
+
+
+def parse_cutoff(value: str) -> datetime.datetime:
+    """Parses a date (midnight UTC) or a timestamp"""
+    if len(value) == len("YYYY-MM-DD"):
+        return datetime.datetime.combine(parse_date(value), datetime.time(), datetime.timezone.utc)
+    try:
+        return columns.parse_timestamp(value)
+    except (ValueError, TypeError, OverflowError):
+        raise ValueValidationError(found=value, expected="a date (YYYY-MM-DD) or an ISO 8601 timestamp", user_message="Invalid date")
+
+
+def date_bounds(start: typing.Optional[datetime.datetime], end: typing.Optional[datetime.datetime]) -> typing.Tuple[typing.Optional[str], typing.Optional[str]]:
+    """Returns the first day and the day after the last day of the time range [start, end) (None if unbounded)"""
+    since = None if start is None else start.date().isoformat()
+    if end is None:
+        return since, None
+    last_day = end.date() if end.time() == datetime.time() else end.date() + datetime.timedelta(days=1)
+    return since, last_day.isoformat()
+
+def micros_or_none(timestamp: typing.Optional[datetime.datetime]) -> typing.Optional[int]:
+    return None if timestamp is None else columns.to_micros(timestamp)
+
+
+def trash_directory(config: "DatalakeConfig") -> Path:
+    return Path(config.data_directory) / f"{TEMPORARY_PREFIX}trash-{uuid.uuid4().hex}"
+
+def remove_trash(trash: Path):
+    shutil.rmtree(trash, ignore_errors=True)
+
+
+def discard_parts(config: "DatalakeConfig", parts: typing.List[PartInfo]):
+    """Removes parts that were written but never added to the catalog"""
+    if not parts: return
+    root_directory = Path(config.data_directory)
+    trash = trash_directory(config)
+    trash.mkdir()
+    for info in parts:
+        part = root_directory / info.path
+        part.rename(trash / part.name)
+        remove_empty_partition(part.parent)
+    remove_trash(trash)
+
+
+def remove_empty_partition(partition_directory: Path):
+    """Removes a partition directory, and its date directory, if they are empty"""
+    for directory in (partition_directory, partition_directory.parent):
+        try:
+            directory.rmdir()
+        except OSError:
+            return
+
+
+def truncate_parts(
+    config: "DatalakeConfig",
+    parts: typing.List[PartInfo],
+    start: typing.Optional[int],
+    end: typing.Optional[int]
+) -> typing.Tuple[typing.List[PartInfo], typing.List[PartInfo]]:
+    """Writes the rows outside start up to end (epoch microseconds, unbounded if None) of the parts as new parts.
+
+    Only parts holding rows in the range are rewritten. Returns the (replaced, added) parts, the replaced parts
+    are left on disk to be removed from the catalog by the caller. The added parts are not in the catalog yet,
+    the caller discards them (see discard_parts) if it does not add them.
+    """
+    root_directory = Path(config.data_directory)
+    removed, added = [], []
+    try:
+        for info in parts:
+            part = Part.from_info(root_directory, info)
+            remove = np.zeros(part.rows, dtype=bool)
+            remove[part.select_rows(config.timeseries_column, start, end)] = True
+            if not remove.any(): continue
+            keep = np.flatnonzero(~remove).tolist()
+            if keep:
+                data = {column: (column_type, columns.take(values, keep)) for column, (column_type, values) in part.read().items()}
+                compress_numeric = any(column.get("codec") is not None for column in info.columns if column["type"] in columns.NUMERIC_TYPES)
+                added.append(write_part(
+                    root_directory, info.date, info.key, data, info.codec, config.compaction_level, compress_numeric,
+                    sort_column=config.timeseries_column, block_rows=config.index_block_rows, column_codecs=column_codecs(config),
+                    sync=config.fsync_writes
+                ))
+            removed.append(info)
+    except BaseException:
+        discard_parts(config, added)
+        raise
+    return removed, added
+
+
+class Part:
+    """Read access to a single stored part"""
+    def __init__(self, path: Path, meta: typing.Optional[typing.Dict[str, typing.Any]] = None, stats: typing.Optional[typing.Dict[str, typing.Any]] = None):
+        self.path = path
+        if meta is None:
+            meta = json.loads((path / META_FILE).read_text())
+        self.rows: int = meta["rows"]
+        self._codec: typing.Optional[str] = meta.get("codec")
+        self.columns: typing.Dict[str, typing.Dict[str, str]] = {column["name"]: column for column in meta["columns"]}
+        self._stats: typing.Optional[typing.Dict[str, typing.Any]] = stats
+        self._sketches: typing.Optional[typing.Dict[str, typing.Any]] = None
+        # (sorted by, block index) loaded on first use when not given
+        self._index: typing.Optional[typing.Tuple[typing.Optional[str], typing.Optional[typing.List[typing.List[int]]]]] = None
+        if "sorted_by" in meta:
+            self._index = (meta["sorted_by"], meta["index"])
+
+    @classmethod
+    def from_info(cls, root_directory: Path, info: PartInfo) -> "Part":
+        return cls(root_directory / info.path, {"rows": info.rows, "codec": info.codec, "columns": info.columns}, info.stats)
+
+    @property
+    def codec(self) -> typing.Optional[str]:
+        return self._codec if self._codec is not None else next(iter(self.columns.values()), {}).get("codec")
+
+    def column_type(self, column: str) -> typing.Optional[str]:
+        meta = self.columns.get(column)
+        return None if meta is None else meta["type"]
+
+    def stats(self, column: str) -> typing.Optional[ColumnStats]:
+        """Statistics of the column from the sidecar (None for parts written before sidecars existed)"""
+        if self._stats is None:
+            stats_path = self.path / STATS_FILE
+            self._stats = json.loads(stats_path.read_text()) if stats_path.exists() else {}
+        column_stats = self._stats.get(column)
+        return None if column_stats is None else ColumnStats.from_dict(column_stats)
+
+    def sketch(self, column: str) -> typing.Optional[ColumnSketch]:
+        """Sketches of the column from the sidecar (None for parts written before sketches existed)"""
+        if self._sketches is None:
+            sketches_path = self.path / SKETCHES_FILE
+            self._sketches = json.loads(sketches_path.read_text()) if sketches_path.exists() else {}
+        column_sketch = self._sketches.get(column)
+        return None if column_sketch is None else ColumnSketch.from_dict(column_sketch)
+
+    def read_column(self, column: str) -> typing.Sequence[typing.Any]:
+        meta = self.columns[column]
+        data = columns.decompress(meta.get("codec"), (self.path / meta["file"]).read_bytes())
+        return columns.decode(meta["type"], data, self.rows, meta.get("encoding", columns.PLAIN))
+
+    def map_column(self, column: str) -> np.ndarray:
+        """Returns a numeric column as a read only array.
+
+        Plain uncompressed columns are memory mapped, so no memory proportional to the column is allocated and the
+        data is shared with the page cache. Other columns are decompressed and decoded into memory.
+        """
+        meta = self.columns[column]
+        dtype = np.dtype(columns.DTYPES[meta["type"]])
+        path = self.path / meta["file"]
+        encoding = meta.get("encoding", columns.PLAIN)
+        if meta.get("codec") is not None or encoding != columns.PLAIN:
+            return columns.decode_array(meta["type"], columns.decompress(meta.get("codec"), path.read_bytes()), self.rows, encoding)
+        if not self.rows:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=(self.rows,))
+
+    def block_index(self, column: str) -> typing.Optional[typing.List[typing.List[int]]]:
+        """The [first value, last value, first row] of every block of rows if the part is sorted on the column"""
+        if self._index is None:
+            meta = json.loads((self.path / META_FILE).read_text())
+            self._index = (meta.get("sorted_by"), meta.get("index"))
+        sorted_by, index = self._index
+        return index if sorted_by == column else None
+
+    def select_rows(self, timeseries_column: str, start: typing.Optional[int], end: typing.Optional[int]) -> typing.Union[slice, np.ndarray]:
+        """Rows with start <= timestamp < end (unbounded if None), a slice if the part is sorted on the timeseries column"""
+        index = self.block_index(timeseries_column)
+        timestamps = self.map_column(timeseries_column)
+        if index is None:
+            mask = np.ones(self.rows, dtype=bool)
+            if start is not None: mask &= timestamps >= start
+            if end is not None: mask &= timestamps < end
+            return np.flatnonzero(mask)
+        last_values = [block[1] for block in index]
+        return slice(self._search(index, last_values, timestamps, start, 0), self._search(index, last_values, timestamps, end, self.rows))
+
+    def _search(self, index: typing.List[typing.List[int]], last_values: typing.List[int], timestamps: np.ndarray, value: typing.Optional[int], default: int) -> int:
+        # First row with a timestamp >= value. Only the block that can hold it is read
+        if value is None: return default
+        block = bisect.bisect_left(last_values, value)
+        if block == len(index): return self.rows
+        first_row = index[block][2]
+        last_row = index[block + 1][2] if block + 1 < len(index) else self.rows
+        return first_row + int(np.searchsorted(timestamps[first_row:last_row], value, "left"))
+
+    def read(self) -> typing.Dict[str, TypedColumn]:
+        return {column: (meta["type"], self.read_column(column)) for column, meta in self.columns.items()}
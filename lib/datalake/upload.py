@@ -0,0 +1,115 @@
+import os
+import shutil
+import time
+import typing
+import uuid
+from concurrent.futures import Future, wait
+from functools import lru_cache
+from pathlib import Path
+from . import catalog, ingest, instrumentation, schema, storage
+from .executor import ProcessPool
+
+if typing.TYPE_CHECKING:
+    from ..models.config import DatalakeConfig
+
+# An upload is committed as a whole. The files of an upload are parsed and written as parts, in parallel across
+# a pool of ingest_workers processes when there are several, and the parts of every file are added to the catalog
+# in a single transaction once all of them are written. If any file fails the parts already written are discarded
+# so an upload is either visible in full or not at all. Files are converted to the lake schema read when they start,
+# without holding the catalog lock, and the columns they add or widen are registered in the commit transaction (see
+# schema.register) so a failed upload leaves no trace in the schema either.
+
+# (file name, file, file type) of an uploaded file
+UploadedFile = typing.Tuple[typing.Optional[str], typing.BinaryIO, str]
+
+
+class FileResult(typing.NamedTuple):
+    filename: typing.Optional[str]
+    bytes_read: int
+    rows: int
+    parts: typing.List[storage.PartInfo]
+    seconds: float
+
+    @property
+    def bytes_written(self) -> int:
+        return sum(part.size for part in self.parts)
+
+
+def ingest_file(config: "DatalakeConfig", filename: typing.Optional[str], file: typing.BinaryIO, file_type: str) -> FileResult:
+    """Converts the batches of a file to the lake schema and writes them as parts. The parts are not added to the catalog"""
+    started = time.perf_counter()
+    parser = ingest.get_parser(file_type, config.ingest_buffer_size)
+    # Batches are converted without holding the catalog lock. The columns are registered when the parts are committed
+    with catalog.connect(config) as connection:
+        lake_columns = catalog.get_columns(connection)
+    parts = []
+    try:
+        for batch in ingest.read_batches(file, parser, config.ingest_chunk_size):
+            with instrumentation.stage("convert"):
+                data = schema.apply(config, lake_columns, batch)
+            lake_columns = schema.updated(lake_columns, data)
+            parts.extend(storage.write_batch(config, data))
+    except BaseException:
+        storage.discard_parts(config, parts)
+        raise
+    instrumentation.read(parser.rows_read, parser.bytes_read)
+    return FileResult(filename, parser.bytes_read, parser.rows_read, parts, time.perf_counter() - started)
+
+def _ingest_path(config_dict: typing.Dict[str, typing.Any], filename: typing.Optional[str], path: str, file_type: str) -> FileResult:
+    from ..models.config import DatalakeConfig
+    with open(path, "rb") as f:
+        return ingest_file(DatalakeConfig(**config_dict), filename, f, file_type)
+
+
+def ingest_workers(config: "DatalakeConfig") -> int:
+    return config.ingest_workers or os.cpu_count() or 1
+
+@lru_cache(maxsize=1)
+def _get_executor(max_workers: int) -> ProcessPool:
+    return ProcessPool(max_workers)
+
+
+def _ingest_parallel(config: "DatalakeConfig", files: typing.List[UploadedFile], workers: int) -> typing.List[FileResult]:
+    # Uploaded files are spooled to the data directory so the workers can read them
+    spool = Path(config.data_directory) / f"{storage.TEMPORARY_PREFIX}upload-{uuid.uuid4().hex}"
+    spool.mkdir(parents=True)
+    executor = _get_executor(workers)
+    futures: typing.List[Future] = []
+    failed: typing.Optional[BaseException] = None
+    try:
+        for number, (filename, file, file_type) in enumerate(files):
+            path = spool / str(number)
+            with open(path, "wb") as f:
+                shutil.copyfileobj(file, f)
+            futures.append(instrumentation.submit(executor, _ingest_path, config.dict(), filename, str(path), file_type))
+    except BaseException as e:
+        failed = e
+    wait(futures)
+    shutil.rmtree(spool, ignore_errors=True)
+    results = [instrumentation.result(future) for future in futures if future.exception() is None]
+    if failed is None:
+        failed = next((future.exception() for future in futures if future.exception() is not None), None)
+    if failed is not None:
+        storage.discard_parts(config, [part for result in results for part in result.parts])
+        raise failed
+    return results
+
+
+def ingest_files(config: "DatalakeConfig", files: typing.List[UploadedFile]) -> typing.List[FileResult]:
+    """Ingests the files of an upload and commits all of their parts at once. Returns the result of every file"""
+    results: typing.List[FileResult] = []
+    with instrumentation.operation(instrumentation.INGEST):
+        try:
+            workers = ingest_workers(config)
+            if workers <= 1 or len(files) < 2:
+                for file in files:
+                    results.append(ingest_file(config, *file))
+            else:
+                results = _ingest_parallel(config, files, workers)
+            with instrumentation.stage("commit"), catalog.connect(config, write=True) as connection:
+                schema.register(config, connection, [part for result in results for part in result.parts])
+                catalog.add_parts(connection, [part for result in results for part in result.parts])
+        except BaseException:
+            storage.discard_parts(config, [part for result in results for part in result.parts])
+            raise
+    return results
@@ -2,7 +2,7 @@ import pydantic
 import typing
 
 class DatalakeConfig(pydantic.BaseModel):
-    __root_mount_path__ = "datalake" 
+    __root_mount_path__ = "datalake"
     class Config:
         extra=pydantic.Extra.allow
 
@@ -12,4 +12,72 @@ class DatalakeConfig(pydantic.BaseModel):
     # We assume the data has a key relating to a specific instance
     key_column: str
     supported_types: typing.List[str]
+    # The column types of the lake are inferred from the first upload and enforced on later ones. Set to let later
+    # uploads add columns to the schema instead of rejecting them
+    schema_allow_new_columns: bool = False
+    # Parts are fsynced before they are renamed into place and recorded in the catalog. Disabling trades crash
+    # safety for write throughput
+    fsync_writes: bool = True
+    # Number of bytes read from an upload at a time
+    ingest_chunk_size: int = 1024 * 1024
+    # Maximum number of bytes of parsed records buffered per upload before they are flushed to the lake.
+    # Peak memory per upload is roughly ingest_chunk_size + ingest_buffer_size (plus parsing overhead)
+    ingest_buffer_size: int = 16 * 1024 * 1024
+    # Processes parsing and writing the files of an upload in parallel (0 to use every cpu). Uploads of a single
+    # file are ingested in the api process
+    ingest_workers: int = 0
+    # Bounds of the in memory cache of /info results (per process)
+    info_cache_max_entries: int = 10000
+    info_cache_max_bytes: int = 16 * 1024 * 1024
+    # Rows of every part are sorted on the timeseries column and indexed in blocks of this many rows so time
+    # range queries only read the blocks they need
+    index_block_rows: int = 8192
+    # /optimise merges the parts of every day/key partition into parts of at most this many rows
+    compaction_target_rows: int = 1000000
+    # Compression of parts written by uploads and rewritten by /optimise (None to disable) as "codec[:level]" with
+    # codecs zlib, gzip, lzma and bz2. compaction_level is used when no level is given
+    upload_codec: typing.Optional[str] = None
+    compaction_codec: typing.Optional[str] = "zlib"
+    compaction_level: int = 6
+    # Numeric columns are left uncompressed so queries can memory map them. Set to trade query speed for disk space
+    compaction_compress_numeric: bool = False
+    # Per column "[encoding+]codec[:level]" overriding the codecs above, where the encoding is delta (integers and
+    # timestamps), rle, dictionary (strings) or plain. e.g. {"entrytime": "delta+zlib", "key": "rle"}.
+    # See `python -m lib.datalake.benchmarks codecs` for the trade off of each on your data
+    column_codecs: typing.Dict[str, str] = {}
+    # Number of processes running background jobs such as /optimise
+    job_workers: int = 1
+    # Finished jobs are forgotten after this many seconds
+    job_retention_seconds: int = 24 * 60 * 60
+    # Number of values of a column reduced at a time when statistics have to be computed from the data
+    scan_chunk_rows: int = 1024 * 1024
+    # /info answers from the statistics recorded at upload. Set to False to always compute them from the stored data
+    info_use_statistics: bool = True
+    # /info and /stats queries aligned to hours answer partitions rolled up by /optimise from their hourly and daily
+    # rollups (see lib.datalake.rollups)
+    info_use_rollups: bool = True
+    # Rows formatted and sent at a time by /export
+    export_chunk_rows: int = 10000
+    # Processes scanning stored data in parallel (0 to use every cpu) and the number of groups the parts of a scan
+    # are split into (0 for 4 per worker). Scans of fewer than scan_parallel_min_parts parts run in the api process
+    scan_workers: int = 0
+    scan_partitions: int = 0
+    scan_parallel_min_parts: int = 16
+    # Threads running the parsing, writing and scanning of requests off the event loop, and the number of requests
+    # admitted at a time before new ones are rejected with a 503
+    executor_workers: int = 4
+    executor_max_pending: int = 32
+
+    @pydantic.validator("upload_codec", "compaction_codec")
+    def _check_codec(cls, spec: typing.Optional[str]) -> typing.Optional[str]:
+        # Bad codecs fail when the config is loaded instead of on every upload and compaction
+        from ...datalake.columns import parse_codec
+        parse_codec(spec)
+        return spec
+
+    @pydantic.validator("column_codecs", each_item=True)
+    def _check_column_codec(cls, spec: str) -> str:
+        from ...datalake.columns import parse_codec
+        parse_codec(spec)
+        return spec
 
@@ -0,0 +1,123 @@
+import datetime
+import random
+import typing
+import pytest
+import yaml
+from fastapi.testclient import TestClient
+from lib.models.config import DatalakeConfig
+
+# (key, timestamp, value) rows of the sample lake
+Row = typing.Tuple[str, datetime.datetime, float]
+BASE = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture
+def config(tmp_path) -> DatalakeConfig:
+    return DatalakeConfig(
+        data_directory=str(tmp_path / "data"),
+        timeseries_column="entrytime",
+        key_column="key",
+        supported_types=["csv", "json"],
+    )
+
+
+def _clear_caches():
+    from lib.apibuilder.config import get_settings
+    from lib.datalake import snapshots
+    from lib.datalake.cache import get_info_cache
+    from lib.datalake.executor import get_executor
+    get_settings.cache_clear()
+    get_executor.cache_clear()
+    get_info_cache.cache_clear()
+    for lease in snapshots._leases.values():
+        lease.close()
+    snapshots._leases.clear()
+
+
+@pytest.fixture
+def make_client(tmp_path, config, monkeypatch) -> typing.Iterator[typing.Callable[..., TestClient]]:
+    """Creates the api as lib.apibuilder.api.init_app does, on the lake of the config fixture with the given
+    datalake settings overridden"""
+    import lib.apibuilder.app as appbuilder
+    from lib.apibuilder import api
+    from lib.apibuilder.config import ConfigSourceManager, get_settings
+
+    def make(**overrides: typing.Any) -> TestClient:
+        path = tmp_path / "config.yml"
+        path.write_text(yaml.safe_dump({
+            "app": {"title": "Datalake API", "route_modules": ["lib.api:init_app"]},
+            "datalake": {**config.dict(include={"data_directory", "timeseries_column", "key_column", "supported_types"}), **overrides},
+        }))
+        monkeypatch.setattr(ConfigSourceManager, "_config_paths", [str(path)])
+        monkeypatch.setattr(appbuilder, "init_app_config", get_settings)
+        _clear_caches()
+        return TestClient(api.init_app())
+
+    yield make
+    _clear_caches()
+
+@pytest.fixture
+def client(make_client) -> TestClient:
+    return make_client()
+
+
+@pytest.fixture
+def rows() -> typing.List[Row]:
+    """300 rows over 3 days and 3 keys at whole minutes"""
+    generator = random.Random(0)
+    return [
+        (f"k{generator.randrange(3)}", BASE + datetime.timedelta(minutes=generator.randrange(3 * 24 * 60)), round(generator.uniform(-50, 50), 2))
+        for _ in range(300)
+    ]
+
+@pytest.fixture
+def upload() -> typing.Callable[..., typing.Any]:
+    """Uploads rows as a csv file, in as many requests as batches"""
+    def upload(client: TestClient, rows: typing.List[Row], batches: int = 1) -> typing.List[typing.Dict[str, typing.Any]]:
+        responses = []
+        for batch in range(batches):
+            data = "key,entrytime,value\n" + "".join(f"{key},{timestamp.isoformat()},{value}\n" for key, timestamp, value in rows[batch::batches])
+            response = client.post("/api/datalake/upload", files=[("files", ("rows.csv", data.encode()))])
+            assert response.status_code == 200, response.json()
+            responses.append(response.json())
+        return responses
+    return upload
+
+@pytest.fixture
+def expected() -> typing.Callable[..., typing.Dict[str, typing.Any]]:
+    """The /info answer computed from rows with start <= timestamp < end"""
+    def expected(
+        rows: typing.List[Row],
+        start: typing.Optional[datetime.datetime] = None,
+        end: typing.Optional[datetime.datetime] = None,
+        key: typing.Optional[str] = None,
+        date: typing.Optional[str] = None
+    ) -> typing.Dict[str, typing.Any]:
+        values = [
+            value for row_key, timestamp, value in rows
+            if (start is None or timestamp >= start) and (end is None or timestamp < end)
+            and (key is None or row_key == key) and (date is None or timestamp.date().isoformat() == date)
+        ]
+        return {"min_value": min(values), "max_value": max(values), "mean_value": pytest.approx(sum(values) / len(values)), "total_records": len(values)}
+    return expected
+
+@pytest.fixture
+def info() -> typing.Callable[..., typing.Dict[str, typing.Any]]:
+    def info(client: TestClient, **params: typing.Any) -> typing.Dict[str, typing.Any]:
+        params = {name: value.isoformat() if isinstance(value, datetime.datetime) else value for name, value in params.items() if value is not None}
+        response = client.get("/api/datalake/info", params={"column": "value", **params})
+        assert response.status_code == 200, response.json()
+        return response.json()
+    return info
+
+@pytest.fixture
+def wait_for_job() -> typing.Callable[[TestClient, typing.Dict[str, typing.Any]], typing.Dict[str, typing.Any]]:
+    def wait_for_job(client: TestClient, job: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+        import time
+        deadline = time.monotonic() + 60
+        while job["status"] not in ("completed", "failed") and time.monotonic() < deadline:
+            time.sleep(0.05)
+            job = client.get(f"/api/datalake/jobs/{job['id']}").json()
+        assert job["status"] == "completed", job
+        return job
+    return wait_for_job
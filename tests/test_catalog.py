@@ -0,0 +1,54 @@
+import io
+import shutil
+from pathlib import Path
+import pytest
+from lib.datalake import catalog, upload
+
+
+@pytest.fixture
+def lake(config):
+    data = "key,entrytime,value\n" + "".join(f"k{i % 3},2023-01-0{i % 4 + 1}T00:00:{i:02d},{i}\n" for i in range(40))
+    upload.ingest_files(config, [("a.csv", io.BytesIO(data.encode()), "csv")])
+    upload.ingest_files(config, [("b.json", io.BytesIO(b'{"key": "k0", "entrytime": "2023-01-01T01:00:00", "value": 1.5}\n'), "json")])
+    return config
+
+def _reopen(config):
+    catalog._initialised.discard(config.data_directory)
+    return catalog.connect(config)
+
+def _paths(config):
+    with catalog.connect(config) as connection:
+        return [part.path for part in catalog.find_parts(connection)]
+
+
+def test_rebuild_without_catalog(lake):
+    with catalog.connect(lake) as connection:
+        parts = catalog.find_parts(connection)
+        columns = catalog.get_columns(connection)
+    for path in Path(lake.data_directory).glob(f"{catalog.CATALOG_FILE}*"):
+        path.unlink()
+    with _reopen(lake) as connection:
+        assert catalog.find_parts(connection) == parts
+        assert catalog.get_columns(connection) == columns
+        assert columns["value"] == "float64"
+        assert sum(part.rows for part in catalog.find_parts(connection)) == 41
+
+
+def test_migration_keeps_retired_and_uncommitted_parts_out_of_the_lake(lake):
+    root_directory = Path(lake.data_directory)
+    paths = _paths(lake)
+    with catalog.connect(lake, write=True) as connection:
+        retired = catalog.find_parts(connection)[0]
+        catalog.remove_parts(connection, [retired])
+        version = catalog.current_version(connection)
+    # A part written by an upload that never committed
+    uncommitted = (root_directory / paths[1]).with_name("part-" + "f" * 32)
+    shutil.copytree(root_directory / paths[1], uncommitted)
+    with catalog.connect(lake, write=True) as connection:
+        connection.execute("UPDATE settings SET value = '5' WHERE name = 'version'")
+
+    with _reopen(lake) as connection:
+        assert [part.path for part in catalog.find_parts(connection)] == paths[1:]
+        assert catalog.find_retired_parts(connection, version) == [retired.path]
+        # Never older than a version a reader may have pinned
+        assert catalog.current_version(connection) >= version
@@ -0,0 +1,56 @@
+from pathlib import Path
+import pytest
+from lib.datalake import catalog, compaction, snapshots, storage
+
+
+def _part_directories(config):
+    return sorted(path.relative_to(config.data_directory).as_posix() for path in Path(config.data_directory).glob(f"date=*/key=*/{storage.PART_PREFIX}*"))
+
+
+def test_optimise_compacts_once_and_collects_garbage(client, config, rows, upload, info, wait_for_job):
+    upload(client, rows, batches=4)
+    before = info(client)
+    assert len(_part_directories(config)) == 36
+    job = wait_for_job(client, client.post("/api/datalake/optimise").json())
+    result = job["result"]
+    assert result["partitions_compacted"] == 9
+    assert result["files_after"] < result["files_before"]
+    after = info(client)
+    assert {**after, "number_of_files": 0, "mean_value": 0} == {**before, "number_of_files": 0, "mean_value": 0}
+    assert after["mean_value"] == pytest.approx(before["mean_value"])
+    assert after["number_of_files"] == 9
+    # The retired parts were collected, a compacted part is left per partition
+    with catalog.connect(config) as connection:
+        live = [part.path for part in catalog.find_parts(connection)]
+        assert catalog.find_retired_parts(connection, catalog.current_version(connection)) == []
+    assert _part_directories(config) == sorted(live)
+    assert len(live) == 9
+    # Compacted partitions are left alone by the next run
+    again = wait_for_job(client, client.post("/api/datalake/optimise").json())["result"]
+    assert (again["partitions_compacted"], again["partitions_rolled_up"]) == (0, 0)
+
+
+def test_compaction_splits_partitions_into_target_sized_parts(make_client, config, rows, upload):
+    client = make_client(compaction_target_rows=10)
+    upload(client, rows, batches=4)
+    config = config.copy(update={"compaction_target_rows": 10})
+    compaction.compact(config)
+    with catalog.connect(config) as connection:
+        parts = catalog.find_parts(connection)
+        assert catalog.find_uncompacted_partitions(connection, "zlib", 10) == []
+    for partition in {(part.date, part.key) for part in parts}:
+        sizes = sorted(part.rows for part in parts if (part.date, part.key) == partition)
+        assert all(size == 10 for size in sizes[1:])
+        assert all(part.codec == "zlib" for part in parts)
+    assert compaction.compact(config).partitions == []
+
+
+def test_retired_parts_are_kept_while_pinned(client, config, rows, upload):
+    upload(client, rows, batches=2)
+    old_parts = _part_directories(config)
+    with snapshots.pin(config):
+        compaction.compact(config)
+        assert snapshots.collect_garbage(config) == 0
+        assert set(old_parts) <= set(_part_directories(config))
+    assert snapshots.collect_garbage(config) == len(old_parts)
+    assert not set(old_parts) & set(_part_directories(config))
@@ -0,0 +1,30 @@
+import asyncio
+import threading
+from lib.datalake.executor import get_executor
+
+
+def test_requests_are_rejected_while_the_executor_is_full(make_client, rows, upload):
+    client = make_client(executor_max_pending=1)
+    upload(client, rows)
+    executor = get_executor()
+    started, release = threading.Event(), threading.Event()
+    def block():
+        started.set()
+        release.wait()
+    blocking = threading.Thread(target=asyncio.run, args=(executor.run(block),))
+    blocking.start()
+    try:
+        assert started.wait(5)
+        response = client.get("/api/datalake/info", params={"column": "value"})
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+        assert client.get("/api/datalake/export").status_code == 503
+        assert executor.rejected == 2
+    finally:
+        release.set()
+        blocking.join()
+    assert executor.pending == 0
+    assert client.get("/api/datalake/info", params={"column": "value"}).status_code == 200
+    # A finished export releases its slot
+    assert client.get("/api/datalake/export").status_code == 200
+    assert executor.pending == 0
@@ -0,0 +1,43 @@
+import csv
+import datetime
+import io
+import json
+import pytest
+
+BASE = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _sorted(records):
+    return sorted(records, key=lambda record: (record["entrytime"], record["key"], record["value"]))
+
+def _expected(rows, start=None, end=None, key=None):
+    return _sorted(
+        {"key": row_key, "entrytime": timestamp.isoformat(), "value": value} for row_key, timestamp, value in rows
+        if (start is None or timestamp >= start) and (end is None or timestamp < end) and (key is None or row_key == key)
+    )
+
+
+@pytest.mark.parametrize("params", [{}, {"key": "k1"}, {"start": BASE + datetime.timedelta(hours=5, minutes=30), "end": BASE + datetime.timedelta(hours=40)}])
+def test_export_ndjson(client, rows, upload, params):
+    upload(client, rows, batches=2)
+    response = client.get("/api/datalake/export", params={name: value.isoformat() if isinstance(value, datetime.datetime) else value for name, value in params.items()})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert _sorted(json.loads(line) for line in response.text.splitlines()) == _expected(rows, **params)
+
+
+def test_export_csv_projection(client, rows, upload):
+    upload(client, rows)
+    response = client.get("/api/datalake/export", params={"format": "csv", "column": ["entrytime", "value"], "date": "2023-01-02"})
+    assert response.status_code == 200
+    assert 'filename="export.csv"' in response.headers["content-disposition"]
+    header, *records = csv.reader(io.StringIO(response.text, newline=""))
+    assert header == ["entrytime", "value"]
+    day = [record for record in _expected(rows) if record["entrytime"].startswith("2023-01-02")]
+    assert sorted((entrytime, float(value)) for entrytime, value in records) == sorted((record["entrytime"], record["value"]) for record in day)
+
+
+def test_export_rejects_unknown_columns_and_formats(client, rows, upload):
+    upload(client, rows)
+    assert client.get("/api/datalake/export", params={"column": "nope"}).status_code == 400
+    assert client.get("/api/datalake/export", params={"format": "xml"}).status_code == 400
@@ -0,0 +1,104 @@
+import datetime
+import io
+import numpy as np
+import pytest
+from lib.datalake import sketches, upload as lake_upload
+
+BASE = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+HOUR = datetime.timedelta(hours=1)
+QUERIES = [
+    {},
+    {"key": "k1"},
+    {"date": "2023-01-02"},
+    {"date": "2023-01-02", "key": "k1"},
+    {"start": BASE + 5 * HOUR + datetime.timedelta(minutes=30), "end": BASE + 40 * HOUR},
+    {"start": BASE + 20 * HOUR},
+    {"end": BASE + 30 * HOUR + datetime.timedelta(minutes=7), "key": "k2"},
+    {"start": BASE + 20 * HOUR, "end": BASE + 50 * HOUR, "date": "2023-01-02"},
+]
+# Aligned to hours so partitions rolled up by /optimise are answered from their rollups
+ALIGNED_QUERIES = [
+    {"start": BASE + 5 * HOUR, "end": BASE + 7 * HOUR},
+    {"start": BASE + 20 * HOUR, "end": BASE + 50 * HOUR},
+    {"start": BASE + 20 * HOUR, "end": BASE + 50 * HOUR, "key": "k1"},
+    {"start": BASE + 24 * HOUR, "end": BASE + 48 * HOUR},
+    {"end": BASE + 61 * HOUR},
+]
+
+
+def _subset(answer, expected):
+    return {field: answer[field] for field in expected}
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_info_matches_the_rows(client, rows, upload, info, expected, query):
+    upload(client, rows, batches=3)
+    answer = info(client, **query)
+    assert _subset(answer, expected(rows, **query)) == expected(rows, **query)
+    assert answer["p50"] is None and answer["distinct_count"] is None
+
+
+def test_info_of_unknown_column_and_bad_date(client, rows, upload):
+    upload(client, rows)
+    assert client.get("/api/datalake/info", params={"column": "nope"}).status_code == 400
+    assert client.get("/api/datalake/info", params={"column": "value", "date": "bad"}).status_code == 400
+
+
+def test_approximate_info_within_sketch_bounds(client, rows, upload, info):
+    upload(client, rows, batches=3)
+    answer = info(client, approximate=True)
+    values = np.sort([value for _, _, value in rows])
+    for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+        exact = values[int(q * (len(values) - 1))]
+        assert abs(answer[name] - exact) <= sketches.RELATIVE_ACCURACY * abs(exact)
+    distinct = len(set(values.tolist()))
+    assert abs(answer["distinct_count"] - distinct) <= 3 * 1.04 / 2 ** (sketches.HLL_PRECISION / 2) * distinct
+
+
+def test_stats_grouped_by_date_and_key(client, rows, upload, expected):
+    upload(client, rows, batches=2)
+    response = client.get("/api/datalake/stats", params={"column": ["value"], "group_by": ["date", "key"]})
+    assert response.status_code == 200
+    groups = response.json()["groups"]
+    assert len(groups) == 9
+    for group in groups:
+        answer = expected(rows, date=group["date"], key=group["key"])
+        stats = group["columns"]["value"]
+        assert (stats["min_value"], stats["max_value"], stats["count"]) == (answer["min_value"], answer["max_value"], answer["total_records"])
+        assert stats["mean_value"] == answer["mean_value"]
+
+
+def test_cache_is_invalidated_by_uploads_and_deletes(client, rows, upload, info, expected):
+    upload(client, rows[:150])
+    assert info(client, key="k1") == info(client, key="k1")
+    assert client.get("/api/datalake/cache").json()["hits"] == 1
+    upload(client, rows[150:])
+    assert _subset(info(client, key="k1"), expected(rows, key="k1")) == expected(rows, key="k1")
+    end = BASE + 30 * HOUR
+    assert client.request("DELETE", "/api/datalake/", params={"end": end.isoformat()}).status_code == 200
+    assert _subset(info(client, key="k1"), expected(rows, start=end, key="k1")) == expected(rows, start=end, key="k1")
+    assert client.get("/api/datalake/cache").json()["invalidations"] > 0
+
+
+def test_cache_sees_writes_of_other_processes(client, config, rows, upload, info, expected):
+    upload(client, rows[:150])
+    info(client, date="2023-01-02")
+    # Written without going through the api of this process, as another api process would
+    data = "key,entrytime,value\n" + "".join(f"{key},{timestamp.isoformat()},{value}\n" for key, timestamp, value in rows[150:])
+    lake_upload.ingest_files(config, [("rows.csv", io.BytesIO(data.encode()), "csv")])
+    assert _subset(info(client, date="2023-01-02"), expected(rows, date="2023-01-02")) == expected(rows, date="2023-01-02")
+
+
+def test_rollups_match_a_raw_scan(make_client, rows, upload, info, expected, wait_for_job):
+    client = make_client()
+    upload(client, rows, batches=3)
+    job = wait_for_job(client, client.post("/api/datalake/optimise").json())
+    assert job["result"]["partitions_rolled_up"] == 9
+    rolled_up = [info(client, **query) for query in ALIGNED_QUERIES]
+    scan_client = make_client(info_use_rollups=False, info_use_statistics=False)
+    for query, answer in zip(ALIGNED_QUERIES, rolled_up):
+        scanned = info(scan_client, **query)
+        assert _subset(answer, expected(rows, **query)) == expected(rows, **query)
+        assert answer["total_records"] == scanned["total_records"]
+        assert (answer["min_value"], answer["max_value"]) == (scanned["min_value"], scanned["max_value"])
+        assert answer["mean_value"] == pytest.approx(scanned["mean_value"])
@@ -0,0 +1,99 @@
+import csv
+import io
+import json
+import random
+import pytest
+from lib.apibuilder.exceptions import ValueValidationError
+from lib.datalake import ingest
+
+FIELDS = ["", "a", "1.5", "a,b", 'say "hi"', '"', "line\nbreak", "crlf\r\nbreak", "é ü ✓", " spaced ", ",\n\""]
+
+
+def _rows(file_type: str, data: bytes, chunk_size: int, buffer_size: int = 64) -> list:
+    parser = ingest.get_parser(file_type, buffer_size)
+    rows = []
+    for batch in ingest.read_batches(io.BytesIO(data), parser, chunk_size):
+        columns = list(batch)
+        rows.extend(dict(zip(columns, values)) for values in zip(*batch.values()))
+    assert parser.rows_read == len(rows)
+    return rows
+
+def _csv(records: list) -> bytes:
+    text = io.StringIO()
+    csv.writer(text).writerows(records)
+    return text.getvalue().encode()
+
+def _expected_csv(data: bytes) -> list:
+    header, *records = csv.reader(io.StringIO(data.decode("utf-8-sig"), newline=""))
+    return [dict(zip(header, record)) for record in records]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_csv_matches_csv_module_across_chunk_boundaries(seed):
+    generator = random.Random(seed)
+    records = [["key", "value", "text"]] + [[generator.choice(FIELDS) for _ in range(3)] for _ in range(50)]
+    data = _csv(records)
+    expected = _expected_csv(data)
+    for chunk_size in (1, 2, 3, 7, 64, len(data)):
+        assert _rows("csv", data, chunk_size) == expected
+
+
+def test_csv_bare_quotes_are_part_of_the_value():
+    data = b'key,value\nab"c,1\n"q""uoted",x"y"\nk,"multi\nline"\n'
+    for chunk_size in (1, 5, len(data)):
+        assert _rows("csv", data, chunk_size) == _expected_csv(data)
+
+
+def test_csv_byte_order_mark_is_dropped():
+    assert _rows("csv", b"\xef\xbb\xbfkey,value\nk,1\n", 1) == [{"key": "k", "value": "1"}]
+
+
+def test_csv_unterminated_quoted_field():
+    with pytest.raises(ValueValidationError):
+        _rows("csv", b'key,value\nk,"open\nrest\n', 4)
+
+
+def test_csv_wrong_number_of_fields():
+    with pytest.raises(ValueValidationError):
+        _rows("csv", b"key,value\nk,1,2\n", 1024)
+
+
+RECORDS = [
+    {"key": "k1", "entrytime": "2023-01-01T00:00:00", "value": 1},
+    {"key": "k2", "entrytime": "2023-01-01T01:00:00", "value": 2.5, "text": "a \"b\" ]},{ ✓"},
+    {"key": "k1", "entrytime": "2023-01-02T00:00:00", "nested": {"a": [1, 2]}},
+]
+# Columns first seen part way through are backfilled with None
+EXPECTED = [{"value": None, "text": None, "nested": None, **record} for record in RECORDS]
+
+
+@pytest.mark.parametrize("data", [
+    "".join(json.dumps(record) + "\n" for record in RECORDS).encode(),
+    json.dumps(RECORDS).encode(),
+    json.dumps(RECORDS, indent=2, ensure_ascii=False).encode(),
+    b"\n  " + json.dumps(RECORDS, separators=(",", ":")).encode() + b"\n",
+], ids=["ndjson", "array", "indented array", "compact array"])
+def test_json_across_chunk_boundaries(data):
+    for chunk_size in (1, 2, 3, 7, 64, len(data)):
+        rows = _rows("json", data, chunk_size, buffer_size=1024 * 1024)
+        assert rows == [{column: row.get(column) for column in EXPECTED[0]} for row in EXPECTED]
+
+
+@pytest.mark.parametrize("data", [
+    b'{"key": "k1"}\n{"key": \n',
+    b'[{"key": "k1"}, {"key": ]',
+    b'[{"key": "k1"} {"key": "k2"}]',
+    b'[{"key": "k1"}',
+    b'[{"key": "k1"}] []',
+    b'[1, 2]',
+    b'["a"]\n',
+    b'1\n',
+])
+def test_invalid_json(data):
+    for chunk_size in (1, len(data)):
+        with pytest.raises(ValueValidationError):
+            _rows("json", data, chunk_size)
+
+
+def test_empty_json_array():
+    assert _rows("json", b" [ ] ", 1) == []
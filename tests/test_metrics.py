@@ -0,0 +1,24 @@
+def _samples(client):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    samples = {}
+    for line in response.text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_metrics_are_labelled_by_route_and_operation(client, rows, upload, info):
+    before = _samples(client)
+    upload(client, rows)
+    info(client, key="k1")
+    info(client, key="k2")
+    after = _samples(client)
+    def increase(name):
+        return after.get(name, 0) - before.get(name, 0)
+    assert increase('http_request_duration_seconds_count{method="GET",route="/api/datalake/info",status="200"}') == 2
+    assert increase('http_request_duration_seconds_count{method="POST",route="/api/datalake/upload",status="200"}') == 1
+    assert increase('datalake_stage_duration_seconds_count{operation="ingest",stage="parse"}') >= 1
+    assert increase('datalake_written_rows_total{operation="ingest"}') == len(rows)
+    assert 'datalake_executor_pending_requests' in after
@@ -0,0 +1,81 @@
+import datetime
+import io
+import pytest
+from lib.datalake import catalog, retention, storage, upload as lake_upload
+
+BASE = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+HOUR = datetime.timedelta(hours=1)
+
+
+def _delete(client, **params):
+    params = {name: value.isoformat() if isinstance(value, datetime.datetime) else value for name, value in params.items()}
+    return client.request("DELETE", "/api/datalake/", params=params)
+
+def _remaining(rows, start=None, end=None, key=None):
+    return [
+        row for row in rows
+        if not ((start is None or row[1] >= start) and (end is None or row[1] < end) and (key is None or row[0] == key))
+    ]
+
+
+def test_delete_before_a_date(client, rows, upload, info, expected):
+    upload(client, rows, batches=2)
+    response = _delete(client, date="2023-01-02")
+    assert response.status_code == 200
+    assert response.json()["size_after"] < response.json()["size_before"]
+    remaining = _remaining(rows, end=BASE + 24 * HOUR)
+    assert info(client)["total_records"] == len(remaining)
+    assert info(client)["min_value"] == expected(remaining)["min_value"]
+
+
+@pytest.mark.parametrize("start, end, key", [
+    (BASE + 10 * HOUR + datetime.timedelta(minutes=30), BASE + 40 * HOUR + datetime.timedelta(minutes=15), None),
+    (BASE + 5 * HOUR, BASE + 7 * HOUR, "k1"),
+    (BASE + 24 * HOUR, BASE + 48 * HOUR, None),
+    (BASE + 50 * HOUR, None, None),
+])
+def test_delete_time_range_truncates_boundary_parts(client, config, rows, upload, info, expected, start, end, key):
+    upload(client, rows, batches=3)
+    params = {"start": start, "key": key, "end": end}
+    assert _delete(client, **{name: value for name, value in params.items() if value is not None}).status_code == 200
+    remaining = _remaining(rows, start, end, key)
+    dates = sorted({timestamp.date().isoformat() for _, timestamp, _ in remaining})
+    for query in [{}, {"key": "k1"}, *({"date": date} for date in dates)]:
+        answer = info(client, **query)
+        assert {field: answer[field] for field in expected(remaining, **query)} == expected(remaining, **query)
+    # Only whole days and truncated copies of the boundary parts are left in the catalog
+    with catalog.connect(config) as connection:
+        parts = catalog.find_parts(connection)
+    assert sum(part.rows for part in parts) == len(remaining)
+
+
+def test_invalid_delete_ranges(client, rows, upload):
+    upload(client, rows)
+    assert _delete(client, start=BASE + 5 * HOUR, end=BASE).status_code == 400
+    assert _delete(client, date="2023-01-02", end="2023-01-03").status_code == 400
+
+
+def test_delete_rewrites_parts_added_while_truncating(client, config, rows, upload, monkeypatch):
+    upload(client, rows)
+    start, end = BASE + 10 * HOUR, BASE + 14 * HOUR
+    late = [("k1", BASE + 12 * HOUR + datetime.timedelta(minutes=30), 1.0), ("k1", BASE + 20 * HOUR, 2.0)]
+    truncate_parts = storage.truncate_parts
+    calls = []
+    def upload_while_truncating(*args):
+        truncated = truncate_parts(*args)
+        if not calls:
+            data = "key,entrytime,value\n" + "".join(f"{key},{timestamp.isoformat()},{value}\n" for key, timestamp, value in late)
+            lake_upload.ingest_files(config, [("late.csv", io.BytesIO(data.encode()), "csv")])
+        calls.append(args)
+        return truncated
+    monkeypatch.setattr(storage, "truncate_parts", upload_while_truncating)
+    retention.delete_range(config, start, end)
+    # The first rewrite missed the late upload so it was discarded and done again
+    assert len(calls) == 2
+    with catalog.connect(config) as connection:
+        parts = catalog.find_parts(connection)
+        known = catalog.known_part_paths(connection)
+    assert sum(part.rows for part in parts) == len(_remaining(rows + late, start, end))
+    # The parts of the discarded rewrite were removed
+    on_disk = {path.relative_to(config.data_directory).as_posix() for path in storage.iter_partitions(config) for path in path.glob(f"{storage.PART_PREFIX}*")}
+    assert on_disk <= known
@@ -0,0 +1,51 @@
+from pathlib import Path
+from lib.datalake import storage
+
+
+def _upload(client, name, data):
+    return client.post("/api/datalake/upload", files=[("files", (name, data))])
+
+def _parts(config):
+    return sorted(Path(config.data_directory).glob(f"date=*/key=*/{storage.PART_PREFIX}*"))
+
+
+def test_schema_is_inferred_and_widened(client):
+    assert _upload(client, "a.csv", b"key,entrytime,value\nk,2023-01-01T00:00:00,1\n").status_code == 200
+    assert client.get("/api/datalake/schema").json()["columns"] == {"key": "string", "entrytime": "timestamp", "value": "int64"}
+    assert _upload(client, "b.json", b'{"key": "k", "entrytime": "2023-01-01T01:00:00", "value": 2.5}\n').status_code == 200
+    assert client.get("/api/datalake/schema").json()["columns"]["value"] == "float64"
+    answer = client.get("/api/datalake/info", params={"column": "value"}).json()
+    assert (answer["min_value"], answer["max_value"], answer["total_records"]) == (1, 2.5, 2)
+
+
+def test_mixed_files_of_one_upload_widen_the_schema(client):
+    response = client.post("/api/datalake/upload", files=[
+        ("files", ("a.csv", b"key,entrytime,value\nk,2023-01-01T00:00:00,1\n")),
+        ("files", ("b.csv", b"key,entrytime,value\nk,2023-01-01T00:00:00,1.5\n")),
+    ])
+    assert response.status_code == 200
+    assert client.get("/api/datalake/schema").json()["columns"]["value"] == "float64"
+
+
+def test_new_columns_and_type_conflicts_are_rejected(client, config):
+    assert _upload(client, "a.csv", b"key,entrytime,value\nk,2023-01-01T00:00:00,1.5\n").status_code == 200
+    schema = client.get("/api/datalake/schema").json()
+    parts = _parts(config)
+    assert _upload(client, "b.csv", b"key,entrytime,value,extra\nk,2023-01-01T00:00:00,1,x\n").status_code == 400
+    assert _upload(client, "c.csv", b"key,entrytime,value\nk,2023-01-01T00:00:00,abc\n").status_code == 400
+    # Failed uploads change neither the schema nor the parts
+    assert client.get("/api/datalake/schema").json() == schema
+    assert _parts(config) == parts
+
+
+def test_new_columns_are_added_when_allowed(make_client):
+    client = make_client(schema_allow_new_columns=True)
+    assert _upload(client, "a.csv", b"key,entrytime,value\nk,2023-01-01T00:00:00,1\n").status_code == 200
+    assert _upload(client, "b.csv", b"key,entrytime,value,extra\nk,2023-01-01T00:00:00,1,x\n").status_code == 200
+    assert client.get("/api/datalake/schema").json()["columns"]["extra"] == "string"
+
+
+def test_invalid_uploads(client):
+    assert _upload(client, "a.txt", b"x").status_code == 400
+    assert _upload(client, "a.csv", b"key,entrytime,value\nk,2023-01-01T00:00:00,\xff\n").status_code == 400
+    assert _upload(client, "a.json", b'{"key": "k"').status_code == 400
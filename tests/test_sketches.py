@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from lib.datalake import sketches
+
+QUANTILES = (0.0, 0.01, 0.25, 0.5, 0.95, 0.99, 1.0)
+
+
+def _data(name: str) -> np.ndarray:
+    generator = np.random.default_rng(0)
+    if name == "lognormal": return generator.lognormal(0, 3, 100000)
+    if name == "normal": return generator.normal(0, 100, 100000)
+    if name == "integers": return generator.integers(-1000, 1000, 100000).astype(np.float64)
+    raise ValueError(name)
+
+def _exact(values: np.ndarray, q: float) -> float:
+    values = np.sort(values)
+    return values[int(q * (len(values) - 1))]
+
+
+@pytest.mark.parametrize("name", ["lognormal", "normal", "integers"])
+def test_quantiles_within_relative_accuracy(name):
+    values = _data(name)
+    sketch = sketches.QuantileSketch().add_array(values)
+    for q in QUANTILES:
+        exact = _exact(values, q)
+        assert abs(sketch.quantile(q) - exact) <= sketches.RELATIVE_ACCURACY * abs(exact)
+
+
+def test_quantiles_of_merged_sketches_within_relative_accuracy():
+    values = _data("lognormal")
+    sketch = sketches.QuantileSketch()
+    for part in np.array_split(values, 100):
+        sketch.merge(sketches.QuantileSketch.from_dict(sketches.QuantileSketch().add_array(part).to_dict()))
+    assert sketch.count == len(values)
+    for q in QUANTILES:
+        exact = _exact(values, q)
+        assert abs(sketch.quantile(q) - exact) <= sketches.RELATIVE_ACCURACY * abs(exact)
+
+
+def test_quantile_of_empty_sketch():
+    assert sketches.QuantileSketch().add_array(np.array([np.nan, np.inf])).quantile(0.5) is None
+
+
+@pytest.mark.parametrize("distinct", [10, 1000, 100000])
+def test_distinct_count_within_bound(distinct):
+    # Three standard errors of the estimate
+    bound = 3 * 1.04 / 2 ** (sketches.HLL_PRECISION / 2)
+    values = np.random.default_rng(0).permutation(np.tile(np.arange(distinct, dtype=np.float64) * 0.5, 3))
+    sketch = sketches.HyperLogLog()
+    for part in np.array_split(values, 10):
+        sketch.merge(sketches.HyperLogLog.from_dict(sketches.HyperLogLog().add_array(part).to_dict()))
+    assert abs(sketch.estimate() - distinct) <= bound * distinct
@@ -0,0 +1,62 @@
+import datetime
+import random
+import numpy as np
+import pytest
+from lib.datalake import columns, storage
+
+BASE = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+ENCODINGS = [
+    ("count", columns.INT64, "plain"), ("count", columns.INT64, "delta"), ("count", columns.INT64, "rle"),
+    ("entrytime", columns.TIMESTAMP, "plain"), ("entrytime", columns.TIMESTAMP, "delta"), ("entrytime", columns.TIMESTAMP, "rle"),
+    ("value", columns.FLOAT64, "plain"), ("value", columns.FLOAT64, "rle"),
+    ("name", columns.STRING, "plain"), ("name", columns.STRING, "dictionary"), ("name", columns.STRING, "rle"),
+]
+
+
+@pytest.fixture
+def data():
+    generator = random.Random(0)
+    raw = {
+        "entrytime": [(BASE + datetime.timedelta(seconds=generator.randrange(0, 86400))).isoformat() for _ in range(500)],
+        "count": [generator.choice([-3, 0, 7, 2 ** 40]) for _ in range(500)],
+        "value": [round(generator.uniform(-50, 50), 2) for _ in range(500)],
+        "name": [generator.choice(["a", "bb", "ççç", ""]) for _ in range(500)],
+    }
+    types = {"entrytime": columns.TIMESTAMP, "count": columns.INT64, "value": columns.FLOAT64, "name": columns.STRING}
+    return {name: (types[name], columns.convert(types[name], values)) for name, values in raw.items()}
+
+
+def _read(part, column):
+    if part.column_type(column) == columns.STRING:
+        return list(part.read_column(column))
+    return part.map_column(column).tolist()
+
+
+@pytest.mark.parametrize("codec", [None, "zlib", "gzip", "lzma", "bz2"])
+@pytest.mark.parametrize("column, column_type, encoding", ENCODINGS)
+def test_column_round_trips(tmp_path, data, codec, column, column_type, encoding):
+    spec = f"{encoding}+{codec or 'none'}"
+    info = storage.write_part(tmp_path, "2023-01-01", "k", data, "zlib", sort_column="entrytime", column_codecs={column: columns.parse_codec(spec)})
+    expected = storage.sort_rows(data, "entrytime")
+    for part in (storage.Part(tmp_path / info.path), storage.Part.from_info(tmp_path, info)):
+        assert part.columns[column].get("encoding", columns.PLAIN) == encoding
+        assert part.columns[column].get("codec") == codec
+        for name in data:
+            assert _read(part, name) == list(expected[name][1])
+
+
+@pytest.mark.parametrize("compress_numeric", [False, True])
+def test_default_codecs_round_trip(tmp_path, data, compress_numeric):
+    info = storage.write_part(tmp_path, "2023-01-01", "k", data, "lzma", 1, compress_numeric, sort_column="entrytime", block_rows=64, sync=True)
+    part = storage.Part(tmp_path / info.path)
+    assert (part.columns["value"].get("codec") == "lzma") == compress_numeric
+    assert part.columns["name"]["codec"] == "lzma"
+    # Plain uncompressed numeric columns are memory mapped
+    assert isinstance(part.map_column("value"), np.memmap) != compress_numeric
+    expected = storage.sort_rows(data, "entrytime")
+    assert {name: (column_type, list(values)) for name, (column_type, values) in part.read().items()} == {
+        name: (column_type, list(values)) for name, (column_type, values) in expected.items()
+    }
+    timestamps = part.map_column("entrytime")
+    assert np.all(np.diff(timestamps) >= 0)
+    assert len(part.block_index("entrytime")) == 8